@@ -1,7 +1,12 @@
 
-from habittracker import database, model
+import datetime
+
+import itertools
+
+from habittracker import bitmaps, cache, database, model, schedules
 from typing import List
 
+@cache.cached
 def all_habits_information(db) -> List[model.Habit]:
    """
     Collect all habit information from the database.
@@ -13,11 +18,11 @@ def all_habits_information(db) -> List[model.Habit]:
     List[model.Habit]: A list of all habit information in the database.
     """
    cur = db.cursor()
-   cur.execute("SELECT * FROM habitbase")
+   cur.execute(database.HABIT_SELECT)
    results = cur.fetchall()
    all_data = []
    for result in results:
-      all_data.append(model.Habit(*result))
+      all_data.append(database.habit_from_row(result))
    return all_data
 
 def all_habits_log(db) -> List[model.LogEntry]:
@@ -36,6 +41,7 @@ def all_habits_log(db) -> List[model.LogEntry]:
    logs = [model.LogEntry(*row) for row in results]
    return logs
 
+@cache.cached
 def max_streak_all_habits(db) -> List[model.LogEntry]:
    """
     Collect the log entries with the maximum streak from the database.
@@ -47,7 +53,8 @@ def max_streak_all_habits(db) -> List[model.LogEntry]:
     List[model.LogEntry]: A list of log entries with the maximum streak in the database.
     """
    cur = db.cursor()
-   cur.execute("SELECT * FROM habitlog WHERE max_streak = (SELECT MAX(max_streak) FROM habitlog)")
+   cur.execute("""SELECT l.* FROM habitlog l JOIN habitbase b ON b.habit = l.habit
+      WHERE b.id IN (SELECT habit_id FROM habit_stats WHERE max_streak = (SELECT MAX(max_streak) FROM habit_stats))""")
    results = cur.fetchall()
    logs = [model.LogEntry(*row) for row in results]
    return logs
@@ -69,6 +76,7 @@ def max_streak_given_habit(db, habit) -> List[model.LogEntry]:
    logs = [model.LogEntry(*row) for row in results]
    return logs
 
+@cache.cached
 def habit_custom_perdiodicity_information(db, periodicity) -> List[model.Habit]:
    """
     Collect habit information from the database with a specific periodicity.
@@ -81,9 +89,321 @@ def habit_custom_perdiodicity_information(db, periodicity) -> List[model.Habit]:
     List[model.Habit]: A list of habit information with the specified periodicity in the database.
     """
    cur = db.cursor()
-   cur.execute("SELECT * FROM habitbase WHERE periodicity = ?", (periodicity,))
+   cur.execute(database.HABIT_SELECT + " WHERE b.periodicity_id = (SELECT id FROM periodicities WHERE label = ?)", (periodicity,))
    results = cur.fetchall()
    periodicitys = []
    for result in results:
-      periodicitys.append(model.Habit(*result))
-   return periodicitys
\ No newline at end of file
+      periodicitys.append(database.habit_from_row(result))
+   return periodicitys
+
+
+STATS_COLUMNS = "b.habit, p.label, s.completions, s.resets, s.streak, s.max_streak, s.last_completed, s.started"
+
+STATS_FROM = "habit_stats s JOIN habitbase b ON b.id = s.habit_id LEFT JOIN periodicities p ON p.id = s.periodicity_id"
+
+def habit_stats(db, habit) -> model.HabitStats:
+   """
+    Look up the materialized statistics of a single habit.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+    habit (str): The habit to look up.
+
+    Returns:
+    model.HabitStats: The statistics of the habit, or None if the habit does not exist.
+    """
+   cur = db.cursor()
+   cur.execute(f"SELECT {STATS_COLUMNS} FROM {STATS_FROM} WHERE b.habit = ?", (habit,))
+   result = cur.fetchone()
+   return model.HabitStats(*result) if result is not None else None
+
+@cache.cached
+def all_habit_stats(db) -> List[model.HabitStats]:
+   """
+    Collect the materialized statistics of all habits.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+
+    Returns:
+    List[model.HabitStats]: The statistics of all habits, ordered by habit name.
+    """
+   cur = db.cursor()
+   cur.execute(f"SELECT {STATS_COLUMNS} FROM {STATS_FROM} ORDER BY b.habit")
+   return [model.HabitStats(*row) for row in cur.fetchall()]
+
+@cache.cached
+def periodicity_stats(db) -> List[model.PeriodicityStats]:
+   """
+    Collect the aggregated statistics per periodicity.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+
+    Returns:
+    List[model.PeriodicityStats]: One aggregate for every periodicity that currently has habits.
+    """
+   cur = db.cursor()
+   cur.execute("""SELECT p.label, s.habits, s.completions, s.resets FROM periodicity_stats s JOIN periodicities p ON p.id = s.periodicity_id
+      WHERE s.habits > 0 ORDER BY p.label""")
+   return [model.PeriodicityStats(*row) for row in cur.fetchall()]
+
+LEADERBOARD_ORDER = {
+   "max_streak": "s.max_streak DESC, s.habit_id",
+   "streak": "s.streak DESC, s.habit_id",
+   "completion_rate": "completion_rate DESC, s.habit_id",
+}
+
+COMPLETION_RATE = """MIN(1.0, s.completions * 1.0 / expected_checkoffs(p.label, s.started, ?))"""
+
+@cache.cached
+def leaderboard(db, by="max_streak", k=10, periodicity=None, offset=0, today=None) -> List[model.HabitStats]:
+   """
+    Collect one page of the habits ranked by their longest streak, current streak or completion rate.
+
+    Rankings by streak are read straight from the ordered indexes on 'habit_stats', so a page costs O(offset + k)
+    regardless of the number of habits. The completion rate depends on the current day and is ranked with a bounded sort.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+    by (str): The ranking, one of 'max_streak', 'streak' or 'completion_rate'. Defaults to 'max_streak'.
+    k (int): The page size. Defaults to 10.
+    periodicity (str, optional): Only rank habits with this periodicity. Defaults to None.
+    offset (int): The number of ranked habits to skip. Defaults to 0.
+    today (datetime.date, optional): The day the completion rate is computed for. Defaults to today.
+
+    Returns:
+    List[model.HabitStats]: The ranked statistics, ties broken by habit id, the order the habits were added in.
+
+    Raises:
+    ValueError: If the ranking is unknown.
+    """
+   if by not in LEADERBOARD_ORDER:
+      raise ValueError(f"Unknown ranking '{by}', expected one of {', '.join(LEADERBOARD_ORDER)}")
+   today = today if today is not None else datetime.date.today()
+   where = "WHERE s.periodicity_id = (SELECT id FROM periodicities WHERE label = ?)" if periodicity is not None else ""
+   params = [today.toordinal()] + ([periodicity] if periodicity is not None else []) + [k, offset]
+   cur = db.cursor()
+   cur.execute(f"SELECT {STATS_COLUMNS}, {COMPLETION_RATE} AS completion_rate FROM {STATS_FROM} {where} ORDER BY {LEADERBOARD_ORDER[by]} LIMIT ? OFFSET ?", params)
+   return [model.HabitStats(*row) for row in cur.fetchall()]
+
+ROLLING_WINDOWS = (7, 30, 90)
+
+class HabitSeries:
+   """
+    The completion history of one habit, bucketed into the periods of its schedule and precomputed for O(1) window queries.
+
+    A period counts as completed once it holds as many check-offs as the schedule's target.
+
+    Attributes:
+    schedule (schedules.Schedule): The schedule of the habit's periodicity.
+    anchor (int): The day number the periods of an anchored schedule are counted from.
+    origin (int): The day number the first period starts on.
+    end (int): The day number the last period ends on.
+    first_index (int): The period index of the first period.
+    prefix (List[int]): prefix[i] is the number of completed periods before period i.
+    next_hit (List[int]): next_hit[i] is the first completed period at or after period i.
+    prev_hit (List[int]): prev_hit[i] is the last completed period at or before period i, or -1.
+    gap_table (List[List[int]]): A sparse table of the missed periods between consecutive completed periods.
+    """
+   def __init__(self, periodicity, started, days, today):
+      self.schedule = schedules.parse(periodicity)
+      self.anchor = started if started is not None else min(days[:1] + [today])
+      first_day = min([self.anchor] + days[:1])
+      self.origin = self.schedule.window(first_day, self.anchor)[0]
+      self.end = self.schedule.window(today, self.anchor)[1]
+      self.first_index = self.schedule.period_index(first_day, self.anchor)
+      count = self.schedule.period_index(today, self.anchor) - self.first_index + 1
+      checkoffs = [0] * count
+      for day in days:
+         checkoffs[self._index(day)] += 1
+      hits = [1 if checkoff >= self.schedule.target else 0 for checkoff in checkoffs]
+      self.prefix = [0, *itertools.accumulate(hits)]
+      self.next_hit = [count] * (count + 1)
+      for i in range(count - 1, -1, -1):
+         self.next_hit[i] = i if hits[i] else self.next_hit[i + 1]
+      self.prev_hit = [-1] * count
+      for i in range(count):
+         self.prev_hit[i] = i if hits[i] else self.prev_hit[i - 1] if i > 0 else -1
+      completed = [i for i, hit in enumerate(hits) if hit]
+      gaps = [b - a - 1 for a, b in zip(completed, completed[1:])]
+      self.gap_table = [gaps]
+      width = 1
+      while 2 * width <= len(gaps):
+         level = self.gap_table[-1]
+         self.gap_table.append([max(level[i], level[i + width]) for i in range(len(level) - width)])
+         width *= 2
+
+   def _index(self, day):
+      """Return the position of the period containing a day in the precomputed lists."""
+      return self.schedule.period_index(day, self.anchor) - self.first_index
+
+   def _days(self, periods):
+      """Convert a number of periods into days, using the average period length of the schedule."""
+      return round(periods * self.schedule.days)
+
+   def _max_gap(self, first, last):
+      """Return the largest entry of the gap list between the indexes first and last (inclusive)."""
+      level = (last - first + 1).bit_length() - 1
+      return max(self.gap_table[level][first], self.gap_table[level][last - (1 << level) + 1])
+
+   def window(self, start, end):
+      """
+    Compute the statistics of the periods overlapping the days start to end (inclusive) in O(1).
+
+    Parameters:
+    start (int): The first day number of the window.
+    end (int): The last day number of the window.
+
+    Returns:
+    tuple: The number of periods, completed periods, the summed days between the first and last check-off,
+    the number of gaps between check-offs and the longest stretch of days without a check-off.
+    """
+      start = max(start, self.origin)
+      end = min(end, self.end)
+      if start > end:
+         return 0, 0, 0, 0, 0
+      a = self._index(start)
+      b = self._index(end)
+      periods = b - a + 1
+      completed = self.prefix[b + 1] - self.prefix[a]
+      if completed == 0:
+         return periods, 0, 0, 0, self._days(periods)
+      first, last = self.next_hit[a], self.prev_hit[b]
+      longest = max(first - a, b - last)
+      if completed > 1:
+         longest = max(longest, self._max_gap(self.prefix[first], self.prefix[last] - 1))
+      return periods, completed, self._days(last - first), completed - 1, self._days(longest)
+
+class CompletionIndex:
+   """
+    Day-bucketed prefix sums over the completion history of all habits.
+
+    The history of every habit is read in a single ordered query, merged with its archived check-offs and bucketed in
+    one pass. Afterwards every window query costs O(1) per habit, so a report over all habits is linear in the number
+    of habits and independent of the length of their history.
+
+    Attributes:
+    today (int): The day number the index was built for. Windows are clipped to it.
+    habits (dict): The HabitSeries of every habit, keyed by habit name.
+    """
+   def __init__(self, db, today=None):
+      today = today if today is not None else datetime.date.today()
+      self.today = today.toordinal()
+      self.habits = {}
+      cur = db.cursor()
+      cur.execute("""SELECT b.habit, p.label, s.started, h.day FROM habit_stats s JOIN habitbase b ON b.id = s.habit_id
+         JOIN periodicities p ON p.id = s.periodicity_id
+         LEFT JOIN habit_history h ON h.habit_id = s.habit_id AND h.event = 'completed' AND h.day <= ?
+         ORDER BY s.habit_id, h.day""", (self.today,))
+      archived = database.archived_days(db, end=self.today)
+      for habit, rows in itertools.groupby(cur.fetchall(), key=lambda row: row[0]):
+         rows = list(rows)
+         days = [row[3] for row in rows if row[3] is not None]
+         if habit in archived:
+            days = sorted(archived[habit] + days)
+         self.habits[habit] = HabitSeries(rows[0][1], rows[0][2], days, self.today)
+
+   def habit_window(self, habit, start, end) -> model.WindowStats:
+      """
+    Compute the consistency of one habit between two dates.
+
+    Parameters:
+    habit (str): The habit to analyze.
+    start (datetime.date): The first day of the window.
+    end (datetime.date): The last day of the window.
+
+    Returns:
+    model.WindowStats: The statistics of the habit, including the rolling 7, 30 and 90 day completion rates up to the end of the window.
+    """
+      series = self.habits[habit]
+      first, last = start.toordinal(), end.toordinal()
+      periods, completed, gap_days, gaps, longest = series.window(first, last)
+      rolling = {}
+      for days in ROLLING_WINDOWS:
+         rolling_periods, rolling_completed, *_ = series.window(last - days + 1, last)
+         rolling[days] = rolling_completed / rolling_periods if rolling_periods > 0 else None
+      return model.WindowStats(habit, periods, completed, gap_days / gaps if gaps > 0 else None, longest, rolling)
+
+   def window_report(self, start, end) -> List[model.WindowStats]:
+      """
+    Compute the consistency of every habit and of all habits together between two dates.
+
+    Parameters:
+    start (datetime.date): The first day of the window.
+    end (datetime.date): The last day of the window.
+
+    Returns:
+    List[model.WindowStats]: The statistics of every habit ordered by name, followed by the aggregate of all habits (habit None).
+    """
+      report = [self.habit_window(habit, start, end) for habit in sorted(self.habits)]
+      first, last = start.toordinal(), end.toordinal()
+      totals = [0, 0, 0, 0, 0]
+      for series in self.habits.values():
+         periods, completed, gap_days, gaps, longest = series.window(first, last)
+         totals = [totals[0] + periods, totals[1] + completed, totals[2] + gap_days, totals[3] + gaps, max(totals[4], longest)]
+      rolling = {}
+      for days in ROLLING_WINDOWS:
+         windows = [series.window(last - days + 1, last) for series in self.habits.values()]
+         rolling_periods = sum(window[0] for window in windows)
+         rolling[days] = sum(window[1] for window in windows) / rolling_periods if rolling_periods > 0 else None
+      report.append(model.WindowStats(None, totals[0], totals[1], totals[2] / totals[3] if totals[3] > 0 else None, totals[4], rolling))
+      return report
+
+def completion_calendar(db, year, habit=None) -> dict:
+   """
+    Count the check-offs per day of a year from the cached monthly completion bitmaps.
+
+    Every habit contributes at most twelve integers per year, and the days are read from their set bits, so the cost
+    does not depend on the size of the habit history.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+    year (int): The year to count.
+    habit (str, optional): Only count this habit. Defaults to all habits.
+
+    Returns:
+    dict: The number of habits checked off on each day, keyed by datetime.date. Days without check-offs are left out.
+    """
+   cur = db.cursor()
+   query = "SELECT month, bits FROM habit_calendar WHERE month BETWEEN ? AND ?"
+   params = [year * 12, year * 12 + 11]
+   if habit is not None:
+      query += " AND habit_id = (SELECT id FROM habitbase WHERE habit = ?)"
+      params.append(habit)
+   cur.execute(query, params)
+   counts = {}
+   for month, bits in cur.fetchall():
+      first = datetime.date(year, month % 12 + 1, 1).toordinal()
+      while bits:
+         lowest = bits & -bits
+         day = datetime.date.fromordinal(first + lowest.bit_length() - 1)
+         counts[day] = counts.get(day, 0) + 1
+         bits ^= lowest
+   return counts
+
+def habit_overlap(db, habits=None, periodicity=None, start=None, end=None) -> model.Overlap:
+   """
+    Count the days a group of habits was checked off together, from the compressed completion bitmaps.
+
+    The bitmaps are intersected and united container by container, so thousands of habits with years of history
+    are compared without reading the habit history.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+    habits (List[str], optional): The habits to compare. Defaults to all habits, or all habits of the periodicity.
+    periodicity (str, optional): Compare the habits of this periodicity, if no habits are given.
+    start (datetime.date, optional): The first day to count. Defaults to the beginning.
+    end (datetime.date, optional): The last day to count. Defaults to the end.
+
+    Returns:
+    model.Overlap: The days with check-offs of all and of any of the habits.
+    """
+   if habits is None:
+      habits = [habit.habit for habit in (database.certain_periodicity(db, periodicity) if periodicity is not None else database.all_habits(db))]
+   loaded = list(database.completion_bitmaps(db, habits).values())
+   together, anything = bitmaps.intersect(loaded), bitmaps.union(loaded)
+   if start is not None or end is not None:
+      window = bitmaps.DayBitmap.from_range(start.toordinal() if start is not None else 1, end.toordinal() if end is not None else datetime.date.max.toordinal())
+      together, anything = together & window, anything & window
+   return model.Overlap(sorted(habits), len(together), len(anything), together.last())
@@ -0,0 +1,198 @@
+"""
+    Compressed bitmaps over day numbers, in the style of roaring bitmaps.
+
+    The day numbers are split into containers of 65536 days by their high bits. In memory every container is a
+    Python integer used as a bit set, so AND, OR and popcount of two containers are single operations on machine
+    words. On disk every container is stored in the smallest of three layouts: a sorted array of its days, a list of
+    runs of consecutive days, or the bit set trimmed to the bytes between its first and last day. A habit lives for a
+    few years of one container at most, so the trimmed bit set is usually both the smallest and the fastest to load.
+"""
+import struct
+
+CONTAINER_BITS = 16
+
+ARRAY, RUNS, BITSET = 0, 1, 2
+
+_HEADER = struct.Struct("<IBI")
+
+
+def _positions(bits):
+    """Yield the positions of the set bits of an integer, lowest first."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class DayBitmap:
+    """
+    A set of day numbers stored as a compressed bitmap.
+
+    Attributes:
+        containers (dict): The bit set of every container, keyed by the high bits of its days. Empty containers are dropped.
+
+    """
+    def __init__(self, days=()):
+        self.containers = {}
+        for day in days:
+            self.add(day)
+
+    @classmethod
+    def from_range(cls, start, end):
+        """
+        Build the bitmap of all days from start to end, both included.
+
+        Args:
+            start (int): The first day number.
+            end (int): The last day number.
+
+        Returns:
+            DayBitmap: The bitmap.
+        """
+        bitmap = cls()
+        for high in range(start >> CONTAINER_BITS, (end >> CONTAINER_BITS) + 1):
+            low = max(start - (high << CONTAINER_BITS), 0)
+            top = min(end - (high << CONTAINER_BITS), 0xFFFF)
+            bitmap.containers[high] = ((1 << (top - low + 1)) - 1) << low
+        return bitmap
+
+    def add(self, day):
+        """Add a day number to the set."""
+        high, low = day >> CONTAINER_BITS, day & 0xFFFF
+        self.containers[high] = self.containers.get(high, 0) | 1 << low
+
+    def __contains__(self, day):
+        return self.containers.get(day >> CONTAINER_BITS, 0) >> (day & 0xFFFF) & 1 == 1
+
+    def __and__(self, other):
+        result = DayBitmap()
+        for high in self.containers.keys() & other.containers.keys():
+            bits = self.containers[high] & other.containers[high]
+            if bits:
+                result.containers[high] = bits
+        return result
+
+    def __or__(self, other):
+        result = DayBitmap()
+        result.containers = dict(self.containers)
+        for high, bits in other.containers.items():
+            result.containers[high] = result.containers.get(high, 0) | bits
+        return result
+
+    def __len__(self):
+        return sum(bits.bit_count() for bits in self.containers.values())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            for low in _positions(self.containers[high]):
+                yield high << CONTAINER_BITS | low
+
+    def __eq__(self, other):
+        return isinstance(other, DayBitmap) and self.containers == other.containers
+
+    def last(self):
+        """Return the highest day number of the set, or None if it is empty."""
+        if not self.containers:
+            return None
+        high = max(self.containers)
+        return high << CONTAINER_BITS | self.containers[high].bit_length() - 1
+
+    def __repr__(self) -> str:
+        return f"DayBitmap({len(self)} days)"
+
+    def to_bytes(self):
+        """
+        Serialize the bitmap, choosing the smallest layout for every container.
+
+        Returns:
+            bytes: The serialized bitmap.
+        """
+        parts = []
+        for high in sorted(self.containers):
+            bits = self.containers[high]
+            cardinality = bits.bit_count()
+            starts = bits & ~(bits << 1)
+            ends = bits & ~(bits >> 1)
+            runs = starts.bit_count()
+            first_byte = ((bits & -bits).bit_length() - 1) // 8
+            span = (bits.bit_length() + 7) // 8 - first_byte
+            if 4 * runs < min(2 * cardinality, span):
+                pairs = [value for start, end in zip(_positions(starts), _positions(ends)) for value in (start, end - start)]
+                parts.append(_HEADER.pack(high, RUNS, runs) + struct.pack(f"<{2 * runs}H", *pairs))
+            elif 2 * cardinality < span:
+                parts.append(_HEADER.pack(high, ARRAY, cardinality) + struct.pack(f"<{cardinality}H", *_positions(bits)))
+            else:
+                parts.append(_HEADER.pack(high, BITSET, span) + struct.pack("<H", first_byte) + (bits >> 8 * first_byte).to_bytes(span, "little"))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Deserialize a bitmap written by to_bytes.
+
+        Args:
+            data (bytes): The serialized bitmap, or None for an empty bitmap.
+
+        Returns:
+            DayBitmap: The bitmap.
+        """
+        bitmap = cls()
+        offset = 0
+        data = data or b""
+        while offset < len(data):
+            high, layout, count = _HEADER.unpack_from(data, offset)
+            offset += _HEADER.size
+            if layout == BITSET:
+                first_byte, = struct.unpack_from("<H", data, offset)
+                bits = int.from_bytes(data[offset + 2:offset + 2 + count], "little") << 8 * first_byte
+                offset += 2 + count
+            elif layout == ARRAY:
+                bits = 0
+                for low in struct.unpack_from(f"<{count}H", data, offset):
+                    bits |= 1 << low
+                offset += 2 * count
+            else:
+                values = struct.unpack_from(f"<{2 * count}H", data, offset)
+                bits = 0
+                for start, length in zip(values[::2], values[1::2]):
+                    bits |= ((1 << (length + 1)) - 1) << start
+                offset += 4 * count
+            bitmap.containers[high] = bits
+        return bitmap
+
+
+def intersect(bitmaps):
+    """
+    Intersect several bitmaps, starting with the smallest so the intermediate results stay small.
+
+    Args:
+        bitmaps (iterable): The bitmaps.
+
+    Returns:
+        DayBitmap: The days contained in every bitmap, empty if no bitmap is given.
+    """
+    bitmaps = sorted(bitmaps, key=len)
+    if not bitmaps:
+        return DayBitmap()
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        result = result & bitmap
+        if not result.containers:
+            break
+    return result
+
+
+def union(bitmaps):
+    """
+    Unite several bitmaps.
+
+    Args:
+        bitmaps (iterable): The bitmaps.
+
+    Returns:
+        DayBitmap: The days contained in any of the bitmaps.
+    """
+    result = DayBitmap()
+    for bitmap in bitmaps:
+        result = result | bitmap
+    return result
@@ -0,0 +1,142 @@
+"""
+    A cache in front of the analytics queries, for dashboards that poll them.
+
+    The results are keyed by the query, its arguments and the version of the database file: SQLite's 'data_version'
+    pragma of a connection that only reads, which changes whenever any connection commits, and the identity of the
+    file, which changes when it is replaced. A result therefore never outlives a change of the data. As some queries
+    depend on the current day as well, a result is fresh for a few seconds only; after that it is still served for a
+    while, but the first reader to see it revalidates it (stale-while-revalidate).
+
+    Identical queries that miss the cache at the same time share one execution (single flight): the first reader runs
+    the query and the others wait for its result instead of running the same query again.
+
+    A result stored for a new version of a database file replaces the results of its older versions, which can never
+    be served again, and the oldest results are dropped once the cache holds too many.
+"""
+import functools
+import os
+import sqlite3
+import threading
+import time
+
+
+class _Flight:
+    """A query being run, which the readers asking for the same result wait for."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    """
+    Cache the results of queries per database file and share the execution of identical queries.
+
+    Attributes:
+        ttl (float): The seconds a result is fresh.
+        stale (float): The seconds after that a result is still served while one reader revalidates it.
+        clock (callable): Returns the current time in seconds.
+        max_entries (int): The number of results kept at most.
+        entries (dict): The version of the database, the time and the result of every query, keyed by the database
+            file, the name of the query and its arguments, from the oldest to the newest.
+
+    """
+    def __init__(self, ttl=5.0, stale=30.0, clock=time.monotonic, max_entries=1024):
+        self.ttl = ttl
+        self.stale = stale
+        self.clock = clock
+        self.max_entries = max(1, max_entries)
+        self.entries = {}
+        self._flights = {}
+        self._probes = {}
+        self._lock = threading.Lock()
+
+    def version(self, path):
+        """Return the version of a database file, which changes with every commit to it and when it is replaced."""
+        stat = os.stat(path)
+        identity = (stat.st_dev, stat.st_ino)
+        with self._lock:
+            probe = self._probes.get(path)
+            if probe is None or probe[0] != identity:
+                if probe is not None:
+                    probe[1].close()
+                probe = self._probes[path] = (identity, sqlite3.connect(path, check_same_thread=False))
+            return identity, probe[1].execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, db, query, *args, **kwargs):
+        """
+        Return the result of a query, from the cache if the database did not change since it was run.
+
+        Args:
+            db (sqlite3.Connection): A connection to the database, which runs the query on a miss.
+            query (callable): The query, called with the connection and the arguments.
+            *args: The arguments of the query.
+            **kwargs: The keyword arguments of the query.
+
+        Returns:
+            The result of the query. It is shared by all readers, so it must not be changed.
+        """
+        path = db.execute("PRAGMA database_list").fetchone()[2]
+        if not path:
+            return query(db, *args, **kwargs)
+        version = self.version(path)
+        key = (path, query.__qualname__, args, tuple(sorted(kwargs.items())))
+        now = self.clock()
+        with self._lock:
+            entry = self.entries.get(key)
+            current = entry is not None and entry[0] == version
+            if current and now - entry[1] < self.ttl:
+                return entry[2]
+            flight = self._flights.get(key)
+            if flight is not None and current and now - entry[1] < self.ttl + self.stale:
+                return entry[2]
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = query(db, *args, **kwargs)
+            with self._lock:
+                self._store(key, version, now, flight.value)
+            return flight.value
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _store(self, key, version, now, value):
+        # Called with the lock held. The results of other versions of the file are outdated, so they go first.
+        outdated = [other for other, entry in self.entries.items() if other[0] == key[0] and entry[0] != version]
+        for other in outdated:
+            del self.entries[other]
+        self.entries.pop(key, None)
+        self.entries[key] = (version, now, value)
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def clear(self):
+        """Forget all results and close the connections that read the versions."""
+        with self._lock:
+            self.entries = {}
+            for _, probe in self._probes.values():
+                probe.close()
+            self._probes = {}
+
+
+QUERY_CACHE = QueryCache()
+
+
+def cached(query):
+    """Serve a query, called with a connection and its arguments, through the shared query cache."""
+    @functools.wraps(query)
+    def wrapper(db, *args, **kwargs):
+        return QUERY_CACHE.get(db, query, *args, **kwargs)
+    wrapper.uncached = query
+    return wrapper
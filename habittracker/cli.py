@@ -1,18 +1,26 @@
 
-from typing import Optional
+from typing import List, Optional
 
-from habittracker import __app_name__, __version__, database, model, get, analytics
+from habittracker import __app_name__, __version__, database, model, get, analytics, schedules, scheduler, timezones, sync, search, writes
+
+import asyncio
+
+import functools
 
 import questionary
 
 import datetime
 
 import typer
-from rich.console import Console
+from rich.console import Console, Group
 from rich.table import Table
+from rich.text import Text
 
 app = typer.Typer()
 
+sync_app = typer.Typer(short_help="Synchronize your habits with another device")
+app.add_typer(sync_app, name="sync")
+
 console = Console()
 
 qt = questionary
@@ -78,6 +86,593 @@ def start():
     start_function()
 
 
+@app.command("verify-stats", short_help="Check the habit statistics for drift")
+def verify_stats(
+    repair: bool = typer.Option(False, "--repair", help="Rebuild the statistics from scratch if drift is found.")
+) -> None:
+    """
+    Recompute the habit statistics from the habitbase and the habit history and compare them with the materialized table.
+
+    Args:
+        repair (bool): Whether to rebuild the statistics when drift is found.
+
+    Returns:
+        None
+
+    Raises:
+        typer.Exit: With exit code 1 if drift is found and not repaired.
+
+    """
+    db = database.connect_db()
+    drift = database.habit_stats_drift(db)
+    if len(drift) == 0:
+        typer.secho("\nThe habit statistics are up to date !\n", fg=typer.colors.BRIGHT_GREEN)
+    elif repair:
+        database.rebuild_habit_stats(db)
+        typer.secho(f"\nRebuilt the statistics of {len(drift)} entries: {', '.join(drift)}\n", fg=typer.colors.BRIGHT_YELLOW)
+    else:
+        typer.secho(f"\nThe statistics of {len(drift)} entries drifted: {', '.join(drift)}\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+
+
+@app.command(short_help="Show the leaderboard of your habits")
+def leaderboard(
+    by: str = typer.Option("max_streak", "--by", help="Rank by 'max_streak', 'streak' or 'completion_rate'."),
+    top: int = typer.Option(10, "--top", "-k", min=1, help="Number of habits per page."),
+    periodicity: Optional[str] = typer.Option(None, "--periodicity", "-p", help="Only rank habits with this periodicity."),
+    page: int = typer.Option(1, "--page", min=1, help="Page of the leaderboard to show."),
+) -> None:
+    """
+    Display one page of the habits ranked by their longest streak, current streak or completion rate.
+
+    Args:
+        by (str): The ranking to use.
+        top (int): The number of habits per page.
+        periodicity (str, optional): Only rank habits with this periodicity.
+        page (int): The page to show, starting at 1.
+
+    Returns:
+        None
+
+    Raises:
+        typer.Exit: With exit code 2 if the ranking is unknown.
+
+    """
+    db = database.connect_db()
+    try:
+        leaders = analytics.leaderboard(db, by=by, k=top, periodicity=periodicity, offset=(page - 1) * top)
+    except ValueError as e:
+        typer.secho(f"\n{e}\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=2)
+
+    table = Table(title = "\nLEADERBOARD\n", show_header=True, show_lines=True)
+    table.add_column("Rank", min_width=6, justify="center")
+    table.add_column("Habit", min_width=12, justify="center")
+    table.add_column("Periodicity", min_width=12, justify="center")
+    table.add_column("Streak", min_width=12, justify="center")
+    table.add_column("Max_Streak", min_width=12, justify="center")
+    table.add_column("Completion_Rate", min_width=12, justify="center")
+    for rank, stats in enumerate(leaders, start=(page - 1) * top + 1):
+        table.add_row(str(rank), stats.habit, stats.periodicity, str(stats.streak), str(stats.max_streak), f"{stats.completion_rate:.0%}")
+    console.print(table)
+
+
+@app.command(short_help="Show the consistency of your habits over a date window")
+def consistency(
+    start: Optional[datetime.datetime] = typer.Option(None, "--from", formats=["%Y-%m-%d", "%d %b %Y"], help="First day of the window. Defaults to 30 days before the last day."),
+    end: Optional[datetime.datetime] = typer.Option(None, "--to", formats=["%Y-%m-%d", "%d %b %Y"], help="Last day of the window. Defaults to today."),
+) -> None:
+    """
+    Display the completion rate, misses, gaps and rolling consistency of every habit and of all habits together.
+
+    Args:
+        start (datetime.datetime, optional): The first day of the window.
+        end (datetime.datetime, optional): The last day of the window.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    end_date = end.date() if end is not None else datetime.date.today()
+    start_date = start.date() if start is not None else end_date - datetime.timedelta(days=29)
+    index = analytics.CompletionIndex(db)
+
+    def rate_str(rate):
+        return '-' if rate is None else f"{rate:.0%}"
+
+    table = Table(title = f"\nCONSISTENCY {start_date.strftime('%d %b %Y')} - {end_date.strftime('%d %b %Y')}\n", show_header=True, show_lines=True)
+    table.add_column("Habit", min_width=12, justify="center")
+    table.add_column("Completion_Rate", min_width=12, justify="center")
+    table.add_column("Misses", min_width=8, justify="center")
+    table.add_column("Average_Gap", min_width=8, justify="center")
+    table.add_column("Longest_Gap", min_width=8, justify="center")
+    for days in analytics.ROLLING_WINDOWS:
+        table.add_column(f"Last_{days}_Days", min_width=8, justify="center")
+    for stats in index.window_report(start_date, end_date):
+        average_gap_str = '-' if stats.average_gap is None else f"{stats.average_gap:.1f}"
+        table.add_row(stats.habit or "All habits", rate_str(stats.completion_rate), str(stats.misses), average_gap_str,
+        str(stats.longest_gap), *[rate_str(stats.rolling[days]) for days in analytics.ROLLING_WINDOWS])
+    console.print(table)
+
+
+HEATMAP_LEVELS = ["grey30", "dark_green", "green4", "green3", "bright_green"]
+
+
+@app.command(short_help="Show a calendar heatmap of your check-offs")
+def heatmap(
+    habit: Optional[str] = typer.Option(None, "--habit", help="Only show this habit. Defaults to all habits."),
+    year: Optional[List[int]] = typer.Option(None, "--year", help="Year to show, can be repeated. Defaults to the current year."),
+) -> None:
+    """
+    Display a year grid of check-offs for one habit or aggregated over all habits, one row per weekday and one column per week.
+
+    Args:
+        habit (str, optional): The habit to show.
+        year (List[int], optional): The years to show.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    if habit is not None and not database.habit_existing_check(db, habit):
+        typer.secho(f"\nThe habit '{habit}' is not existing ! Please try again !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    for shown_year in year or [datetime.date.today().year]:
+        counts = analytics.completion_calendar(db, shown_year, habit)
+        console.print(render_heatmap(counts, shown_year, habit or "All habits"))
+
+
+def render_heatmap(counts, year, title):
+    """
+    Render the check-offs of one year as a GitHub-style grid.
+
+    Args:
+        counts (dict): The number of check-offs per datetime.date.
+        year (int): The year to render.
+        title (str): The title shown above the grid.
+
+    Returns:
+        rich.text.Text: The rendered grid.
+
+    """
+    first = datetime.date(year, 1, 1)
+    grid_start = first - datetime.timedelta(days=first.weekday())
+    weeks = (datetime.date(year, 12, 31) - grid_start).days // 7 + 1
+    highest = max(counts.values(), default=0)
+
+    heatmap_text = Text(f"\n{title} {year} - {sum(counts.values())} check-offs\n\n", style="bold")
+    month_row = [" "] * (weeks + 3)
+    for month in range(1, 13):
+        column = (datetime.date(year, month, 1) - grid_start).days // 7
+        label = datetime.date(year, month, 1).strftime("%b")
+        month_row[column:column + len(label)] = label
+    heatmap_text.append("    " + "".join(month_row).rstrip() + "\n")
+    for weekday in range(7):
+        heatmap_text.append(datetime.date(2023, 1, 2 + weekday).strftime("%a") + " ")
+        for week in range(weeks):
+            day = grid_start + datetime.timedelta(days=7 * week + weekday)
+            if day.year != year:
+                heatmap_text.append(" ")
+                continue
+            count = counts.get(day, 0)
+            level = 0 if count == 0 else 1 + (count * (len(HEATMAP_LEVELS) - 2)) // highest
+            heatmap_text.append("■", style=HEATMAP_LEVELS[level])
+        heatmap_text.append("\n")
+    return heatmap_text
+
+
+@app.command(short_help="Show on how many days your habits were checked off together")
+def overlap(
+    habits: Optional[List[str]] = typer.Argument(None, help="The habits to compare. Defaults to all habits."),
+    periodicity: Optional[str] = typer.Option(None, "--periodicity", help="Compare all habits of this periodicity."),
+    start: Optional[datetime.datetime] = typer.Option(None, "--from", formats=["%Y-%m-%d", "%d %b %Y"], help="First day to count. Defaults to the beginning."),
+    end: Optional[datetime.datetime] = typer.Option(None, "--to", formats=["%Y-%m-%d", "%d %b %Y"], help="Last day to count. Defaults to today."),
+) -> None:
+    """
+    Display the number of days all of a group of habits were checked off, the days any of them was, and their overlap.
+
+    Args:
+        habits (List[str], optional): The habits to compare.
+        periodicity (str, optional): Compare all habits of this periodicity.
+        start (datetime.datetime, optional): The first day to count.
+        end (datetime.datetime, optional): The last day to count.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    for habit in habits or []:
+        if not database.habit_existing_check(db, habit):
+            typer.secho(f"\nThe habit '{habit}' is not existing ! Please try again !\n", fg=typer.colors.BRIGHT_RED)
+            raise typer.Exit(code=1)
+    stats = analytics.habit_overlap(db, habits or None, periodicity, start.date() if start is not None else None, end.date() if end is not None else None)
+
+    table = Table(title = f"\nOVERLAP OF {len(stats.habits)} HABITS\n", show_header=True, show_lines=True)
+    table.add_column("Habits", min_width=20, justify="center")
+    table.add_column("All_Checked_Off", min_width=8, justify="center")
+    table.add_column("Any_Checked_Off", min_width=8, justify="center")
+    table.add_column("Overlap", min_width=8, justify="center")
+    table.add_column("Last_Together", min_width=12, justify="center")
+    table.add_row(", ".join(stats.habits), str(stats.together), str(stats.any),
+        '-' if stats.overlap is None else f"{stats.overlap:.0%}", stats.last_together or '-')
+    console.print(table)
+
+
+@app.command(short_help="Find your habits by a part of their name")
+def find(
+    query: str = typer.Argument(..., help="The start of the name, a part of it, or a misspelled name."),
+    limit: int = typer.Option(10, "--limit", min=1, help="Maximum number of habits shown."),
+) -> None:
+    """
+    Display the habits whose names best match the query, names starting with it first.
+
+    Args:
+        query (str): The text to search for.
+        limit (int): The maximum number of habits shown.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    matches = search.index_of(db).search(query, limit)
+    if not matches:
+        typer.secho(f"\nThere is no habit matching '{query}' !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    table = Table(title = f"\nHABITS MATCHING '{query}'\n", show_header=True, show_lines=True)
+    table.add_column("Habit", min_width=12, justify="center")
+    table.add_column("Periodicity", min_width=12, justify="center")
+    for habit in matches:
+        table.add_row(habit, database.periodicity_of_habit(db, database.habit_id(db, habit)))
+    console.print(table)
+
+
+@app.command(short_help="Rename one of your habits")
+def rename(
+    habit: str = typer.Argument(..., help="The current name of the habit, in any case."),
+    new_name: str = typer.Argument(..., help="The new name of the habit."),
+) -> None:
+    """
+    Rename a habit, keeping its streaks, statistics and history.
+
+    Args:
+        habit (str): The current name of the habit.
+        new_name (str): The new name of the habit.
+
+    Returns:
+        None
+
+    Raises:
+        typer.Exit: With exit code 1 if there is no such habit or the new name is taken.
+
+    """
+    db = database.connect_db()
+    habit_id = database.habit_id(db, habit)
+    if habit_id is None:
+        typer.secho(f"\nThere is no habit '{habit}' !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    if database.habit_id(db, new_name) not in (None, habit_id):
+        typer.secho(f"\nThere is already a habit '{new_name}' !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    old_name = database.habit_by_id(db, habit_id).habit
+    database.rename_habit(db, habit_id, new_name)
+    typer.secho(f"\nThe habit '{old_name}' is now called '{new_name}' !\n", fg=typer.colors.BRIGHT_GREEN)
+
+
+
+@app.command("check-off", short_help="Check off a habit, e.g. from a script")
+def check_off_command(
+    habit: str = typer.Argument(..., help="The habit to check off, in any case."),
+    date: Optional[datetime.datetime] = typer.Option(None, "--date", formats=["%Y-%m-%d"], help="Day of the check-off. Defaults to today."),
+    request_id: Optional[str] = typer.Option(None, "--request-id", help="Id of the check-off. A retry with the same id is not counted twice."),
+    socket: Optional[str] = typer.Option(None, "--socket", help="Socket of a running daemon that commits the check-off together with those of other clients."),
+) -> None:
+    """
+    Check off a habit without the menus. Retrying with the same '--request-id' returns the first result again.
+
+    Args:
+        habit (str): The habit to check off.
+        date (datetime.datetime, optional): The day of the check-off. Defaults to today in the time zone of the habit.
+        request_id (str, optional): The id of the check-off, to retry it safely.
+        socket (str, optional): The socket of a daemon started with '--socket', which commits the check-off. Defaults to committing it directly.
+
+    Returns:
+        None
+
+    Raises:
+        typer.Exit: With exit code 1 if there is no such habit, the daemon failed or the result of the request id is no longer known,
+            and with exit code 2 if the day is in the future or before the last completion of the habit.
+
+    """
+    db = database.connect_db()
+    habit_id = database.habit_id(db, habit)
+    if habit_id is None:
+        typer.secho(f"\nThere is no habit '{habit}' !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    habit = database.habit_by_id(db, habit_id).habit
+    today = database.local_today(db, habit)
+    day = date.date() if date is not None else today
+    last_completed = database.habit_completed_time(db, habit_id)
+    if day > today:
+        typer.secho(f"\nYou cannot check off the habit '{habit}' for a day in the future !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=2)
+    if last_completed is not None and day.toordinal() < database.day_number(last_completed):
+        typer.secho(f"\nThe habit '{habit}' was last completed on {last_completed}, you cannot check it off for an earlier day !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=2)
+    if socket is None:
+        result = database.submit_check_off(db, habit_id, day.strftime("%d %b %Y"), request_id)
+    else:
+        try:
+            result = writes.submit(socket, "habit.db", "check_off", habit_id, day.strftime("%d %b %Y"), request_id)
+        except (OSError, RuntimeError) as e:
+            typer.secho(f"\nThe daemon did not check off the habit '{habit}': {e}\n", fg=typer.colors.BRIGHT_RED)
+            raise typer.Exit(code=1)
+    if result is None:
+        typer.secho(f"\nThe check-off '{request_id}' was already submitted, but its result is no longer known !\n", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    if result["completed"]:
+        console.print(f"\nYou checked off the habit '{habit}' ! Your streak is {result['streak']} !\n")
+    elif result["recorded"]:
+        console.print(f"\nYou checked off the habit '{habit}' !\n")
+    else:
+        console.print(f"\nYou already completed the habit '{habit}' {schedules.parse(database.periodicity_of_habit(db, habit_id)).noun} !\n")
+
+
+@app.command(short_help="Archive old check-offs and shrink the database")
+def compact(
+    keep_days: int = typer.Option(365, "--keep-days", min=0, help="Check-offs of the last this many days stay in the history."),
+    vacuum_pages: int = typer.Option(1000, "--vacuum-pages", min=0, help="Maximum number of free pages to give back to the file system, 0 to only archive."),
+) -> None:
+    """
+    Move old check-offs into compressed archive segments and free a limited number of pages of the database file.
+
+    Statistics, the heatmap and the consistency report keep reading the archived check-offs.
+
+    Args:
+        keep_days (int): The check-offs of the last this many days stay in the history.
+        vacuum_pages (int): The maximum number of free pages to give back to the file system.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    horizon = database.local_today(db).toordinal() - keep_days
+    segments, archived = database.compact_history(db, horizon)
+    freed = database.vacuum_incrementally(db, vacuum_pages)
+    console.print(f"\nArchived {archived} check-offs before {database.day_string(horizon)} in {segments} segments and freed {freed} pages !\n")
+
+
+@app.command(short_help="Print the changes of your habits as JSON lines")
+def changes(
+    since: int = typer.Option(0, "--since", min=0, help="Sequence number of the last change already seen."),
+    batch_size: int = typer.Option(500, "--batch-size", min=1, help="Number of changes read from the database at once."),
+) -> None:
+    """
+    Print every change of your habits after a cursor as one JSON line, oldest first.
+
+    The 'seq' of the last printed line is the cursor to pass to '--since' the next time.
+
+    Args:
+        since (int): The sequence number of the last change already seen.
+        batch_size (int): The number of changes read from the database at once.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    for change in database.stream_changes(db, since, batch_size):
+        typer.echo(change.to_json())
+
+
+@sync_app.command("export", short_help="Write the changes another device has not seen yet into a file")
+def sync_export(
+    path: str = typer.Argument(..., help="The delta file to write."),
+    peer: Optional[str] = typer.Option(None, "--peer", help="Id of the device the file is meant for. Defaults to all changes."),
+) -> None:
+    """
+    Write the changes of your habits into a delta file for another device.
+
+    Args:
+        path (str): The delta file to write.
+        peer (str, optional): The id of the device the file is meant for. Only the changes it has not seen yet are written.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    count = sync.export_delta(db, path, peer)
+    console.print(f"\nWrote {count} changes of the device '{sync.replica_id(db)}' to '{path}' !\n")
+
+
+@sync_app.command("import", short_help="Merge a file of changes from another device")
+def sync_import(
+    path: str = typer.Argument(..., help="The delta file to read."),
+) -> None:
+    """
+    Merge the changes of another device from a delta file. Streaks are derived from the check-offs of all devices.
+
+    Args:
+        path (str): The delta file to read.
+
+    Returns:
+        None
+
+    """
+    db = database.connect_db()
+    merged = sync.import_delta(db, path)
+    console.print(f"\nMerged the habits: {', '.join(merged) or '-'}\n")
+
+
+@app.command(short_help="Show or set the time zone your days are counted in")
+def timezone(
+    name: Optional[str] = typer.Argument(None, help="IANA name of the time zone, e.g. 'Europe/Berlin', or 'local' for the time of this machine."),
+    habit: Optional[str] = typer.Option(None, "--habit", help="Only set the time zone of this habit."),
+) -> None:
+    """
+    Show or set the time zone the days of your habits are counted in.
+
+    Args:
+        name (str, optional): The time zone to set. Shows the current time zone if not given.
+        habit (str, optional): Only set the time zone of this habit.
+
+    Returns:
+        None
+
+    Raises:
+        typer.Exit: With exit code 2 if the time zone or the habit is unknown.
+
+    """
+    db = database.connect_db()
+    if habit is not None:
+        habit_id = database.habit_id(db, habit)
+        if habit_id is None:
+            typer.secho(f"\nThere is no habit '{habit}' in your database !\n", fg=typer.colors.BRIGHT_RED)
+            raise typer.Exit(code=2)
+        # The setting is keyed by the stored name, which renames and deletes of the habit look up.
+        habit = database.habit_by_id(db, habit_id).habit
+    key = "timezone" if habit is None else f"timezone:{habit}"
+    counted = "Your days are" if habit is None else f"The days of the habit '{habit}' are"
+    if name is None:
+        current = database.timezone_of(db, habit) or "local"
+        console.print(f"\n{counted} counted in the time zone '{current}'. Today is {timezones.today(None if current == 'local' else current):%d %b %Y}.\n")
+        return
+    if name != "local":
+        try:
+            timezones.zone(name)
+        except ValueError as e:
+            typer.secho(f"\n{e}\n", fg=typer.colors.BRIGHT_RED)
+            raise typer.Exit(code=2)
+    database.set_setting(db, key, None if name == "local" else name)
+    console.print(f"\n{counted} now counted in the time zone '{name}'.\n")
+
+
+def scheduler_options(databases, shards, stagger, remind_before, run_at=datetime.time(0, 0), verbose=False):
+    """
+    Build the scheduler for the rollover and reminder commands.
+
+    Args:
+        databases (List[str]): The database files to roll over. Defaults to 'habit.db' if empty.
+        shards (int): The number of shards the databases are spread over.
+        stagger (float): The seconds between the start of two shards.
+        remind_before (int): How many days before its deadline a habit is reminded of.
+        run_at (datetime.time, optional): The time of day the daemon runs the rollover at. Defaults to midnight.
+        verbose (bool, optional): Whether the rollover lists every habit that was not checked off yet or broke. Defaults to False.
+
+    Returns:
+        scheduler.Scheduler: The scheduler.
+    """
+    return scheduler.Scheduler(databases or ["habit.db"], functools.partial(update_check_results, verbose=verbose), remind=print_reminder,
+        shards=shards, stagger=stagger, remind_before=remind_before, run_at=run_at)
+
+
+def print_reminder(reminder):
+    """
+    Print a reminder for a habit whose streak is about to break.
+
+    Args:
+        reminder (model.Reminder): The reminder.
+
+    Returns:
+        None
+    """
+    typer.secho(f"Reminder: check off '{reminder.habit}' by {reminder.deadline} or your streak of {reminder.streak} will be reseted !",
+    fg=typer.colors.BRIGHT_YELLOW)
+
+
+@app.command(short_help="Roll your habits over once, e.g. from a cron entry")
+def rollover(
+    databases: List[str] = typer.Option([], "--database", "-d", help="Database file to roll over. Can be repeated. Defaults to habit.db."),
+    shards: int = typer.Option(1, "--shards", min=1, help="Number of shards the databases are spread over."),
+    stagger: float = typer.Option(0.0, "--stagger", min=0.0, help="Seconds between the start of two shards."),
+    remind_before: int = typer.Option(1, "--remind-before", min=1, help="Remind of habits whose streak breaks within this many days."),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only print the changes the rollover would make."),
+    verbose: bool = typer.Option(False, "--verbose", help="List every habit that was not checked off yet or broke."),
+) -> None:
+    """
+    Run the rollover of all habits and print reminders for the habits whose streak is about to break, without starting the tracker.
+
+    Args:
+        databases (List[str]): The database files to roll over.
+        shards (int): The number of shards the databases are spread over.
+        stagger (float): The seconds between the start of two shards.
+        remind_before (int): How many days before its deadline a habit is reminded of.
+        dry_run (bool): Only print the changes the rollover would make, without writing them.
+        verbose (bool): List every habit that was not checked off yet or broke, instead of the first few.
+
+    Returns:
+        None
+    """
+    if dry_run:
+        for db_name in databases or ["habit.db"]:
+            print_rollover_plan(db_name, plan_rollover(db_name))
+        return
+    asyncio.run(scheduler_options(databases, shards, stagger, remind_before, verbose=verbose).run_once())
+
+
+@app.command(short_help="Roll your habits over every day in the background")
+def daemon(
+    databases: List[str] = typer.Option([], "--database", "-d", help="Database file to roll over. Can be repeated. Defaults to habit.db."),
+    run_at: datetime.datetime = typer.Option("00:00", "--at", formats=["%H:%M"], help="Time of day to run the rollover at."),
+    shards: int = typer.Option(1, "--shards", min=1, help="Number of shards the databases are spread over."),
+    stagger: float = typer.Option(0.0, "--stagger", min=0.0, help="Seconds between the start of two shards."),
+    remind_before: int = typer.Option(1, "--remind-before", min=1, help="Remind of habits whose streak breaks within this many days."),
+    socket: Optional[str] = typer.Option(None, "--socket", help="Socket to accept the check-offs, additions and deletions of clients on."),
+    batch_window: float = typer.Option(2.0, "--batch-window", min=0.0, help="Milliseconds the changes of all clients are collected for one commit."),
+    batch_size: int = typer.Option(256, "--batch-size", min=1, help="Maximum number of changes committed together."),
+    verbose: bool = typer.Option(False, "--verbose", help="List every habit that was not checked off yet or broke."),
+) -> None:
+    """
+    Run the rollover and the reminders every day at a fixed time until the process is stopped.
+
+    Args:
+        databases (List[str]): The database files to roll over.
+        run_at (datetime.datetime): The time of day to run the rollover at.
+        shards (int): The number of shards the databases are spread over.
+        stagger (float): The seconds between the start of two shards.
+        remind_before (int): How many days before its deadline a habit is reminded of.
+        socket (str, optional): The socket to accept the changes of clients on, see writes.WriteServer. Defaults to none.
+        batch_window (float): The milliseconds the changes of all clients are collected for one commit.
+        batch_size (int): The maximum number of changes committed together.
+        verbose (bool): List every habit that was not checked off yet or broke, instead of the first few.
+
+    Returns:
+        None
+    """
+    jobs = scheduler_options(databases, shards, stagger, remind_before, run_at.time(), verbose)
+    server = writes.WriteServer(socket, jobs.tenants, batch_window / 1000, batch_size) if socket is not None else None
+    try:
+        asyncio.run(run_daemon(jobs, server))
+    except KeyboardInterrupt:
+        typer.secho("\nThe rollover daemon stopped.\n", fg=typer.colors.BRIGHT_WHITE)
+
+
+async def run_daemon(jobs, server=None):
+    """
+    Run the daily rollover and, if given, serve the changes of clients until the process is stopped.
+
+    Args:
+        jobs (scheduler.Scheduler): The scheduler of the rollover.
+        server (writes.WriteServer, optional): The server for the changes of clients. Defaults to none.
+
+    Returns:
+        None
+    """
+    if server is None:
+        await jobs.run_forever()
+        return
+    await server.start()
+    try:
+        await jobs.run_forever()
+    finally:
+        await server.close()
+
+
 ### Additional functions to support the running programm after starting app !!
 
 habit_name = get.habit_entry
@@ -145,7 +740,7 @@ def for_start_add_function():
         habit_entry = habit_name()
         description_entry = description_name()
         periodicity_entry = periodicity_name()
-        adding_entry = model.Habit(habit_entry, description_entry, periodicity_entry)
+        adding_entry = model.Habit(habit_entry, description_entry, periodicity_entry, database.local_today(database.connect_db()).strftime("%d %b %Y"))
         if get.adding_confirmation(habit_entry, description_entry, periodicity_entry):
             model.Habit.add_habit(adding_entry, db_name="habit.db")
             show(None)
@@ -204,7 +799,6 @@ def delete_function():
                 if get.delete_confirmation(deleting_habit_name):
                     deleting_entry = model.Habit(deleting_habit_name)
                     model.Habit.delete_habit(deleting_entry, db_name="habit.db")
-                    database.reset_log(db, deleting_habit_name)
                     if len(database.all_habits(db)) > 0:
                         show(None)
                         console.print(f"\nThe habit '{deleting_habit_name}' is deleted!\n")
@@ -304,7 +898,7 @@ def add_function():
                     description_entry = description_name()
                     periodicity_entry = periodicity_name()
                     if get.adding_confirmation(habit_entry_name, description_entry, periodicity_entry):
-                        adding_entry = model.Habit(habit_entry_name, description_entry, periodicity_entry)
+                        adding_entry = model.Habit(habit_entry_name, description_entry, periodicity_entry, database.local_today(database.connect_db()).strftime("%d %b %Y"))
                         model.Habit.add_habit(adding_entry, db_name="habit.db")
                         show(None)
                         console.print(f"\nYou added the habit '{habit_entry_name}' with the description '{description_entry}' as '{periodicity_entry}' to your tracker!!\n")
@@ -364,6 +958,45 @@ def start_without_update():
         fg = typer.colors.BRIGHT_RED)
         raise typer.Exit()
 
+def check_off(db, check_off_habit):
+    """
+    Ask for confirmation and check off a habit for today, then show the updated tracker.
+
+    The message names the current period of the habit's periodicity, e.g. "today" or "this week". A periodicity that
+    needs several check-offs per period reports the check-offs that are still missing instead.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        check_off_habit (str): The habit to check off.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the periodicity of the habit is unknown.
+    """
+    habit_id = database.habit_id(db, check_off_habit)
+    schedule = schedules.parse(database.periodicity_of_habit(db, habit_id))
+    habit_to_check_off = model.Habit(check_off_habit, id=habit_id)
+    if get.check_off_confirmation(check_off_habit):
+        today = database.local_today(db, check_off_habit)
+        today_formatted = today.strftime("%d %b %Y")
+        if not habit_to_check_off.update_streak(db_name="habit.db", current_date= today_formatted):
+            console.print(f"\nYou already completed the habit '{check_off_habit}' {schedule.noun} !\n")
+            return
+        show(None)
+        if habit_to_check_off.completed == model.Completion.COMPLETED:
+            typer.secho(f"\nCONGRATULATIONS !!!\n",
+            fg=typer.colors.BRIGHT_GREEN)
+            console.print(f"You completed the habit '{check_off_habit}' {schedule.noun} ! Keep it going!\n")
+        else:
+            window_start = schedule.window(today.toordinal(), None)[0]
+            missing = schedule.target - database.completions_since(db, habit_id, window_start)
+            console.print(f"\nYou checked off the habit '{check_off_habit}' ! {missing} more check-offs {schedule.noun} to complete it !\n")
+    else:
+        console.print(f"\nYou did not set the habit '{check_off_habit}' to completed !\n")
+
+
 def manage_for_update():
     checking_is_on = True
     try:
@@ -376,49 +1009,20 @@ def manage_for_update():
     while checking_is_on:             
         check_off_habit = managing_habit()
         try:
-            if database.periodicity_of_habit(db,check_off_habit) == "Daily":
-                habit_daily = model.Habit(check_off_habit)
-                if get.check_off_confirmation(check_off_habit):
-                    today = datetime.datetime.now().date()
-                    today_formatted = today.strftime("%d %b %Y")
-                    habit_daily.update_streak(db_name="habit.db", current_date= today_formatted)
-                    show(None)
-                    typer.secho(f"\nCONGRATULATIONS !!!\n",
-                    fg=typer.colors.BRIGHT_GREEN)
-                    console.print(f"You completed the habit '{check_off_habit}' today ! Keep it going!\n")
-                else:
-                    console.print(f"\nYou did not set the habit '{check_off_habit}' to completed !\n")
-                check_off_continue_question = qt.confirm("Do you want to check off more habits ?").ask()
-                if check_off_continue_question is True:
-                    if database.collect_uncompleted_habits_choices(db) is not None:
-                        continue
-                    else:
-                        checking_is_on = False
-                        typer.secho("\nThere are no uncompleted habits in your database !\n",
-                        fg=typer.colors.BRIGHT_RED)
-                        ask_for_intention()
-
-                else:
-                    checking_is_on = False
-                    start_without_update()
-
-            elif database.periodicity_of_habit(db,check_off_habit) == "Weekly":
-                habit_weekly = model.Habit(check_off_habit)
-                if get.check_off_confirmation(check_off_habit):
-                    database.complete_habit(db,check_off_habit)
-                    habit_weekly.update_streak(db_name="habit.db", current_date= today_formatted)
-                    show(None)
-                    typer.secho(f"\nCONGRATULATIONS !!!",
-                    fg=typer.colors.BRIGHT_GREEN)
-                    console.print(f"\nYou completed the habit '{check_off_habit}' this week ! Keep it going!\n")
-                else:
-                    console.print(f"\nYou did not set the habit '{check_off_habit}' to completed !\n")
-                check_off_continue_question = qt.confirm("Do you want to check off more habits ?").ask()
-                if check_off_continue_question is True:
+            check_off(db, check_off_habit)
+            check_off_continue_question = qt.confirm("Do you want to check off more habits ?").ask()
+            if check_off_continue_question is True:
+                if get.habit_choices().uncompleted:
                     continue
                 else:
                     checking_is_on = False
-                    start_without_update()
+                    typer.secho("\nThere are no uncompleted habits in your database !\n",
+                    fg=typer.colors.BRIGHT_RED)
+                    ask_for_intention()
+
+            else:
+                checking_is_on = False
+                start_without_update()
         except ValueError:
             typer.secho("\nThere is no habit with the periodicity you choosed ! Please add one first !\n",
             fg = typer.colors.BRIGHT_RED)
@@ -431,11 +1035,9 @@ def manage_function():
     Manage the progress of habits in the tracker.
     
     Connects to the database and prompts the user to select a habit to mark as
-    completed. If the selected habit has a periodicity of "Daily", the function
-    checks if the habit has already been completed today and updates the streak
-    accordingly. If the selected habit has a periodicity of "Weekly", the function
-    checks if the habit has already been completed this week and updates the
-    streak accordingly. After the user has marked a habit as completed, they are
+    completed. The habit is checked off for the current period of its periodicity
+    (e.g. today for "Daily", this week for "Weekly") and its streak is updated
+    accordingly. After the user has marked a habit as completed, they are
     prompted to continue managing or exit the function.
 
     Args:
@@ -461,71 +1063,28 @@ def manage_function():
     while checking_is_on:             
         check_off_habit = managing_habit()
         try:
-            if database.periodicity_of_habit(db,check_off_habit) == "Daily":
-                habit_daily = model.Habit(check_off_habit)
-                if get.check_off_confirmation(check_off_habit):
-                    today = datetime.datetime.now().date()
-                    today_formatted = today.strftime("%d %b %Y")
-                    habit_daily.update_streak(db_name="habit.db", current_date= today_formatted)
-                    show(None)
-                    typer.secho(f"\nCONGRATULATIONS !!!\n",
-                    fg=typer.colors.BRIGHT_GREEN)
-                    console.print(f"You completed the habit '{check_off_habit}' today ! Keep it going!\n")
-                else:
-                    console.print(f"\nYou did not set the habit '{check_off_habit}' to completed !\n")
-                check_off_continue_question = qt.confirm("Do you want to check off more habits ?").ask()
-                if check_off_continue_question is True:
-                    if database.collect_uncompleted_habits_choices(db) is not None:
-                        continue
-                    else:
-                        checking_is_on = False
-                        typer.secho("\nThere are no uncompleted habits in your database !\n",
-                        fg=typer.colors.BRIGHT_RED)
-                        ask_for_intention()
-
+            check_off(db, check_off_habit)
+            check_off_continue_question = qt.confirm("Do you want to check off more habits ?").ask()
+            if check_off_continue_question is True:
+                if get.habit_choices().uncompleted:
+                    continue
                 else:
                     checking_is_on = False
-                    for_check_off_second_question = qt.select("Do you want to keep on managing or exit?",
-                    choices=["Keep managing", "Go to Start", "Exit"],
-                    ).ask()
-                    if for_check_off_second_question == "Keep managing":
-                        manage()
-                    elif for_check_off_second_question == "Go to Start":
-                        start_without_update()
-                    else:
-                        exit_app_question()
-
-            elif database.periodicity_of_habit(db,check_off_habit) == "Weekly":
-                habit_weekly = model.Habit(check_off_habit)
-                if get.check_off_confirmation(check_off_habit):
-                    database.complete_habit(db,check_off_habit)
-                    habit_weekly.update_streak(db_name="habit.db", current_date= today_formatted)
-                    show(None)
-                    typer.secho(f"\nCONGRATULATIONS !!!",
-                    fg=typer.colors.BRIGHT_GREEN)
-                    console.print(f"\nYou completed the habit '{check_off_habit}' this week ! Keep it going!\n")
-                else:
-                    console.print(f"\nYou did not set the habit '{check_off_habit}' to completed !\n")
-                check_off_continue_question = qt.confirm("Do you want to check off more habits ?").ask()
-                if check_off_continue_question is True:
-                    if database.collect_uncompleted_habits_choices(db) is not None:
-                        continue
-                    else:
-                        checking_is_on = False
-                        typer.secho("\nThere are no uncompleted habits in your database !\n",
-                        fg=typer.colors.BRIGHT_RED)
-                        ask_for_intention()
+                    typer.secho("\nThere are no uncompleted habits in your database !\n",
+                    fg=typer.colors.BRIGHT_RED)
+                    ask_for_intention()
+
+            else:
+                checking_is_on = False
+                for_check_off_second_question = qt.select("Do you want to keep on managing or exit?",
+                choices=["Keep managing", "Go to Start", "Exit"],
+                ).ask()
+                if for_check_off_second_question == "Keep managing":
+                    manage()
+                elif for_check_off_second_question == "Go to Start":
+                    start_without_update()
                 else:
-                    checking_is_on = False
-                    for_check_off_second_question = qt.select("Do you want to keep on managing or exit?",
-                    choices=["Keep managing", "Go to Start", "Exit"],
-                    ).ask()
-                    if for_check_off_second_question == "Keep managing":
-                        manage()
-                    elif for_check_off_second_question == "Go to Start":
-                        start_without_update()
-                    else:
-                        exit_app_question()
+                    exit_app_question()
         except ValueError:
             typer.secho("\nThere is no habit with the periodicity you choosed ! Please add one first !\n",
             fg = typer.colors.BRIGHT_RED)
@@ -678,18 +1237,9 @@ def analyze_habits_same_periodicity():
 
     periodicity_analyze_name = get_periodicity_name()
     if len(analytics.habit_custom_perdiodicity_information(db, periodicity_analyze_name)) > 0 :
-        if periodicity_analyze_name == "Daily":
-            show(periodicity="Daily")
-            console.print(f"\nHere is an overview of your habits with the periodicity '{periodicity_analyze_name}' !\n")
-            keep_analyzing()
-
-        elif periodicity_analyze_name =="Weekly":
-            show(periodicity="Weekly")
-            console.print(f"\nHere is an overview of your habits with the periodicity '{periodicity_analyze_name}' !\n")
-            keep_analyzing()
-
-        else:
-            console.print(f"\nNo matching habits with the periodicity '{periodicity_analyze_name}' found in your database!\n")
+        show(periodicity=periodicity_analyze_name)
+        console.print(f"\nHere is an overview of your habits with the periodicity '{periodicity_analyze_name}' !\n")
+        keep_analyzing()
 
     else:
         typer.secho(f"\nThere are no habits with the periodicity '{periodicity_analyze_name}' in your database !\n")
@@ -761,7 +1311,7 @@ def show_all():
         table.add_column("Streak", min_width=12, justify="center")
 
         for entry in entries_list:
-            is_completed_str = 'Yes' if entry.completed == 2 else 'No'
+            is_completed_str = 'Yes' if entry.completed == model.Completion.COMPLETED else 'No'
             weekly_date_str = '-' if entry.startdate_weekly is None else entry.startdate_weekly
             table.add_row(entry.habit, entry.description, entry.periodicity, entry.starting_date, weekly_date_str, is_completed_str, str(entry.streak))
         console.print(table)
@@ -770,45 +1320,13 @@ def show_all():
         start_without_update()
 
 
-def show_daily(periodicity):
-    """Displays a table of daily habits.
-
-    Args:
-        periodicity (str): The periodicity of the habits to display (e.g. "Daily").
-
-    Returns:
-        None
-
-    """
-    try:
-        db = database.connect_db()
-    except Exception as e:
-        console.print(f"\nError retrieving habits from database: {e}\n")
-        return
-    if len(database.all_habits(db)) > 0:
-        data_list = analytics.habit_custom_perdiodicity_information(db,periodicity)
-        table = Table(title="\nYOUR HABITTRACKER\n", show_header=True, show_lines=True)
-        table.add_column("Habit", min_width=12, justify="center")
-        table.add_column("Description", min_width=20, justify="center")
-        table.add_column("Periodicity", min_width=12, justify="center")
-        table.add_column("Started", min_width=12, justify="center")
-        table.add_column("Completed", min_width=12, justify="center")
-        table.add_column("Streak", min_width=12, justify="center")
-
-        for data in data_list:
-            completed_daily_str = 'Yes' if data.completed == 2 else 'No'
-            table.add_row(data.habit, data.description, data.periodicity, data.starting_date, completed_daily_str, str(data.streak))
-        console.print(table)
-
-    else:
-        start_without_update()
-       
-
-def show_weekly(periodicity):
+def show_periodicity(periodicity):
     """Displays a table of habits based on their periodicity.
 
+    The start of the current window is only shown for periodicities that count their periods from the habit itself (e.g. "Weekly").
+
     Args:
-        periodicity (str): The periodicity of the habits to display (e.g. "Weekly").
+        periodicity (str): The periodicity of the habits to display (e.g. "Daily" or "Weekly").
 
     Returns:
         None
@@ -820,20 +1338,23 @@ def show_weekly(periodicity):
         console.print(f"\nError retrieving habits from database: {e}\n")
         return
     if len(database.all_habits(db)) > 0:
+        anchored = schedules.parse(periodicity).anchored
         periodicity_list = analytics.habit_custom_perdiodicity_information(db,periodicity)
         table = Table(title="\nYOUR HABITTRACKER\n", show_header=True, show_lines=True)
         table.add_column("Habit", min_width=12, justify="center")
         table.add_column("Description", min_width=20, justify="center")
         table.add_column("Periodicity", min_width=12, justify="center")
         table.add_column("Started", min_width=12, justify="center")
-        table.add_column("Startdate_Weekly", min_width=12, justify="center")
+        if anchored:
+            table.add_column("Startdate_Weekly", min_width=12, justify="center")
         table.add_column("Completed", min_width=12, justify="center")
         table.add_column("Streak", min_width=12, justify="center")
 
         for period in periodicity_list:
-            completed_weekly_str = 'Yes' if period.completed == 2 else 'No'
+            completed_str = 'Yes' if period.completed == model.Completion.COMPLETED else 'No'
             weekly_date_str = '-' if period.startdate_weekly is None else period.startdate_weekly
-            table.add_row(period.habit, period.description, period.periodicity, period.starting_date, weekly_date_str, completed_weekly_str, str(period.streak))
+            window_columns = [weekly_date_str] if anchored else []
+            table.add_row(period.habit, period.description, period.periodicity, period.starting_date, *window_columns, completed_str, str(period.streak))
         console.print(table)
 
     else:
@@ -854,7 +1375,7 @@ def check_completed_habits():
     habits = database.all_habits(db)
     # Loop through the habits and check if any are completed
     for habit in habits:
-        if habit.completed == 1:
+        if habit.completed == model.Completion.UNCOMPLETED:
             return True
     return False
 
@@ -953,7 +1474,7 @@ def log_function():
         table.add_column("Max_Streak", min_width=12, justify="center")
         
         for result in results:
-            completed_str = 'Yes' if result.completed == 2 else 'No'
+            completed_str = 'Yes' if result.completed == model.Completion.COMPLETED else 'No'
             table.add_row(result.habit, completed_str, str(result.streak),result.datetime_completed, str(result.max_streak))
         console.print(table)
         
@@ -977,58 +1498,43 @@ def log_function():
         start_without_update()
 
 
-def update_check_daily(db_name = None, today = None):
+def rollover_days(db, today = None):
     """
-    Check the habits that have a periodicity of "Daily" and update the list of habits that need to be completed today.
+    Find the day the rollover classifies for in every time zone the habits count days in.
 
     Args:
-        None
-    
+        db (sqlite3.Connection): A connection to the database.
+        today (str, optional): The day to classify for in all time zones, in the format '%d %b %Y'. Defaults to today in every time zone.
+
     Returns:
-    - results (list): A list of tuples, where each tuple contains an integer and a string.
-        The integer represents the number of days since the habit was last completed,
-        and the string represents the name of the habit.
+    - tuple: The day number in every time zone, keyed by the IANA name of the zone or None for the local time of the machine,
+        the time zone of the user and the time zones of single habits.
 
     """
-    try:
-        db = database.connect_db(db_name)
-    except Exception as e:
-        console.print(f"\nError retrieving habits from database: {e}\n")
-        return
-    habits_to_check = database.certain_periodicity(db, periodicity="Daily")
-    results = []
-    if habits_to_check is not None:
-        if today is None:
-            today = datetime.datetime.now().date()
-        else:
-            today = datetime.datetime.strptime(today, "%d %b %Y").date()
-
-        for habit in habits_to_check:
-            if habit.datetime_completed is not None:
-                last_completion = datetime.datetime.strptime(database.habit_completed_time(db, habit.habit), "%d %b %Y").date()
-                if today - last_completion == datetime.timedelta(days=0):
-                    results.append((1, habit.habit))
-                elif today - last_completion == datetime.timedelta(days=1):
-                    results.append((2,habit.habit))
-                elif today - last_completion >= datetime.timedelta(days=2):
-                    results.append((3,habit.habit))
-            else:
-                results.append((0,habit.habit))
-        return results
-    else:
-        pass
+    if today is None:
+        user_zone, habit_zones = database.timezone_settings(db)
+        return {zone: timezones.today(zone).toordinal() for zone in {user_zone, *habit_zones.values()}}, user_zone, habit_zones
+    return {None: datetime.datetime.strptime(today, "%d %b %Y").date().toordinal()}, None, {}
+
 
-def update_check_weekly(db_name = None, today=None):
+def update_check(db_name = None, today = None, states = None):
     """
-    Check the habits that have a periodicity of "Weekly" and update the list of habits that need to be completed this week.
+    Classify the habits for the rollover with the periodicity engine.
+
+    Only the habits whose deadline has passed are read, from the deadline index and in deadline order, so the cost
+    grows with the number of expiring habits instead of the number of all habits. All other habits keep their status.
 
     Args:
-        None
-    
+        db_name (str, optional): The name of the database file. Defaults to 'habit.db'.
+        today (str, optional): The day to classify for, in the format '%d %b %Y'. Defaults to today in the time zone of every habit.
+        states (dict, optional): Filled with the completion status, the last check-off, the window start and the streak of every
+            due habit as they were classified, keyed by habit. Defaults to not collecting them.
+
     Returns:
-    - results (list): A list of tuples, where each tuple contains an integer and a string.
-        The integer represents the completion status of the habit for the current week,
-        and the string represents the name of the habit.
+    - results (list): A list of tuples, where each tuple contains the status of a due habit, the name of the habit,
+        the new start of its window, or None if the window does not move, and the first days of the periods it missed.
+        The status is 0 if the habit was not checked off in its current period yet, 1 if it was checked off,
+        2 if the period it was checked off in ended and 3 if a whole period passed without a check-off.
 
     """
     try:
@@ -1036,93 +1542,147 @@ def update_check_weekly(db_name = None, today=None):
     except Exception as e:
         console.print(f"\nError retrieving habits from database: {e}\n")
         return
-    habits = database.certain_periodicity(db, periodicity="Weekly")
+    local_days, user_zone, habit_zones = rollover_days(db, today)
+    today = max(local_days.values())
+
     results = []
-    if habits is not None:
-        if today is None:
-            today = datetime.datetime.now().date()
-        else:
-            today = datetime.datetime.strptime(today, "%d %b %Y").date()
-        for habit in habits:
-            starting_date_str = datetime.datetime.strptime(habit.starting_date, "%d %b %Y").date()
-            starting_week_end = starting_date_str + datetime.timedelta(days=6)
-            if habit.datetime_completed is None:
-                if today <= starting_week_end:
-                    results.append((0,habit.habit))
-                else:
-                    results.append((3, habit.habit))
-            else:
-                new_startdate_week = database.get_startdate_weekly(db, habit.habit)
-                startdate = database.get_starting_date(db, habit.habit)
-                if new_startdate_week == startdate:
-                    if today <= starting_week_end:
-                        results.append((1, habit.habit))
-                    elif today == (starting_week_end + datetime.timedelta(days=1)):
-                        results.append((2, habit.habit))
-                    elif today >= (starting_week_end + datetime.timedelta(days=2)):
-                        results.append((3, habit.habit))
-                else:
-                    startdate_weekly_str = datetime.datetime.strptime(database.get_startdate_weekly(db, habit.habit), "%d %b %Y").date()
-                    startdate_week_end = startdate_weekly_str + datetime.timedelta(days=6)
-                    last_completion = datetime.datetime.strptime(database.habit_completed_time(db, habit.habit), "%d %b %Y").date()
-                    if today <= startdate_week_end and last_completion < startdate_weekly_str:
-                        results.append((0, habit.habit))
-                    elif today <= startdate_week_end and last_completion >= startdate_weekly_str :
-                        results.append((1, habit.habit))
-                    elif today == startdate_week_end + datetime.timedelta(days=1) and last_completion > startdate_weekly_str:
-                        results.append((2, habit.habit))
-                    elif today >= startdate_week_end + datetime.timedelta(days=1) and last_completion < startdate_weekly_str:
-                        results.append((3, habit.habit))
-                    
-        return results
+    for habit in database.due_habits(db, today):
+        today = local_days[habit_zones.get(habit.habit, user_zone)]
+        schedule = schedules.parse(habit.periodicity)
+        last_completion = database.day_number(habit.datetime_completed) if habit.datetime_completed is not None else None
+        window_start = database.day_number(habit.startdate_weekly) if habit.startdate_weekly is not None else None
+        anchor = database.day_number(habit.starting_date)
+        status, current_start = schedule.status(last_completion, today, window_start, anchor)
+        new_window_start = current_start if schedule.anchored and current_start != window_start else None
+        missed = schedule.missed_periods(last_completion, today, window_start, anchor)
+        results.append((status, habit.habit, new_window_start, missed))
+        if states is not None:
+            states[habit.habit] = (habit.completed, habit.datetime_completed, habit.startdate_weekly, habit.streak)
+    return results
+
+
+def plan_rollover(db_name = None, today = None):
+    """
+    Work out the changes of the rollover without writing any of them.
 
-    else:
-        pass
-
-def update_check_daily_results(db_name = None):
-    results = update_check_daily(db_name)
-    for result, habit in results:
-        habit = model.Habit(habit)
-        if result == 1:
-            console.print(f"\nThe habit '{habit.habit}' is checked off !\n")
-        elif result == 2:
-            model.Habit.set_habit_uncomplete(habit, db_name)
-        elif result == 3:
-            console.print(f"\nOhnoo...The habit '{habit.habit}' was not checked off in time ! Your streak will be reseted !\n")
-            model.Habit.reset_streak(habit, db_name)
-            model.Habit.set_habit_uncomplete(habit, db_name)
-        else:
-            console.print(f"\nThe habit '{habit.habit}' has not been checked off yet !\n")
-                 
+    A day that was already rolled over in every time zone is skipped after one read of the rollover watermark.
+
+    Args:
+        db_name (str, optional): The name of the database file. Defaults to 'habit.db'.
+        today (str, optional): The day to roll over to, in the format '%d %b %Y'. Defaults to today.
+
+    Returns:
+        model.RolloverPlan: The plan, or None if the day was already rolled over.
 
-def update_check_weekly_results(db_name = None):
     """
-    Updates the completion status and streaks for habits with a "Daily" or "Weekly" periodicity.
-    
-    Prints messages indicating the status of each habit. Additionally the habit will be set to uncompleted, or will be reseted according to the result.
+    db = database.connect_db(db_name)
+    local_days = rollover_days(db, today)[0]
+    if not database.rollover_pending(db, local_days):
+        return None
+    states = {}
+    results = update_check(db_name, today, states)
+    return model.RolloverPlan(local_days, results, states)
+
+
+def update_check_results(db_name = None, today = None, verbose = False):
+    """
+    Updates the completion status and streaks of all habits according to their rollover status.
+
+    Prints a summary of the status of the habits. Additionally the habit will be set to uncompleted, or will be reseted according to the result,
+    and the window of habits with an anchored periodicity (e.g. "Weekly") moves on to the current period.
+    However long the habit was left alone, the periods it missed are recorded in the habit history in one go.
+    The changes are planned first (see plan_rollover) and then written in one transaction.
 
     Args:
+        db_name (str, optional): The name of the database file. Defaults to 'habit.db'.
+        today (str, optional): The day to roll over to, in the format '%d %b %Y'. Defaults to today.
+        verbose (bool, optional): List every habit that was not checked off yet or broke, instead of the first few. Defaults to False.
+
+    Returns:
         None
-    
+
+    """
+    plan = plan_rollover(db_name, today)
+    if plan is None:
+        return
+    db = database.connect_db(db_name)
+    # The rollover runs once a day, which is often enough to forget the check-off requests nobody can retry anymore.
+    database.purge_request_results(db)
+    stale = database.apply_rollover(db, plan)
+    if stale:
+        # These habits changed after they were planned, e.g. they were checked off, so they are planned again on their own.
+        retry = plan_rollover(db_name, today)
+        retry = retry.only(stale) if retry is not None else model.RolloverPlan(plan.local_days)
+        database.apply_rollover(db, retry)
+        plan = model.RolloverPlan(plan.local_days, plan.only({habit for _, habit in plan.statuses} - set(stale)).results + retry.results)
+    if plan.statuses:
+        console.print(rollover_summary(db_name or "habit.db", plan, verbose))
+
+
+ROLLOVER_LIST_LIMIT = 10
+
+def rollover_summary(db_name, plan, verbose = False):
+    """
+    Summarize the status of the habits after a rollover, to be printed in one go.
+
+    Args:
+        db_name (str): The name of the database file.
+        plan (model.RolloverPlan): The applied plan.
+        verbose (bool, optional): List every habit that was not checked off yet or broke. Defaults to listing the first ROLLOVER_LIST_LIMIT.
+
+    Returns:
+        rich.console.Group: The counts of the habits per status and the habits at risk and with a broken streak.
+
+    """
+    names = {status: [habit for result, habit in plan.statuses if result == status] for status in
+        (schedules.CHECKED_OFF, schedules.NEW_PERIOD, schedules.NOT_CHECKED_OFF, schedules.BROKEN)}
+    lines = [Text(f"\nRollover of '{db_name}': {len(names[schedules.CHECKED_OFF])} checked off, {len(names[schedules.NEW_PERIOD])} in a new period, "
+        f"{len(names[schedules.NOT_CHECKED_OFF])} not checked off yet, {len(names[schedules.BROKEN])} broken", style="bold")]
+    capped = False
+    for status, label, style in ((schedules.NOT_CHECKED_OFF, "Not checked off yet, don't loose your streaks", "bright_yellow"),
+            (schedules.BROKEN, "Ohnoo...not checked off in time, the streak is reseted", "bright_red")):
+        habits = names[status]
+        if not habits:
+            continue
+        shown = habits if verbose else habits[:ROLLOVER_LIST_LIMIT]
+        more = f" and {len(habits) - len(shown)} more" if len(shown) < len(habits) else ""
+        capped = capped or bool(more)
+        lines.append(Text(f"{label}: {', '.join(shown)}{more}", style=style))
+    if capped:
+        lines.append(Text("Run 'rollover --verbose' to see all habits.", style="dim"))
+    lines.append(Text(""))
+    return Group(*lines)
+
+
+def print_rollover_plan(db_name, plan):
+    """
+    Print the changes a rollover would make to one database.
+
+    Args:
+        db_name (str): The name of the database file.
+        plan (model.RolloverPlan): The plan, or None if the day was already rolled over.
+
     Returns:
         None
 
     """
-    results = update_check_weekly(db_name)
-    for result, habit in results:
-        habit = model.Habit(habit)
-        if result == 1:
-            console.print(f"\nThe habit '{habit.habit}' is checked off !\n")
-        elif result == 2:
-            model.Habit.set_habit_uncomplete(habit, db_name)
-            model.Habit.set_new_startdate_weekly(habit, db_name)
-        elif result == 3:
-            console.print(f"\nOhnoo...The habit '{habit.habit}' was not checked off in time ! Your streak will be reseted !\n")
-            model.Habit.reset_streak(habit, db_name)
-            model.Habit.set_habit_uncomplete(habit, db_name)
-            model.Habit.set_new_startdate_weekly(habit, db_name)
-        else:
-            console.print(f"\nThe habit '{habit.habit}' has not been checked off yet !\n")
+    if plan is None:
+        console.print(f"\nThe habits of '{db_name}' are already rolled over today !\n")
+        return
+    table = Table(show_header=True, header_style="bold blue",
+        title=f"Rollover of '{db_name}': {len(plan.resets)} resets, {len(plan.uncompletes)} uncompletes, {len(plan.window_moves)} window moves, "
+        f"{sum(len(days) for _, days in plan.missed)} missed periods")
+    table.add_column("Habit", min_width=12, justify="center")
+    table.add_column("Change", min_width=12, justify="center")
+    for habit in plan.resets:
+        table.add_row(habit, "Streak is reseted")
+    for habit in plan.uncompletes:
+        table.add_row(habit, "Set to uncompleted")
+    for habit, day in plan.window_moves:
+        table.add_row(habit, f"Window moves to {database.day_string(day)}")
+    for habit, days in plan.missed:
+        table.add_row(habit, f"{len(days)} missed periods recorded")
+    console.print(table)
 
 
 def analyze_longest_streak_all_habits():
@@ -1130,7 +1690,7 @@ def analyze_longest_streak_all_habits():
     Analyze the longest streak for all habits.
     
     This function retrieves all habits from the database and displays a table with the maximum
-    streak for each habit. It also prints the row with the highest maximum streak. If there are no
+    streak for each habit. It also prints the row with the highest maximum streak, read from the leaderboard index. If there are no
     habits in the database, it displays an error message and raises the `start` function.
 
     Args:
@@ -1150,10 +1710,9 @@ def analyze_longest_streak_all_habits():
         console.print(f"\nError retrieving habits from database: {e}\n")
         return
 
-    if len(analytics.all_habits_log(db)) != 0:
-        results = analytics.all_habits_log(db)
-        results = sorted(results, key=lambda x: x.max_streak, reverse=True)
-        row_with_highest_max_streak = results[0]
+    leaders = analytics.leaderboard(db, k=1)
+    if len(leaders) != 0:
+        row_with_highest_max_streak = leaders[0]
 
         datas = analytics.max_streak_all_habits(db)
         table = Table(title = "\nHABITLOG\n", show_header=True, show_lines=True)
@@ -1172,6 +1731,42 @@ def analyze_longest_streak_all_habits():
         raise start()
 
 
+def analyze_statistics():
+    """
+    Display the materialized statistics of all habits and the aggregates per periodicity.
+
+    Args:
+        None
+
+    Returns:
+        None
+
+    """
+    try:
+        db = database.connect_db()
+    except Exception as e:
+        console.print(f"\nError retrieving habits from database: {e}\n")
+        return
+
+    table = Table(title = "\nHABIT STATISTICS\n", show_header=True, show_lines=True)
+    table.add_column("Habit", min_width=12, justify="center")
+    table.add_column("Periodicity", min_width=12, justify="center")
+    table.add_column("Check-offs", min_width=12, justify="center")
+    table.add_column("Broken_Streaks", min_width=12, justify="center")
+    table.add_column("Streak", min_width=12, justify="center")
+    table.add_column("Max_Streak", min_width=12, justify="center")
+    table.add_column("Last_Completed_Date", min_width=12, justify="center")
+    for stats in analytics.all_habit_stats(db):
+        last_completed_str = '-' if stats.last_completed is None else stats.last_completed
+        table.add_row(stats.habit, stats.periodicity, str(stats.completions), str(stats.resets), str(stats.streak), str(stats.max_streak), last_completed_str)
+    console.print(table)
+
+    for aggregate in analytics.periodicity_stats(db):
+        console.print(f"'{aggregate.periodicity}': {aggregate.habits} habits, {aggregate.completions} check-offs, {aggregate.resets} broken streaks")
+    console.print()
+    keep_analyzing()
+
+
 def analyze_streak_given_habit():
     """
     Analyze the maximum streak for a given habit.
@@ -1211,7 +1806,7 @@ def analyze_streak_given_habit():
 
 def update(db_name = None, today = None):
     """
-    Check the status of daily and weekly habits and update their completion status in the database.
+    Check the status of all habits and update their completion status in the database.
     Then display the results of the update process.
     
     Args:
@@ -1223,10 +1818,7 @@ def update(db_name = None, today = None):
     Raises:
         None
     """
-    update_check_daily(db_name, today)
-    update_check_weekly(db_name, today)
-    update_check_daily_results(db_name)
-    update_check_weekly_results(db_name)
+    update_check_results(db_name)
     
 
 def log():
@@ -1251,7 +1843,7 @@ def show(periodicity: Optional[str] = typer.Argument(None)):
     Display a list of all habits in the database, or a list of habits with a certain periodicity.
 
     Args:
-        periodicity (str): The desired periodicity of the habits to be displayed. Accepted values are "Daily" and "Weekly".
+        periodicity (str): The desired periodicity of the habits to be displayed, e.g. "Daily" or "Weekly". It has to be the periodicity of at least one habit.
 
     Returns:
         None
@@ -1262,11 +1854,8 @@ def show(periodicity: Optional[str] = typer.Argument(None)):
     if periodicity is None:
         show_all()
 
-    elif periodicity == "Daily":
-        show_daily(periodicity)
-
-    elif periodicity == "Weekly":
-        show_weekly(periodicity)
+    elif periodicity in (database.collect_periodicity_choices(database.connect_db()) or []):
+        show_periodicity(periodicity)
 
     else:
         start_without_update()
@@ -1338,7 +1927,7 @@ def manage():
     if len(database.all_habits(db)) > 0:
         manage_question = qt.confirm("Do you want to Check-off your habits ?").ask()
         if manage_question:
-            if database.collect_uncompleted_habits_choices(db) is not None:
+            if get.habit_choices().uncompleted:
                 manage_function()
             else:
                 typer.secho("\nThere are no uncompleted habits in your database !\n",
@@ -1374,7 +1963,7 @@ def analyze():
     if len(database.all_habits(db)) > 0:
         analyze_question = qt.select("What do you want to analyze?",
         choices=["All currently tracked habits", "All habits with same periodicity", "Longest streak all habits",
-        "Longest streak given habit", "Go to start", "Exit"],
+        "Longest streak given habit", "Statistics overview", "Go to start", "Exit"],
         ).ask()
 
     if analyze_question == "All currently tracked habits":
@@ -1389,6 +1978,9 @@ def analyze():
     elif analyze_question == "Longest streak given habit":
         analyze_streak_given_habit()
 
+    elif analyze_question == "Statistics overview":
+        analyze_statistics()
+
     elif analyze_question == "Go to start":
         start_without_update()
 
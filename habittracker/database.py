@@ -1,9 +1,22 @@
 
 import sqlite3
 
-from habittracker import model
+import datetime
+
+import json
+
+import time
+
+import zlib
+
+from habittracker import bitmaps, model, schedules, timezones
 from typing import List
 
+SCHEMA_VERSION = 8
+
+# Seconds a check-off request id is remembered, so a retry within this time returns the first result.
+REQUEST_TTL = 24 * 60 * 60
+
 def connect_db(db_name=None):
     """
     Connect to a database.
@@ -17,6 +30,16 @@ def connect_db(db_name=None):
     """
     db_name = db_name or "habit.db"
     db = sqlite3.connect(db_name)
+    # Only takes effect on a new database; existing ones are converted by vacuum_incrementally. Setting it on an
+    # existing one would still count as a change and invalidate the caches keyed by 'data_version'.
+    if db.execute("PRAGMA page_count").fetchone()[0] == 0:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    db.create_function("day_number", 1, day_number, deterministic=True)
+    db.create_function("expected_checkoffs", 3, schedules.expected_checkoffs, deterministic=True)
+    db.create_function("window_start", 3, schedules.window_start, deterministic=True)
+    db.create_function("period_target", 1, schedules.period_target, deterministic=True)
+    db.create_function("bitmap_add", 2, bitmap_add, deterministic=True)
+    db.create_function("archived_since", 2, archived_since, deterministic=True)
     create_tables(db)
     return db
 
@@ -29,10 +52,18 @@ def create_tables(db):
 
     """
     cur = db.cursor()
+    _rename_legacy_tables(cur)
+    # Every periodicity label is stored once; the habits and the statistics refer to it by its id.
+    cur.execute("""CREATE TABLE IF NOT EXISTS periodicities (
+        id INTEGER PRIMARY KEY,
+        label TEXT NOT NULL UNIQUE
+    )""")
+
     cur.execute("""CREATE TABLE IF NOT EXISTS habitbase (
-        habit TEXT PRIMARY KEY,
+        id INTEGER PRIMARY KEY,
+        habit TEXT NOT NULL COLLATE NOCASE UNIQUE,
         description TEXT,
-        periodicity TEXT,
+        periodicity_id INTEGER REFERENCES periodicities(id),
         starting_date TEXT,
         startdate_weekly TEXT,
         completed INTEGER,
@@ -41,17 +72,497 @@ def create_tables(db):
         max_streak INTEGER
     )""")
 
-    cur.execute("""CREATE TABLE IF NOT EXISTS habitlog (
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_history (
+        habit_id INTEGER,
+        day INTEGER,
+        event TEXT,
+        FOREIGN KEY (habit_id) REFERENCES habitbase(id)
+    )""")
+
+    _create_stats_tables(cur)
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_calendar (
+        habit_id INTEGER,
+        month INTEGER,
+        bits INTEGER DEFAULT 0,
+        PRIMARY KEY (habit_id, month),
+        FOREIGN KEY (habit_id) REFERENCES habitbase(id)
+    ) WITHOUT ROWID""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_deadlines (
+        habit_id INTEGER PRIMARY KEY,
+        deadline INTEGER,
+        FOREIGN KEY (habit_id) REFERENCES habitbase(id)
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_bitmaps (
+        habit_id INTEGER PRIMARY KEY,
+        days BLOB,
+        FOREIGN KEY (habit_id) REFERENCES habitbase(id)
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_archive (
+        habit_id INTEGER,
+        segment_start INTEGER,
+        segment_end INTEGER,
+        count INTEGER,
+        days BLOB,
+        FOREIGN KEY (habit_id) REFERENCES habitbase(id)
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        habit TEXT,
+        event TEXT,
+        day INTEGER,
+        payload TEXT
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS sync_log (
+        hlc TEXT PRIMARY KEY,
+        replica TEXT,
         habit TEXT,
-        completed INT,
+        event TEXT,
+        day INTEGER,
+        payload TEXT
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS sync_log_habit ON sync_log (habit, hlc)")
+    cur.execute("CREATE INDEX IF NOT EXISTS sync_log_replica ON sync_log (replica, hlc)")
+    cur.execute("CREATE INDEX IF NOT EXISTS sync_log_renamed_from ON sync_log (json_extract(payload, '$.renamed_from'), hlc) WHERE event = 'renamed'")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS request_results (
+        request_id TEXT PRIMARY KEY,
+        result TEXT,
+        created INTEGER
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS request_results_created ON request_results (created)")
+    migrate(db)
+    # The mutable state of a habit lives in its habitbase row only; the habitlog is a view of it for older readers.
+    cur.execute("""CREATE VIEW IF NOT EXISTS habitlog AS
+        SELECT habit, completed, streak, datetime_completed, max_streak FROM habitbase""")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_history_habit_day ON habit_history (habit_id, day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_deadlines_deadline ON habit_deadlines (deadline, habit_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_archive_habit_end ON habit_archive (habit_id, segment_end)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_stats_max_streak ON habit_stats (max_streak DESC, habit_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_stats_streak ON habit_stats (streak DESC, habit_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_stats_periodicity_max_streak ON habit_stats (periodicity_id, max_streak DESC, habit_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habit_stats_periodicity_streak ON habit_stats (periodicity_id, streak DESC, habit_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS habitbase_periodicity ON habitbase (periodicity_id)")
+    # Only the habits still open in their period are indexed, which is what the check-off menus and reminders read.
+    cur.execute(f"CREATE INDEX IF NOT EXISTS habitbase_uncompleted ON habitbase (habit) WHERE completed = {model.Completion.UNCOMPLETED:d}")
+    db.commit()
+
+
+def _create_stats_tables(cur):
+    """
+    Create the tables of the materialized statistics.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor of the database.
+    """
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_stats (
+        habit_id INTEGER PRIMARY KEY,
+        periodicity_id INTEGER,
+        completions INTEGER DEFAULT 0,
+        resets INTEGER DEFAULT 0,
         streak INTEGER DEFAULT 0,
-        datetime_completed TIME,
         max_streak INTEGER DEFAULT 0,
-        FOREIGN KEY (habit) REFERENCES habitbase(habit)
+        last_completed INTEGER,
+        started INTEGER,
+        FOREIGN KEY (habit_id) REFERENCES habitbase(id)
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS periodicity_stats (
+        periodicity_id INTEGER PRIMARY KEY,
+        habits INTEGER DEFAULT 0,
+        completions INTEGER DEFAULT 0,
+        resets INTEGER DEFAULT 0
     )""")
+
+
+LEGACY_TABLES = ("habitbase", "habit_history", "habit_stats", "habit_calendar", "habit_deadlines", "habit_bitmaps", "habit_archive")
+
+LEGACY_INDEXES = ("habit_history_habit_day", "habit_deadlines_deadline", "habit_archive_habit_end", "habit_stats_max_streak",
+    "habit_stats_streak", "habit_stats_periodicity_max_streak", "habit_stats_periodicity_streak")
+
+
+def _rename_legacy_tables(cur):
+    """
+    Move the tables of a database from before the integer habit ids out of the way, so the current tables can be
+    created next to them. migrate copies their rows over and drops them.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor of the database.
+    """
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(habitbase)")]
+    if not columns or "id" in columns:
+        return
+    kind = cur.execute("SELECT type FROM sqlite_master WHERE name = 'habitlog'").fetchone()
+    if kind is not None:
+        cur.execute(f"DROP {kind[0].upper()} habitlog")
+    for index in LEGACY_INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {index}")
+    for table in LEGACY_TABLES:
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            cur.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+
+
+def _copy_legacy_tables(cur):
+    """
+    Copy the habits, their history and their archive from the tables renamed by _rename_legacy_tables, giving every
+    habit an integer id in the order the habits were added, and drop the old tables. The statistics, calendar, bitmaps
+    and deadlines are derived from these and rebuilt by migrate.
+
+    Habit names that only differ in case get a number appended, as names are unique regardless of case now.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor of the database.
+    """
+    if not cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_habitbase'").fetchone():
+        return
+    cur.execute("CREATE TEMP TABLE legacy_ids (habit TEXT PRIMARY KEY, id INTEGER)")
+    taken = set()
+    for row in cur.execute("SELECT * FROM legacy_habitbase ORDER BY rowid").fetchall():
+        name, suffix = row[0], 1
+        while name.lower() in taken:
+            suffix += 1
+            name = f"{row[0]}{suffix}"
+        taken.add(name.lower())
+        cur.execute("""INSERT INTO habitbase (habit, description, periodicity_id, starting_date, startdate_weekly, completed,
+            datetime_completed, streak, max_streak) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (name, row[1], _periodicity_id(cur, row[2], create=True)) + tuple(row[3:]))
+        cur.execute("INSERT INTO legacy_ids VALUES (?, ?)", (row[0], cur.lastrowid))
+    # A database of the first versions has no history yet; migrate rebuilds everything from the habitbase then.
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_habit_history'").fetchone():
+        cur.execute("""INSERT INTO habit_history SELECT m.id, h.day, h.event FROM legacy_habit_history h
+            JOIN legacy_ids m ON m.habit = h.habit ORDER BY h.rowid""")
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_habit_archive'").fetchone():
+        cur.execute("""INSERT INTO habit_archive SELECT m.id, a.segment_start, a.segment_end, a.count, a.days FROM legacy_habit_archive a
+            JOIN legacy_ids m ON m.habit = a.habit ORDER BY a.rowid""")
+    cur.execute("DROP TABLE legacy_ids")
+    for table in LEGACY_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS legacy_{table}")
+
+
+def _encode_periodicities(cur):
+    """
+    Replace the periodicity labels of the habitbase by the ids of the 'periodicities' table, and recreate the
+    statistics tables that were keyed by label. migrate fills them again.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor of the database.
+    """
+    if "periodicity" in [row[1] for row in cur.execute("PRAGMA table_info(habitbase)")]:
+        cur.execute("""INSERT OR IGNORE INTO periodicities (label) SELECT periodicity FROM habitbase
+            WHERE periodicity IS NOT NULL GROUP BY periodicity ORDER BY MIN(id)""")
+        cur.execute("ALTER TABLE habitbase ADD COLUMN periodicity_id INTEGER REFERENCES periodicities(id)")
+        cur.execute("UPDATE habitbase SET periodicity_id = (SELECT id FROM periodicities WHERE label = habitbase.periodicity)")
+        cur.execute("ALTER TABLE habitbase DROP COLUMN periodicity")
+    for table in ("habit_stats", "periodicity_stats"):
+        if "periodicity" in [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]:
+            cur.execute(f"DROP TABLE {table}")
+    _create_stats_tables(cur)
+
+
+def migrate(db):
+    """
+    Bring an existing database up to the current schema version.
+
+    The version is kept in SQLite's 'user_version' pragma, so a database that is already up to date costs a single pragma read.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    """
+    cur = db.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    if version < 7:
+        _copy_legacy_tables(cur)
+    if version < 8:
+        _encode_periodicities(cur)
+    if version < 2:
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(habit_stats)")]
+        if "started" not in columns:
+            cur.execute("ALTER TABLE habit_stats ADD COLUMN started INTEGER")
+        rebuild_habit_stats(db)
+    if version < 3:
+        rebuild_habit_calendar(db)
+    if version < 4:
+        rebuild_habit_deadlines(db)
+    if version < 5:
+        rebuild_habit_bitmaps(db)
+    if version < 6:
+        # The habitlog table only duplicated the state of the habitbase, which the app has always read from.
+        if cur.execute("SELECT type FROM sqlite_master WHERE name = 'habitlog'").fetchone() == ("table",):
+            cur.execute("DROP TABLE habitlog")
+    if version < 7:
+        # The derived tables were recreated empty for the integer habit ids.
+        rebuild_habit_stats(db)
+        rebuild_habit_calendar(db)
+        rebuild_habit_deadlines(db)
+        rebuild_habit_bitmaps(db)
+    if version < 8:
+        rebuild_habit_stats(db)
+    if version < SCHEMA_VERSION:
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def day_number(date_str):
+    """
+    Convert a date string in the format '%d %b %Y' into a day number (proleptic Gregorian ordinal).
+
+    Args:
+        date_str (str): The date, e.g. '04 Dec 2022'.
+
+    Returns:
+        int: The day number of the date.
+    """
+    return datetime.datetime.strptime(date_str, "%d %b %Y").date().toordinal()
+
+
+def calendar_position(day):
+    """
+    Locate a day number in the monthly completion bitmaps.
+
+    Args:
+        day (int): The day number.
+
+    Returns:
+        tuple: The month key (year * 12 + month - 1) and the bit of the day inside the month (day of month - 1).
+    """
+    date = datetime.date.fromordinal(day)
+    return date.year * 12 + date.month - 1, date.day - 1
+
+
+def day_string(day):
+    """
+    Convert a day number back into a date string in the format '%d %b %Y'.
+
+    Args:
+        day (int): The day number.
+
+    Returns:
+        str: The formatted date, or None if no day number is given.
+    """
+    return datetime.date.fromordinal(day).strftime("%d %b %Y") if day is not None else None
+
+
+def get_setting(db, key, default=None):
+    """
+    Read a setting of the user from the 'settings' table.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        key (str): The name of the setting.
+        default (str, optional): The value if the setting is not set. Defaults to None.
+
+    Returns:
+        str: The value of the setting.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT value FROM settings WHERE key = ?", (key,))
+    result = cur.fetchone()
+    return result[0] if result is not None else default
+
+
+def set_setting(db, key, value):
+    """
+    Store a setting of the user in the 'settings' table.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        key (str): The name of the setting.
+        value (str): The new value, or None to remove the setting.
+    """
+    cur = db.cursor()
+    if value is None:
+        cur.execute("DELETE FROM settings WHERE key = ?", (key,))
+    else:
+        cur.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, value))
     db.commit()
 
 
+def timezone_settings(db):
+    """
+    Read the time zone of the user and the time zones of single habits in one query.
+
+    The time zone of the user is stored under the key 'timezone', the time zone of a habit under 'timezone:<habit>'.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        tuple: The time zone of the user, or None for the local time of the machine, and a dict of the habits with their own time zone.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT key, value FROM settings WHERE key = 'timezone' OR key LIKE 'timezone:%'")
+    user_zone, habit_zones = None, {}
+    for key, value in cur.fetchall():
+        if key == "timezone":
+            user_zone = value
+        else:
+            habit_zones[key[len("timezone:"):]] = value
+    return user_zone, habit_zones
+
+
+def timezone_of(db, habit=None):
+    """
+    Find the time zone a habit, or the user, counts days in.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str, optional): The habit. Defaults to the time zone of the user.
+
+    Returns:
+        str: The IANA name of the time zone, or None for the local time of the machine.
+    """
+    user_zone = get_setting(db, "timezone")
+    return get_setting(db, f"timezone:{habit}", user_zone) if habit is not None else user_zone
+
+
+def local_today(db, habit=None, timestamp=None):
+    """
+    Find the current date in the time zone of a habit or the user.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str, optional): The habit. Defaults to the time zone of the user.
+        timestamp (float, optional): Seconds since the epoch. Defaults to now.
+
+    Returns:
+        datetime.date: The local date.
+    """
+    return timezones.today(timezone_of(db, habit), timestamp)
+
+
+def rollover_pending(db, local_days):
+    """
+    Check whether the rollover still has to run, with a single read of the rollover watermark.
+
+    The watermark holds the last day the rollover ran for in every time zone, under the key 'rollover_watermark'.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        local_days (dict): The current day number in every time zone the habits count days in, keyed by the
+            IANA name of the zone, or None for the local time of the machine.
+
+    Returns:
+        bool: Whether the current day of any of the time zones was not rolled over yet.
+    """
+    watermark = json.loads(get_setting(db, "rollover_watermark", "{}"))
+    return any(day > watermark.get(zone or "", -1) for zone, day in local_days.items())
+
+
+HABIT_SELECT = """SELECT b.id, b.habit, b.description, p.label, b.starting_date, b.startdate_weekly, b.completed,
+    b.datetime_completed, b.streak, b.max_streak FROM habitbase b LEFT JOIN periodicities p ON p.id = b.periodicity_id"""
+
+def habit_from_row(row):
+    """
+    Build a habit from a row of the habitbase selected with HABIT_SELECT.
+
+    Args:
+        row (tuple): The row.
+
+    Returns:
+        model.Habit: The habit.
+    """
+    return model.Habit(*row[1:], id=row[0])
+
+def _periodicity_id(cur, label, create=False):
+    """
+    Look up the id of a periodicity label.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor of the database.
+        label (str): The periodicity, e.g. 'Daily'.
+        create (bool, optional): Whether to add the label if it is new. Defaults to False.
+
+    Returns:
+        int: The id of the label, or None if it is unknown and not created.
+    """
+    row = cur.execute("SELECT id FROM periodicities WHERE label = ?", (label,)).fetchone()
+    if row is None and create and label is not None:
+        cur.execute("INSERT INTO periodicities (label) VALUES (?)", (label,))
+        return cur.lastrowid
+    return row[0] if row is not None else None
+
+def _habit_row(cur, habit):
+    """
+    Resolve a habit name, in any case, or an id to the id and the stored name.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor of the database.
+        habit (str or int): The name or the id of the habit.
+
+    Returns:
+        tuple: The id and the stored name, or None and the given habit if there is no such habit.
+    """
+    if isinstance(habit, int):
+        row = cur.execute("SELECT id, habit FROM habitbase WHERE id = ?", (habit,)).fetchone()
+    else:
+        row = cur.execute("SELECT id, habit FROM habitbase WHERE habit = ?", (habit,)).fetchone()
+    return row if row is not None else (None, habit)
+
+def habit_id(db, habit):
+    """
+    Look up the id of a habit by its name, ignoring case.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The name of the habit.
+
+    Returns:
+        int: The id of the habit, or None if there is no such habit.
+    """
+    return _habit_row(db.cursor(), habit)[0]
+
+def habit_by_id(db, habit_id):
+    """
+    Look up a habit by its id.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit_id (int): The id of the habit.
+
+    Returns:
+        model.Habit: The habit, or None if there is no such habit.
+    """
+    cur = db.cursor()
+    cur.execute(HABIT_SELECT + " WHERE b.id = ?", (habit_id,))
+    row = cur.fetchone()
+    return habit_from_row(row) if row is not None else None
+
+def rename_habit(db, habit, new_name):
+    """
+    Rename a habit. Everything else refers to the habit by its id, so only its habitbase row and its time zone
+    setting change; the change feed records the rename.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str or int): The current name or the id of the habit.
+        new_name (str): The new name.
+
+    Raises:
+        ValueError: If there is no such habit.
+        sqlite3.IntegrityError: If another habit already has the new name, ignoring case.
+    """
+    cur = db.cursor()
+    habit_id, old_name = _habit_row(cur, habit)
+    if habit_id is None:
+        raise ValueError(f"Unknown habit '{habit}'")
+    try:
+        cur.execute("UPDATE habitbase SET habit = ? WHERE id = ?", (new_name, habit_id))
+    except sqlite3.IntegrityError:
+        db.rollback()
+        raise
+    cur.execute("UPDATE settings SET key = ? WHERE key = ?", (f"timezone:{new_name}", f"timezone:{old_name}"))
+    _record_change(cur, new_name, "renamed", datetime.date.today().toordinal(), renamed_from=old_name)
+    db.commit()
+
 def insert_habit(db, habit, description, periodicity, starting_date, startdate_weekly, completed, datetime_completed, streak, max_streak):
     """
     Insert a new habit into the 'habitbase' table in the database.
@@ -68,10 +579,33 @@ def insert_habit(db, habit, description, periodicity, starting_date, startdate_w
         streak (int): The current streak of consecutive days the habit has been completed.
         max_streak (int): The longest streak of consecutive days the habit has been completed.
 
+    Returns:
+        int: The id of the new habit.
+
+    Raises:
+        sqlite3.IntegrityError: If there is a habit with the same name already, ignoring case.
+
     """
-    cur = db.cursor()
-    cur.execute("INSERT INTO habitbase VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (habit, description, periodicity, starting_date, startdate_weekly, completed, datetime_completed, streak, max_streak))
+    try:
+        habit_id = _insert_habit(db.cursor(), habit, description, periodicity, starting_date, startdate_weekly, completed, datetime_completed, streak, max_streak)
+    except sqlite3.IntegrityError:
+        db.rollback()
+        raise
     db.commit()
+    return habit_id
+
+def _insert_habit(cur, habit, description, periodicity, starting_date, startdate_weekly, completed, datetime_completed, streak, max_streak):
+    """Insert a new habit as insert_habit does, without committing, and return its id."""
+    periodicity_id = _periodicity_id(cur, periodicity, create=True)
+    cur.execute("""INSERT INTO habitbase (habit, description, periodicity_id, starting_date, startdate_weekly, completed, datetime_completed, streak, max_streak)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (habit, description, periodicity_id, starting_date, startdate_weekly, completed, datetime_completed, streak, max_streak))
+    habit_id = cur.lastrowid
+    cur.execute("INSERT OR REPLACE INTO habit_stats (habit_id, periodicity_id, streak, max_streak, started) VALUES (?, ?, ?, ?, ?)", (habit_id, periodicity_id, streak, max_streak, day_number(starting_date)))
+    cur.execute("INSERT OR IGNORE INTO periodicity_stats (periodicity_id) VALUES (?)", (periodicity_id,))
+    cur.execute("UPDATE periodicity_stats SET habits = habits + 1 WHERE periodicity_id = ?", (periodicity_id,))
+    _refresh_deadline(cur, habit_id)
+    _record_change(cur, habit, "added", day_number(starting_date), description=description, periodicity=periodicity)
+    return habit_id
 
 def delete_habit(db, habit):
     """
@@ -79,12 +613,23 @@ def delete_habit(db, habit):
 
     Args:
         db (sqlite3.Connection): A connection to the database.
-        habit (str): The name of the habit to be deleted.
+        habit (str or int): The name or the id of the habit to be deleted.
     """
-    cur = db.cursor()
-    cur.execute("DELETE FROM habitbase WHERE habit = ?", (habit,))
+    _delete_habit(db.cursor(), habit)
     db.commit()
-    reset_log(db, habit)
+
+def _delete_habit(cur, habit):
+    """Delete a habit as delete_habit does, without committing."""
+    habit_id, habit = _habit_row(cur, habit)
+    cur.execute("""UPDATE periodicity_stats SET habits = habits - 1,
+        completions = completions - COALESCE((SELECT completions FROM habit_stats WHERE habit_id = ?), 0),
+        resets = resets - COALESCE((SELECT resets FROM habit_stats WHERE habit_id = ?), 0)
+        WHERE periodicity_id = (SELECT periodicity_id FROM habit_stats WHERE habit_id = ?)""", (habit_id, habit_id, habit_id))
+    for table in ("habit_stats", "habit_history", "habit_archive", "habit_calendar", "habit_bitmaps", "habit_deadlines"):
+        cur.execute(f"DELETE FROM {table} WHERE habit_id = ?", (habit_id,))
+    cur.execute("DELETE FROM settings WHERE key = ?", (f"timezone:{habit}",))
+    cur.execute("DELETE FROM habitbase WHERE id = ?", (habit_id,))
+    _record_change(cur, habit, "deleted", datetime.date.today().toordinal())
 
 def all_habits(db) -> List[model.Habit]:
     """
@@ -97,22 +642,22 @@ def all_habits(db) -> List[model.Habit]:
         List[model.Habit]: A list of `Habit` objects representing the habits in the 'habitbase' table.
     """
     cur = db.cursor()
-    cur.execute("SELECT * FROM habitbase")
+    cur.execute(HABIT_SELECT)
     results = cur.fetchall()
     habits = []
     for result in results:
-        habits.append(model.Habit(*result))
+        habits.append(habit_from_row(result))
     return habits 
 
 def all_log(db) -> List[model.LogEntry]:
     """
-    Retrieve all log entries from the 'habitlog' table in the database.
+    Retrieve all log entries from the 'habitlog' view of the habitbase.
 
     Args:
         db (sqlite3.Connection): A connection to the database.
 
     Returns:
-        List[model.LogEntry]: A list of `LogEntry` objects representing the log entries in the 'habitlog' table.
+        List[model.LogEntry]: A list of `LogEntry` objects representing the log entries in the 'habitlog' view.
     """
     cur = db.cursor()
     cur.execute("SELECT * FROM habitlog")
@@ -132,26 +677,26 @@ def certain_periodicity(db, periodicity) -> List[model.Habit]:
         List[model.Habit]: A list of `Habit` objects representing the habits with the specified periodicity in the 'habitbase' table.
     """
     cur = db.cursor()
-    cur.execute("SELECT * FROM habitbase WHERE periodicity = ?", (periodicity,))
+    cur.execute(HABIT_SELECT + " WHERE b.periodicity_id = (SELECT id FROM periodicities WHERE label = ?)", (periodicity,))
     results = cur.fetchall()
     periodicitys = []
     for result in results:
-        periodicitys.append(model.Habit(*result))
+        periodicitys.append(habit_from_row(result))
     return periodicitys
 
-def periodicity_of_habit(db, habit):
+def periodicity_of_habit(db, habit_id):
     """
     Retrieve the periodicity of a habit from the 'habitbase' table in the database.
 
     Args:
         db (sqlite3.Connection): A connection to the database.
-        habit (str): The name of the habit.
+        habit_id (int): The id of the habit.
 
     Returns:
         str: The periodicity of the habit.
     """
     cur = db.cursor()
-    cur.execute("SELECT periodicity FROM habitbase WHERE habit = ?", (habit,))
+    cur.execute("SELECT p.label FROM habitbase b JOIN periodicities p ON p.id = b.periodicity_id WHERE b.id = ?", (habit_id,))
     result = cur.fetchone()
     return result[0]
 
@@ -167,104 +712,59 @@ def habit_existing_check(db, habit):
         bool: `True` if the habit exists, `False` if it does not.
     """
     cur = db.cursor()
-    cur.execute("SELECT * FROM habitbase WHERE habit = ?", (habit,))
+    cur.execute("SELECT 1 FROM habitbase WHERE habit = ?", (habit,))
     result = cur.fetchone()
     return True if result is not None else False
 
-def habit_completed_check(db, habit):
+def habit_completed_check(db, habit_id):
     """
     Check the completion status of a habit in the 'habitbase' table in the database.
 
     Args:
         db (sqlite3.Connection): A connection to the database.
-        habit (str): The name of the habit.
+        habit_id (int): The id of the habit.
 
     Returns:
         int: The completion status of the habit. 1 if the habit is not completed, 2 if it is.
     """
     cur = db.cursor()
-    cur.execute("SELECT completed FROM habitlog WHERE habit = ?", (habit,))
+    cur.execute("SELECT completed FROM habitbase WHERE id = ?", (habit_id,))
     completed = cur.fetchone()[0]
     return completed
 
-def insert_habitlog(db, habit, completed, streak, datetime_completed, max_streak):
-    """
-    Insert a new log entry for a habit into the 'habitlog' table in the database.
-
-    Args:
-        db (sqlite3.Connection): A connection to the database.
-        habit (str): The name of the habit.
-        completed (int): The completion status of the habit.
-        streak (int): The current streak count for the habit.
-        datetime_completed (str): The date and time that the habit was completed.
-        max_streak (int): The maximum streak count for the habit.
-    """
-    cur = db.cursor()
-    cur.execute("INSERT INTO habitlog VALUES (?, ?, ?, ?, ?)", (habit, completed, streak, datetime_completed, max_streak))
-    db.commit()
-
-def update_habitlog(db, habit, completed, streak, datetime_completed, max_streak):
-    """
-    Update the log entry for a habit in the 'habitlog' table in the database.
-
-    Args:
-        db (sqlite3.Connection): A connection to the database.
-        habit (str): The name of the habit.
-        completed (int): The completion status of the habit.
-        streak (int): The current streak count for the habit.
-        datetime_completed (str): The date and time that the habit was completed.
-        max_streak (int): The maximum streak count for the habit.
-    """
-    cur = db.cursor()
-    cur.execute("UPDATE habitlog SET completed = ?, streak = ?, datetime_completed = ?, max_streak = ? WHERE habit = ?", (completed, streak, datetime_completed, max_streak, habit))
-    db.commit()
-
-def set_habitlog_uncompleted(db, habit, completed):
-    """
-    Set the completion status of a habit's log entry in the 'habitlog' table to incomplete.
-
-    Args:
-        db (sqlite3.Connection): A connection to the database.
-        habit (str): The name of the habit.
-        completed (int): The completion status of the habit.
-    """
-    cur = db.cursor()
-    cur.execute("UPDATE habitlog SET completed = ? WHERE habit = ?", (completed, habit))
-    db.commit()
-
-def streak_count(db, habit):
+def streak_count(db, habit_id):
     """
-    Given a database connection object (db) and a habit name, returns the current streak count for the habit from 'habitbase' table.
+    Given a database connection object (db) and a habit id, returns the current streak count for the habit from 'habitbase' table.
     If no streak count is found, returns None.
     If there is an sqlite3 error, it prints the error and returns None
     
     :param db: sqlite3 database connection object
     :type db: sqlite3.Connection
-    :param habit: name of the habit to retrieve streak count for
-    :type habit: str
+    :param habit_id: id of the habit to retrieve streak count for
+    :type habit_id: int
     :return: the current streak count for the habit, or None if not found or an error occurred
     :rtype: int or None
     """
     cur = db.cursor()
-    cur.execute("SELECT streak FROM habitbase WHERE habit = ?", (habit,))
+    cur.execute("SELECT streak FROM habitbase WHERE id = ?", (habit_id,))
     count = cur.fetchone()
     return count[0]
 
 
-def max_streak_count(db, habit):
+def max_streak_count(db, habit_id):
     """
     Retrieve the maximum streak count for a habit from the 'habitbase' table in the database.
     
     :param db: sqlite3 database connection object
     :type db: sqlite3.Connection
-    :param habit: name of the habit to retrieve maximum streak count for
-    :type habit: str
+    :param habit_id: id of the habit to retrieve maximum streak count for
+    :type habit_id: int
     :return: the maximum streak count for the habit, or None if not found or an error occurred
     :rtype: int or None
     """
     cur = db.cursor()
     try:
-        cur.execute("SELECT max_streak FROM habitbase WHERE habit = ?", (habit,))
+        cur.execute("SELECT max_streak FROM habitbase WHERE id = ?", (habit_id,))
         count = cur.fetchone()
         if count:
             return count[0]
@@ -274,70 +774,472 @@ def max_streak_count(db, habit):
         print(e)
         return None
 
-def reset_habitlog_streak(db, habit):
-    cur = db.cursor()
-    cur.execute("UPDATE habitlog SET streak = 0 WHERE habit = ?", (habit,))
-    db.commit()
-
-def reset_habitbase_streak(db, habit):
-    cur = db.cursor()
-    cur.execute("UPDATE habitbase SET streak = 0 WHERE habit = ?", (habit,))
-    db.commit()
-
-def update_habit_streak(db, habit, streak, max_streak, datetime_completed = None):
+def reset_habitbase_streak(db, habit, day=None):
     """
-    Updates the streak and maximum streak of a habit in the habitbase table.
-    If a value for datetime_completed is provided, it also updates the datetime_completed column in the habitbase table.
-    
+    Reset the streak of a habit in the habitbase table. A running streak that breaks is recorded in the habit history and statistics.
+
     Parameters:
     db (sqlite3.Connection): The database connection object.
-    habit (str): The habit to update.
-    streak (int): The current streak for the habit.
-    max_streak (int): The maximum streak for the habit.
-    datetime_completed (datetime.datetime, optional): The date and time the habit was completed. Defaults to None.
-    
+    habit (str): The habit to reset.
+    day (int, optional): The day number of the reset. Defaults to today.
+
     Returns:
     None
-
     """
     cur = db.cursor()
-    cur.execute("UPDATE habitbase SET streak = ?, max_streak = ?, datetime_completed = ?  WHERE habit = ?", (streak, max_streak, datetime_completed, habit))
+    habit_id, habit = _habit_row(cur, habit)
+    if _reset_streak(cur, habit_id, habit, day):
+        _refresh_deadline(cur, habit_id)
     db.commit()
 
-def reset_log(db, habit):
+def _reset_streak(cur, habit_id, habit, day=None):
+    """Reset the streak of a habit as reset_habitbase_streak does, without committing or refreshing its deadline, and return whether it had a streak."""
+    day = day if day is not None else datetime.date.today().toordinal()
+    cur.execute("UPDATE habitbase SET streak = 0 WHERE id = ? AND streak > 0", (habit_id,))
+    if cur.rowcount == 0:
+        return False
+    cur.execute("INSERT INTO habit_history VALUES (?, ?, 'reset')", (habit_id, day))
+    cur.execute("UPDATE habit_stats SET streak = 0, resets = resets + 1 WHERE habit_id = ?", (habit_id,))
+    cur.execute("UPDATE periodicity_stats SET resets = resets + 1 WHERE periodicity_id = (SELECT periodicity_id FROM habit_stats WHERE habit_id = ?)", (habit_id,))
+    _record_change(cur, habit, "reset", day)
+    return True
+
+def check_off_habit(db, habit, datetime_completed):
     """
-    Deletes all rows from the habitlog table for a given habit.
-    
+    Check off a habit, completing its current period, in a single statement.
+
+    The streak is incremented by SQLite itself, so concurrent check-offs cannot lose an increment, and the guard
+    only lets the first check-off of a period through: another one in the same period changes nothing.
+
     Parameters:
     db (sqlite3.Connection): The database connection object.
-    habit (str): The habit to reset the log for.
-    
+    habit (str or int): The name or the id of the habit to check off.
+    datetime_completed (str): The date of the check-off in the format '%d %b %Y'.
+
     Returns:
-    None
+    tuple: The new streak and longest streak, or None if the period was already completed or there is no such habit.
     """
-    cur = db.cursor()
-    cur.execute("DELETE FROM habitlog WHERE habit = ?", (habit,))
+    result = _complete_period(db.cursor(), habit, datetime_completed)
     db.commit()
+    return result
+
+# The first day of the window the check-off day ':day' falls into, for a row of the habitbase.
+CHECKOFF_WINDOW = """window_start((SELECT label FROM periodicities WHERE id = periodicity_id), :day,
+    day_number(COALESCE(startdate_weekly, starting_date)))"""
 
-def habit_completed_time(db, habit):
+# The check-offs of a row of the habitbase in that window, in the habit history and the archive.
+CHECKOFFS_IN_WINDOW = f"""((SELECT COUNT(*) FROM habit_history h WHERE h.habit_id = habitbase.id AND h.event = 'completed' AND h.day >= {CHECKOFF_WINDOW})
+    + COALESCE((SELECT SUM(archived_since(a.days, {CHECKOFF_WINDOW})) FROM habit_archive a WHERE a.habit_id = habitbase.id AND a.segment_end >= {CHECKOFF_WINDOW}), 0))"""
+
+def _open_period(habit):
     """
-    Returns the datetime_completed for the most recent completion of the habit from the habitlog table.
-    
-    Parameters:
-    db (sqlite3.Connection): The database connection object.
-    habit (str): The habit to get the completion time for.
-    
-    Returns:
-    datetime.datetime: The datetime_completed for the most recent completion of the habit.
+    Return the condition on the habitbase that selects a habit, by its name or its id ':habit', whose window of the day
+    ':day' is not completed yet. A day before the last completed one never qualifies, so a back-dated check-off cannot
+    move the last completion backwards.
     """
-    cur = db.cursor()
-    cur.execute("SELECT datetime_completed FROM habitbase WHERE habit = ?", (habit,))
-    result = cur.fetchone()
-    return result[0]
+    return f"""{"id" if isinstance(habit, int) else "habit"} = :habit AND (datetime_completed IS NULL
+        OR day_number(datetime_completed) <= :day AND (completed = {model.Completion.UNCOMPLETED:d} OR day_number(datetime_completed) < {CHECKOFF_WINDOW}))"""
 
-def complete_habit(db, habit):
+def _complete_period(cur, habit, datetime_completed):
     """
-    Mark the habit as completed in the database.
+    Complete the current period of a habit as check_off_habit does, without committing.
+
+    The habit is resolved, its window is checked and the check-off target of its periodicity is compared with the
+    check-offs of the window, all by the guarded update itself, which returns everything the follow-up writes need.
+
+    Parameters:
+    cur (sqlite3.Cursor): A cursor of the transaction the check-off belongs to.
+    habit (str or int): The name or the id of the habit to check off.
+    datetime_completed (str): The date of the check-off in the format '%d %b %Y'.
+
+    Returns:
+    tuple: The new streak and longest streak, or None if the period was already completed, the check-off does not
+    reach the target of the period yet or there is no such habit.
+    """
+    day = day_number(datetime_completed)
+    cur.execute(f"""UPDATE habitbase SET streak = streak + 1, max_streak = MAX(max_streak, streak + 1),
+        completed = {model.Completion.COMPLETED:d}, datetime_completed = :date
+        WHERE {_open_period(habit)} AND (period_target((SELECT label FROM periodicities WHERE id = periodicity_id)) = 1
+            OR period_target((SELECT label FROM periodicities WHERE id = periodicity_id)) <= 1 + {CHECKOFFS_IN_WINDOW})
+        RETURNING id, habit, periodicity_id, (SELECT label FROM periodicities WHERE id = periodicity_id), starting_date, startdate_weekly, streak, max_streak""",
+        {"date": datetime_completed, "habit": habit, "day": day})
+    rows = cur.fetchall()
+    if not rows:
+        return None
+    habit_id, habit, periodicity_id, periodicity, starting_date, startdate_weekly, streak, max_streak = rows[0]
+    _record_completion(cur, habit_id, habit, day, periodicity_id, streak, max_streak)
+    _store_deadline(cur, habit_id, periodicity, starting_date, startdate_weekly, model.Completion.COMPLETED, datetime_completed, streak)
+    return streak, max_streak
+
+def submit_check_off(db, habit, datetime_completed, request_id=None):
+    """
+    Check off a habit once per request id, so a client can safely retry a check-off that timed out.
+
+    The request id is claimed, the check-off is applied and its result is stored in one transaction. A request id
+    that was already used returns the stored result and leaves the habit alone. A periodicity that needs several
+    check-offs per period (e.g. "3 Times Per Week") only records the check-off until the last one of the period.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    habit (str or int): The name or the id of the habit to check off.
+    datetime_completed (str): The date of the check-off in the format '%d %b %Y'.
+    request_id (str, optional): The id the client chose for the check-off. Defaults to no deduplication.
+
+    Returns:
+    dict: Whether the check-off was 'recorded', whether it 'completed' the period, and the new 'streak' and
+    'max_streak' of the habit, which are None unless the period was completed. None if the request id was used
+    before but its result is no longer known.
+    """
+    result = _submit_check_off(db.cursor(), habit, datetime_completed, request_id)
+    db.commit()
+    return result
+
+def _submit_check_off(cur, habit, datetime_completed, request_id=None):
+    """Check off a habit as submit_check_off does, without committing, and return the result."""
+    db = cur.connection
+    if request_id is not None:
+        cur.execute("INSERT INTO request_results VALUES (?, NULL, ?) ON CONFLICT (request_id) DO NOTHING", (request_id, int(time.time())))
+        if cur.rowcount == 0:
+            return request_result(db, request_id)
+    result = {"recorded": False, "completed": False, "streak": None, "max_streak": None}
+    streaks = _complete_period(cur, habit, datetime_completed)
+    if streaks is not None:
+        result.update(recorded=True, completed=True, streak=streaks[0], max_streak=streaks[1])
+    else:
+        # Only a check-off that does not reach the target of a periodicity with several check-offs per period is left.
+        day = day_number(datetime_completed)
+        cur.execute(f"""SELECT id, habit, periodicity_id FROM habitbase WHERE {_open_period(habit)}
+            AND period_target((SELECT label FROM periodicities WHERE id = periodicity_id)) > 1""", {"habit": habit, "day": day})
+        row = cur.fetchone()
+        if row is not None:
+            _record_completion(cur, row[0], row[1], day, row[2])
+            result["recorded"] = True
+    if request_id is not None:
+        cur.execute("UPDATE request_results SET result = ? WHERE request_id = ?", (json.dumps(result), request_id))
+    return result
+
+def request_result(db, request_id):
+    """
+    Look up the stored result of a check-off request.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    request_id (str): The id the client chose for the check-off.
+
+    Returns:
+    dict: The result submit_check_off returned for the request, or None if the request id is unknown or expired.
+    """
+    row = db.execute("SELECT result FROM request_results WHERE request_id = ?", (request_id,)).fetchone()
+    return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+def purge_request_results(db, ttl=REQUEST_TTL, now=None):
+    """
+    Forget the check-off requests older than the time to live, using the index on their creation time.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    ttl (int, optional): The seconds a request id is remembered. Defaults to REQUEST_TTL.
+    now (int, optional): The current time in seconds since the epoch. Defaults to now.
+
+    Returns:
+    int: The number of forgotten requests.
+    """
+    now = int(time.time()) if now is None else now
+    cur = db.execute("DELETE FROM request_results WHERE created < ?", (now - ttl,))
+    db.commit()
+    return cur.rowcount
+
+WRITE_OPERATIONS = {"check_off": _submit_check_off, "add": _insert_habit, "delete": _delete_habit}
+
+def apply_writes(db, writes):
+    """
+    Apply a batch of mutations in one transaction, so they share a single commit.
+
+    Every mutation runs in its own savepoint: a mutation that fails is rolled back on its own and does not take
+    the rest of the batch with it.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    writes (list): The mutations, as tuples of the name of an operation of WRITE_OPERATIONS and its arguments
+    after the cursor, e.g. ("check_off", ("Reading", "02 Jan 2023", "req-1")).
+
+    Returns:
+    list: A tuple of the error, or None, and the result of every mutation, in the order of the mutations.
+    None of them is committed if the commit itself fails.
+    """
+    cur = db.cursor()
+    outcomes = []
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for operation, args in writes:
+            cur.execute("SAVEPOINT write")
+            try:
+                outcomes.append((None, WRITE_OPERATIONS[operation](cur, *args)))
+            except Exception as error:
+                cur.execute("ROLLBACK TO write")
+                outcomes.append((error, None))
+            cur.execute("RELEASE write")
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return outcomes
+
+def _record_completion(cur, habit_id, habit, day, periodicity_id=None, streak=None, max_streak=None):
+    """
+    Record a check-off in the habit history, the completion bitmaps and the statistics, without committing.
+
+    Every table is written by a single statement; the bitmap is extended by SQLite itself (see bitmap_add).
+
+    Parameters:
+    cur (sqlite3.Cursor): A cursor of the transaction the check-off belongs to.
+    habit_id (int): The id of the habit that was checked off.
+    habit (str): The name of the habit, for the change feed.
+    day (int): The day number of the check-off.
+    periodicity_id (int, optional): The periodicity of the habit. Defaults to looking it up in the statistics.
+    streak (int, optional): The new streak of the habit, if the check-off completed a period. Defaults to keeping it.
+    max_streak (int, optional): The new longest streak of the habit. Defaults to keeping it.
+
+    Returns:
+    None
+    """
+    cur.execute("INSERT INTO habit_history VALUES (?, ?, 'completed')", (habit_id, day))
+    month, bit = calendar_position(day)
+    cur.execute("""INSERT INTO habit_calendar VALUES (?, ?, ?)
+        ON CONFLICT (habit_id, month) DO UPDATE SET bits = bits | excluded.bits""", (habit_id, month, 1 << bit))
+    cur.execute("""INSERT INTO habit_bitmaps VALUES (?, bitmap_add(NULL, ?))
+        ON CONFLICT (habit_id) DO UPDATE SET days = bitmap_add(days, ?)""", (habit_id, day, day))
+    cur.execute("""UPDATE habit_stats SET completions = completions + 1, last_completed = MAX(COALESCE(last_completed, ?), ?),
+        streak = COALESCE(?, streak), max_streak = COALESCE(?, max_streak) WHERE habit_id = ?""", (day, day, streak, max_streak, habit_id))
+    cur.execute("""UPDATE periodicity_stats SET completions = completions + 1
+        WHERE periodicity_id = COALESCE(?, (SELECT periodicity_id FROM habit_stats WHERE habit_id = ?))""", (periodicity_id, habit_id))
+    _record_change(cur, habit, "checked_off", day)
+
+def _record_change(cur, habit, event, day, **payload):
+    """
+    Append a mutation of a habit to the 'habit_changes' outbox, without committing.
+
+    The row is written by the cursor of the mutation itself, so it is committed or rolled back together with it.
+
+    Parameters:
+    cur (sqlite3.Cursor): A cursor of the transaction the mutation belongs to.
+    habit (str): The habit that changed.
+    event (str): What happened: 'added', 'deleted', 'checked_off', 'reset', 'missed' or 'renamed'.
+    day (int): The day number of the mutation.
+    **payload: Further details of the mutation, stored as JSON.
+
+    Returns:
+    None
+    """
+    cur.execute("INSERT INTO habit_changes (habit, event, day, payload) VALUES (?, ?, ?, ?)", (habit, event, day, json.dumps(payload)))
+
+def _record_missed(cur, habit_id, habit, days):
+    """Record the periods a habit missed in the habit history and the change feed, without committing."""
+    cur.executemany("INSERT INTO habit_history VALUES (?, ?, 'missed')", [(habit_id, day) for day in days])
+    cur.executemany("INSERT INTO habit_changes (habit, event, day, payload) VALUES (?, 'missed', ?, '{}')", [(habit, day) for day in days])
+
+def apply_rollover(db, plan):
+    """
+    Write the changes of a rollover plan in one transaction, together with the rollover watermark.
+
+    Every habit of the plan has its deadline refreshed once, after all its changes. A habit that changed since it was
+    planned, e.g. it was checked off in the meantime, is left alone, and the watermark only moves if no habit was
+    left alone, so the next rollover plans those habits again.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    plan (model.RolloverPlan): The plan to apply.
+
+    Returns:
+    List[str]: The habits that were left alone because they changed since they were planned.
+    """
+    cur = db.cursor()
+    # Nothing can change a habit between the comparison with the plan and the changes.
+    cur.execute("BEGIN IMMEDIATE")
+    habit_ids, stale = {}, []
+    for habit in {habit for _, habit in plan.statuses}:
+        habit_id, name = _habit_row(cur, habit)
+        if habit in plan.states:
+            row = cur.execute("SELECT completed, datetime_completed, startdate_weekly, streak FROM habitbase WHERE id = ?", (habit_id,)).fetchone()
+            if row != tuple(plan.states[habit]):
+                stale.append(habit)
+                continue
+        habit_ids[habit] = (habit_id, name)
+    plan = plan.only(habit_ids) if stale else plan
+    for habit, days in plan.missed:
+        _record_missed(cur, *habit_ids[habit], days)
+    for habit in plan.resets:
+        _reset_streak(cur, *habit_ids[habit])
+    cur.executemany("UPDATE habitbase SET completed = ? WHERE id = ?",
+        [(model.Completion.UNCOMPLETED, habit_ids[habit][0]) for habit in plan.uncompletes])
+    cur.executemany("UPDATE habitbase SET startdate_weekly = ? WHERE id = ?",
+        [(day_string(day), habit_ids[habit][0]) for habit, day in plan.window_moves])
+    for habit_id, _ in habit_ids.values():
+        _refresh_deadline(cur, habit_id)
+    if not stale:
+        watermark = json.loads(get_setting(db, "rollover_watermark", "{}"))
+        for zone, day in plan.local_days.items():
+            watermark[zone or ""] = max(day, watermark.get(zone or "", -1))
+        cur.execute("INSERT OR REPLACE INTO settings VALUES ('rollover_watermark', ?)", (json.dumps(watermark, sort_keys=True),))
+    db.commit()
+    return sorted(stale)
+
+def completions_since(db, habit, day):
+    """
+    Count the check-offs of a habit from a day on.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    habit (str): The habit to count.
+    day (int): The first day number to count.
+
+    Returns:
+    int: The number of check-offs.
+    """
+    cur = db.cursor()
+    habit_id, habit = _habit_row(cur, habit)
+    cur.execute("SELECT COUNT(*) FROM habit_history WHERE habit_id = ? AND day >= ? AND event = 'completed'", (habit_id, day))
+    return cur.fetchone()[0] + len(archived_days(db, habit, start=day).get(habit, []))
+
+def _refresh_deadline(cur, habit_id):
+    """
+    Recompute the deadline of a habit from its row in the habitbase, without committing.
+
+    The deadline is the last day the rollover can leave the habit alone (see schedules.Schedule.deadline). Habits
+    without a deadline are not stored, as nothing happens to them before their next check-off.
+
+    Parameters:
+    cur (sqlite3.Cursor): A cursor of the transaction that changed the habit.
+    habit_id (int): The id of the habit to refresh.
+
+    Returns:
+    None
+    """
+    cur.execute("""SELECT p.label, b.starting_date, b.startdate_weekly, b.completed, b.datetime_completed, b.streak
+        FROM habitbase b JOIN periodicities p ON p.id = b.periodicity_id WHERE b.id = ?""", (habit_id,))
+    row = cur.fetchone()
+    if row is None:
+        cur.execute("DELETE FROM habit_deadlines WHERE habit_id = ?", (habit_id,))
+        return
+    _store_deadline(cur, habit_id, *row)
+
+def _store_deadline(cur, habit_id, periodicity, starting_date, startdate_weekly, completed, datetime_completed, streak):
+    """Store the deadline of a habit computed from the values of its habitbase row, as _refresh_deadline does, without reading the row."""
+    deadline = schedules.parse(periodicity).deadline(
+        day_number(datetime_completed) if datetime_completed is not None else None,
+        completed == model.Completion.COMPLETED,
+        streak or 0,
+        day_number(startdate_weekly) if startdate_weekly is not None else None,
+        day_number(starting_date))
+    if deadline is None:
+        cur.execute("DELETE FROM habit_deadlines WHERE habit_id = ?", (habit_id,))
+    else:
+        cur.execute("INSERT OR REPLACE INTO habit_deadlines VALUES (?, ?)", (habit_id, deadline))
+
+def due_habits(db, today) -> List[model.Habit]:
+    """
+    Retrieve the habits whose deadline has passed, read from the deadline index in deadline order.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    today (int): The current day number.
+
+    Returns:
+    List[model.Habit]: The habits with a deadline before today, earliest deadline first.
+    """
+    cur = db.cursor()
+    cur.execute(HABIT_SELECT + """ JOIN habit_deadlines d ON d.habit_id = b.id
+        WHERE d.deadline < ? ORDER BY d.deadline, b.habit""", (today,))
+    return [habit_from_row(result) for result in cur.fetchall()]
+
+def habits_at_risk(db, day, tenant=None) -> List[model.Reminder]:
+    """
+    Retrieve the habits whose running streak breaks unless they are checked off by a day, read from the deadline index.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    day (int): The last deadline day number to include.
+    tenant (str, optional): The database file to name in the reminders. Defaults to None.
+
+    Returns:
+    List[model.Reminder]: A reminder for every uncompleted habit with a running streak and a deadline up to the day, earliest deadline first.
+    """
+    cur = db.cursor()
+    cur.execute(f"""SELECT b.habit, p.label, b.streak, d.deadline FROM habit_deadlines d JOIN habitbase b ON b.id = d.habit_id
+        JOIN periodicities p ON p.id = b.periodicity_id
+        WHERE d.deadline <= ? AND b.completed = {model.Completion.UNCOMPLETED:d} AND b.streak > 0 ORDER BY d.deadline, b.habit""", (day,))
+    return [model.Reminder(*result, tenant=tenant) for result in cur.fetchall()]
+
+def habit_deadlines(db):
+    """
+    Retrieve the deadlines of all habits that have one.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+
+    Returns:
+    List[tuple]: The deadline day number and the name of every habit, earliest deadline first.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT d.deadline, b.habit FROM habit_deadlines d JOIN habitbase b ON b.id = d.habit_id ORDER BY d.deadline, b.habit")
+    return cur.fetchall()
+
+def changes_since(db, cursor=0, limit=500) -> List[model.Change]:
+    """
+    Read one batch of the habit mutations after a cursor from the 'habit_changes' outbox.
+
+    The sequence numbers are never reused, so a consumer can keep the last one it has seen as its cursor.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    cursor (int, optional): The sequence number of the last change already seen. Defaults to 0, the beginning.
+    limit (int, optional): The maximum number of changes to read. Defaults to 500.
+
+    Returns:
+    List[model.Change]: The changes in the order they happened.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT seq, habit, event, day, payload FROM habit_changes WHERE seq > ? ORDER BY seq LIMIT ?", (cursor, limit))
+    return [model.Change(*result) for result in cur.fetchall()]
+
+def stream_changes(db, cursor=0, batch_size=500):
+    """
+    Read all habit mutations after a cursor, one batch at a time.
+
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    cursor (int, optional): The sequence number of the last change already seen. Defaults to 0, the beginning.
+    batch_size (int, optional): The number of changes read per query. Defaults to 500.
+
+    Returns:
+    Iterator[model.Change]: The changes in the order they happened.
+    """
+    while True:
+        batch = changes_since(db, cursor, batch_size)
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        cursor = batch[-1].seq
+
+def habit_completed_time(db, habit_id):
+    """
+    Returns the datetime_completed for the most recent completion of the habit from the habitbase table.
+    
+    Parameters:
+    db (sqlite3.Connection): The database connection object.
+    habit_id (int): The id of the habit to get the completion time for.
+    
+    Returns:
+    datetime.datetime: The datetime_completed for the most recent completion of the habit.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT datetime_completed FROM habitbase WHERE id = ?", (habit_id,))
+    result = cur.fetchone()
+    return result[0]
+
+def complete_habit(db, habit):
+    """
+    Mark the habit as completed in the database.
 
     Parameters:
     db (sqlite3.Connection): The connection to the habits database.
@@ -347,7 +1249,9 @@ def complete_habit(db, habit):
     None
     """
     cur = db.cursor()
-    cur.execute("UPDATE habitbase SET completed = 2 WHERE habit = ?", (habit,))
+    habit_id = _habit_row(cur, habit)[0]
+    cur.execute("UPDATE habitbase SET completed = ? WHERE id = ?", (model.Completion.COMPLETED, habit_id))
+    _refresh_deadline(cur, habit_id)
     db.commit()
 
 def uncomplete_habit(db, habit):
@@ -362,35 +1266,18 @@ def uncomplete_habit(db, habit):
     None
     """
     cur = db.cursor()
-    cur.execute("UPDATE habitbase SET completed = 1 WHERE habit = ?", (habit,))
+    habit_id = _habit_row(cur, habit)[0]
+    cur.execute("UPDATE habitbase SET completed = ? WHERE id = ?", (model.Completion.UNCOMPLETED, habit_id))
+    _refresh_deadline(cur, habit_id)
     db.commit()
     
-def set_startdate_weekly(db, habit, startdate_weekly):
+def get_startdate_weekly(db, habit_id):
     """
-    This function updates the startdate_weekly in the habitsbase table of the database specified by 'db' for the habit specified by 'habit' with the new startdate_weekly value specified by 'startdate_weekly'.
+    This function retrieves the startdate_weekly from the habitbase table of the database specified by 'db' for the habit specified by 'habit_id'
     
     Arguments:
     db (object) : database object
-    habit (str) : habit name
-    startdate_weekly (str) : new startdate_weekly value
-    
-    Methods called:
-    execute() from cursor object
-    commit() from database object
-    
-    Returns: None
-    """
-    cur= db.cursor()
-    cur.execute("UPDATE habitbase SET startdate_weekly = ? WHERE habit = ?", (startdate_weekly, habit))
-    db.commit()
-
-def get_startdate_weekly(db, habit):
-    """
-    This function retrieves the startdate_weekly from the habitbase table of the database specified by 'db' for the habit specified by 'habit'
-    
-    Arguments:
-    db (object) : database object
-    habit (str) : habit name
+    habit_id (int) : habit id
     
     Methods called:
     execute() from cursor object
@@ -400,17 +1287,17 @@ def get_startdate_weekly(db, habit):
     result[0] (str) : startdate_weekly value of the habit
     """
     cur = db.cursor()
-    cur.execute("SELECT startdate_weekly FROM habitbase WHERE habit = ?", (habit,))
+    cur.execute("SELECT startdate_weekly FROM habitbase WHERE id = ?", (habit_id,))
     result = cur.fetchone()
     return result[0]
 
-def get_starting_date(db, habit):
+def get_starting_date(db, habit_id):
     """
-    This function retrieves the starting_date from the habitbase table of the database specified by 'db' for the habit specified by 'habit'
+    This function retrieves the starting_date from the habitbase table of the database specified by 'db' for the habit specified by 'habit_id'
     
     Arguments:
     db (object) : database object
-    habit (str) : habit name
+    habit_id (int) : habit id
     
     Methods called:
     execute() from cursor object
@@ -420,7 +1307,7 @@ def get_starting_date(db, habit):
     result[0] (str) : starting_date value of the habit
     """
     cur = db.cursor()
-    cur.execute("SELECT starting_date FROM habitbase WHERE habit = ?", (habit,))
+    cur.execute("SELECT starting_date FROM habitbase WHERE id = ?", (habit_id,))
     result = cur.fetchone()
     return result[0]
     
@@ -440,6 +1327,21 @@ def collect_habits_choices(db):
     result = cur.fetchall()
     return [i[0].capitalize() for i in list(result)] if len(result) >0 else None
 
+def collect_periodicity_choices(db):
+    """
+    Collect the periodicities that are in use in the database.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+
+    Returns:
+    List[str] or None: A sorted list of the periodicities of all habits, or None if there are no habits in the database.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT label FROM periodicities WHERE id IN (SELECT periodicity_id FROM habitbase) ORDER BY label")
+    result = cur.fetchall()
+    return [i[0] for i in result] if len(result) > 0 else None
+
 def collect_periodicity_habit_choices(db, periodicity):
     """
     Collect the habit choices from the database with a specific periodicity.
@@ -452,7 +1354,7 @@ def collect_periodicity_habit_choices(db, periodicity):
     List[str] or None: A list of habit choices with the specified periodicity, or None if there are no matching habits in the database.
     """
     cur = db.cursor()
-    cur.execute("SELECT habit FROM habitbase WHERE periodicity = ?", (periodicity,))
+    cur.execute("SELECT habit FROM habitbase WHERE periodicity_id = (SELECT id FROM periodicities WHERE label = ?)", (periodicity,))
     result = cur.fetchall()
     return [i[0].capitalize() for i in list(result)] if len(result) >0 else None
 
@@ -467,6 +1369,519 @@ def collect_uncompleted_habits_choices(db):
     List[str] or None: A list of uncompleted habit choices, or None if there are no uncompleted habits in the database.
     """
     cur = db.cursor()
-    cur.execute("SELECT habit FROM habitbase WHERE completed = 1")
+    cur.execute(f"SELECT habit FROM habitbase WHERE completed = {model.Completion.UNCOMPLETED:d}")
     result = cur.fetchall()
-    return [i[0].capitalize() for i in list(result)] if len(result) >0 else None
\ No newline at end of file
+    return [i[0].capitalize() for i in list(result)] if len(result) >0 else None
+
+
+def habit_completed_flags(db):
+    """
+    Collect whether every habit is completed for its current period, in one query.
+
+    Args:
+    db (sqlite3.Connection): The connection to the habits database.
+
+    Returns:
+    dict: True for the completed and False for the uncompleted habits, keyed by habit.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT habit, completed FROM habitbase")
+    return {habit: completed != model.Completion.UNCOMPLETED for habit, completed in cur.fetchall()}
+
+
+FRESH_HABIT_STATS = """SELECT b.id, b.periodicity_id,
+    (SELECT COUNT(*) FROM habit_history h WHERE h.habit_id = b.id AND h.event = 'completed')
+        + (SELECT COALESCE(SUM(count), 0) FROM habit_archive a WHERE a.habit_id = b.id),
+    (SELECT COUNT(*) FROM habit_history h WHERE h.habit_id = b.id AND h.event = 'reset'),
+    b.streak, b.max_streak,
+    (SELECT MAX(day) FROM (SELECT day FROM habit_history h WHERE h.habit_id = b.id AND h.event = 'completed'
+        UNION ALL SELECT segment_end FROM habit_archive a WHERE a.habit_id = b.id)),
+    day_number(b.starting_date)
+    FROM habitbase b"""
+
+FRESH_PERIODICITY_STATS = """SELECT periodicity_id, COUNT(*), SUM(completions), SUM(resets)
+    FROM habit_stats GROUP BY periodicity_id"""
+
+
+def rebuild_habit_stats(db):
+    """
+    Recompute the 'habit_stats' and 'periodicity_stats' tables from scratch out of the habitbase and the habit history.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+    """
+    cur = db.cursor()
+    cur.execute("DELETE FROM habit_stats")
+    cur.execute(f"INSERT INTO habit_stats {FRESH_HABIT_STATS}")
+    cur.execute("DELETE FROM periodicity_stats")
+    cur.execute(f"INSERT INTO periodicity_stats {FRESH_PERIODICITY_STATS}")
+    db.commit()
+
+
+def habit_stats_drift(db):
+    """
+    Compare the materialized statistics with a recomputation from scratch.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        List[str]: The names of the habits whose statistics row is missing, stale or orphaned, and the periodicities whose aggregates differ. An empty list means there is no drift.
+    """
+    cur = db.cursor()
+    cur.execute(f"""SELECT COALESCE(b.habit, 'habit:' || drifted.habit_id) FROM (
+        SELECT habit_id FROM (SELECT * FROM habit_stats EXCEPT {FRESH_HABIT_STATS})
+        UNION SELECT id FROM ({FRESH_HABIT_STATS} EXCEPT SELECT * FROM habit_stats)) drifted
+        LEFT JOIN habitbase b ON b.id = drifted.habit_id""")
+    drift = [row[0] for row in cur.fetchall()]
+    cur.execute(f"""SELECT COALESCE(p.label, drifted.periodicity_id) FROM (
+        SELECT periodicity_id FROM (SELECT * FROM periodicity_stats WHERE habits > 0 EXCEPT {FRESH_PERIODICITY_STATS})
+        UNION SELECT periodicity_id FROM ({FRESH_PERIODICITY_STATS} EXCEPT SELECT * FROM periodicity_stats)) drifted
+        LEFT JOIN periodicities p ON p.id = drifted.periodicity_id""")
+    drift.extend(f"periodicity:{row[0]}" for row in cur.fetchall())
+    return sorted(drift)
+
+
+def _completed_days_by_id(cur):
+    """
+    Read every check-off of the habit history and its archive.
+
+    Parameters:
+    cur (sqlite3.Cursor): A cursor of the database.
+
+    Returns:
+    List[tuple]: The id of the habit and the day number of every check-off.
+    """
+    cur.execute("SELECT habit_id, day FROM habit_history WHERE event = 'completed'")
+    rows = cur.fetchall()
+    cur.execute("SELECT habit_id, days FROM habit_archive")
+    rows.extend((habit_id, day) for habit_id, segment in cur.fetchall() for day in decode_days(segment))
+    return rows
+
+def rebuild_habit_calendar(db):
+    """
+    Recompute the monthly completion bitmaps of the 'habit_calendar' table from the habit history and its archive.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+    """
+    cur = db.cursor()
+    calendar = {}
+    for habit_id, day in _completed_days_by_id(cur):
+        month, bit = calendar_position(day)
+        calendar[(habit_id, month)] = calendar.get((habit_id, month), 0) | 1 << bit
+    cur.execute("DELETE FROM habit_calendar")
+    cur.executemany("INSERT INTO habit_calendar VALUES (?, ?, ?)", [(habit_id, month, bits) for (habit_id, month), bits in calendar.items()])
+    db.commit()
+
+def rebuild_habit_bitmaps(db):
+    """
+    Recompute the compressed completion bitmaps of the 'habit_bitmaps' table from the habit history and its archive.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+    """
+    cur = db.cursor()
+    days = {}
+    for habit_id, day in _completed_days_by_id(cur):
+        days.setdefault(habit_id, bitmaps.DayBitmap()).add(day)
+    cur.execute("DELETE FROM habit_bitmaps")
+    cur.executemany("INSERT INTO habit_bitmaps VALUES (?, ?)", [(habit_id, bitmap.to_bytes()) for habit_id, bitmap in days.items()])
+    db.commit()
+
+def completion_bitmaps(db, habits=None):
+    """
+    Load the compressed completion bitmaps of the 'habit_bitmaps' table.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habits (List[str], optional): Only load these habits. Defaults to all habits.
+
+    Returns:
+        dict: The bitmaps.DayBitmap of every habit, keyed by habit. Habits that were never checked off have an empty bitmap.
+    """
+    cur = db.cursor()
+    if habits is None:
+        cur.execute("SELECT b.habit, m.days FROM habit_bitmaps m JOIN habitbase b ON b.id = m.habit_id")
+        return {habit: bitmaps.DayBitmap.from_bytes(days) for habit, days in cur.fetchall()}
+    habits = list(habits)
+    loaded = {habit: bitmaps.DayBitmap() for habit in habits}
+    for start in range(0, len(habits), 500):
+        chunk = habits[start:start + 500]
+        cur.execute(f"""SELECT b.habit, m.days FROM habit_bitmaps m JOIN habitbase b ON b.id = m.habit_id
+            WHERE b.habit IN ({', '.join('?' * len(chunk))})""", chunk)
+        loaded.update((habit, bitmaps.DayBitmap.from_bytes(days)) for habit, days in cur.fetchall())
+    return loaded
+
+def rebuild_habit_deadlines(db):
+    """
+    Recompute the deadline index of the 'habit_deadlines' table from the habitbase.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+    """
+    cur = db.cursor()
+    cur.execute("DELETE FROM habit_deadlines")
+    for (habit_id,) in cur.execute("SELECT id FROM habitbase").fetchall():
+        _refresh_deadline(cur, habit_id)
+    db.commit()
+
+
+def insert_sync_events(db, events):
+    """
+    Add events to the replicated 'sync_log', skipping the ones that are already known.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        events (List[tuple]): Events as (hlc, replica, habit, event, day, payload) rows.
+
+    Returns:
+        set: The habits of the events that were new.
+    """
+    cur = db.cursor()
+    changed = set()
+    for event in events:
+        cur.execute("INSERT OR IGNORE INTO sync_log VALUES (?, ?, ?, ?, ?, ?)", tuple(event))
+        if cur.rowcount > 0:
+            changed.add(event[2])
+    db.commit()
+    return changed
+
+
+def sync_events_after(db, vector):
+    """
+    Collect the events of the 'sync_log' a replica has not seen yet, read per replica from the (replica, hlc) index.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        vector (dict): The newest hybrid logical clock stamp the other replica has seen from every replica.
+
+    Returns:
+        List[tuple]: The missing events as (hlc, replica, habit, event, day, payload) rows, in clock order.
+    """
+    cur = db.cursor()
+    events = []
+    for (replica,) in cur.execute("SELECT DISTINCT replica FROM sync_log").fetchall():
+        cur.execute("SELECT * FROM sync_log WHERE replica = ? AND hlc > ?", (replica, vector.get(replica, "")))
+        events.extend(cur.fetchall())
+    return sorted(events)
+
+
+def sync_vector(db):
+    """
+    Find the newest hybrid logical clock stamp of every replica in the 'sync_log'.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        dict: The newest stamp keyed by replica.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT replica, MAX(hlc) FROM sync_log GROUP BY replica")
+    return dict(cur.fetchall())
+
+
+def sync_events_of_habit(db, habit):
+    """
+    Collect the replicated events of one habit.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The habit.
+
+    Returns:
+        List[tuple]: The (hlc, event, day, payload) rows of the habit, in clock order.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT hlc, event, day, payload FROM sync_log WHERE habit = ? ORDER BY hlc", (habit,))
+    return cur.fetchall()
+
+
+def sync_renames_from(db, habit):
+    """
+    Collect the replicated renames of a habit name to another name, read from the index on the old name.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The old name.
+
+    Returns:
+        List[tuple]: The (hlc, day, new name) rows of the renames, in clock order.
+    """
+    cur = db.cursor()
+    cur.execute("""SELECT hlc, day, habit FROM sync_log WHERE event = 'renamed' AND json_extract(payload, '$.renamed_from') = ?
+        ORDER BY hlc""", (habit,))
+    return cur.fetchall()
+
+
+def completed_days(db, habit):
+    """
+    Collect the days a habit was checked off from the habit history, including the archived check-offs.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The habit.
+
+    Returns:
+        set: The day numbers of the check-offs.
+    """
+    return set(history_days(db, habit))
+
+
+def apply_synced_state(db, habit, new_days, streak, max_streak, completed, datetime_completed, startdate_weekly):
+    """
+    Write the state of a habit derived from the merged events of all replicas, in one transaction.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The habit.
+        new_days (List[int]): The day numbers of check-offs from other replicas that are not in the local history yet.
+        streak (int): The derived streak.
+        max_streak (int): The derived longest streak.
+        completed (int): 2 if the current period is completed, 1 otherwise.
+        datetime_completed (str): The date of the check-off that completed the last period, or None.
+        startdate_weekly (str): The start of the current window of an anchored habit, or None to keep it.
+    """
+    cur = db.cursor()
+    habit_id, habit = _habit_row(cur, habit)
+    for day in sorted(new_days):
+        _record_completion(cur, habit_id, habit, day)
+    cur.execute("""UPDATE habitbase SET streak = ?, max_streak = MAX(max_streak, ?), completed = ?, datetime_completed = ?,
+        startdate_weekly = COALESCE(?, startdate_weekly) WHERE id = ?""", (streak, max_streak, completed, datetime_completed, startdate_weekly, habit_id))
+    cur.execute("UPDATE habit_stats SET streak = ?, max_streak = MAX(max_streak, ?) WHERE habit_id = ?", (streak, max_streak, habit_id))
+    _refresh_deadline(cur, habit_id)
+    db.commit()
+
+
+def latest_change(db):
+    """
+    Find the sequence number of the newest change in the 'habit_changes' outbox.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        int: The sequence number, or 0 if there are no changes.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM habit_changes")
+    return cur.fetchone()[0]
+
+
+def habit_names(db):
+    """
+    Collect the names of all habits as they are stored.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        List[str]: The names of the habits.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT habit FROM habitbase")
+    return [row[0] for row in cur.fetchall()]
+
+
+def habit_name_changes(db, cursor=0):
+    """
+    Read the habits added, deleted and renamed after a position of the 'habit_changes' outbox.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        cursor (int, optional): The sequence number of the last change already seen. Defaults to 0.
+
+    Returns:
+        List[tuple]: The sequence number, the habit and the event ('added' or 'deleted') of every change, oldest first.
+            A rename is read as the deletion of the old name followed by the addition of the new one.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT seq, habit, event, payload FROM habit_changes WHERE seq > ? AND event IN ('added', 'deleted', 'renamed') ORDER BY seq", (cursor,))
+    changes = []
+    for seq, habit, event, payload in cur.fetchall():
+        if event == "renamed":
+            changes.append((seq, json.loads(payload)["renamed_from"], "deleted"))
+            event = "added"
+        changes.append((seq, habit, event))
+    return changes
+
+
+def bitmap_add(days, day):
+    """
+    Add a day number to a stored completion bitmap.
+
+    It is registered as the SQL function 'bitmap_add' by connect_db, so a check-off extends the bitmap in one statement.
+
+    Args:
+        days (bytes): The stored bitmap, or None for an empty one.
+        day (int): The day number to add.
+
+    Returns:
+        bytes: The stored bitmap with the day.
+    """
+    bitmap = bitmaps.DayBitmap.from_bytes(days)
+    bitmap.add(day)
+    return bitmap.to_bytes()
+
+
+def archived_since(segment, day):
+    """
+    Count the check-offs of an archive segment from a day on.
+
+    It is registered as the SQL function 'archived_since' by connect_db.
+
+    Args:
+        segment (bytes): The segment, written by encode_days.
+        day (int): The first day number to count.
+
+    Returns:
+        int: The number of check-offs.
+    """
+    return sum(1 for archived in decode_days(segment) if archived >= day)
+
+
+def encode_days(days):
+    """
+    Compress sorted day numbers into an archive segment: the gaps between them as varints, compressed with zlib.
+
+    Args:
+        days (List[int]): The sorted day numbers. Repeated days are kept.
+
+    Returns:
+        bytes: The segment.
+    """
+    encoded = bytearray()
+    previous = 0
+    for day in days:
+        gap, previous = day - previous, day
+        while gap >= 0x80:
+            encoded.append(gap & 0x7F | 0x80)
+            gap >>= 7
+        encoded.append(gap)
+    return zlib.compress(bytes(encoded), 9)
+
+
+def decode_days(segment):
+    """
+    Decompress the day numbers of an archive segment written by encode_days.
+
+    Args:
+        segment (bytes): The segment.
+
+    Returns:
+        List[int]: The sorted day numbers.
+    """
+    days = []
+    day = gap = shift = 0
+    for byte in zlib.decompress(segment):
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            day += gap
+            days.append(day)
+            gap = shift = 0
+    return days
+
+
+def archived_days(db, habit=None, start=None, end=None):
+    """
+    Read the archived check-offs, decompressing only the segments that overlap the requested days.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str, optional): Only read this habit. Defaults to all habits.
+        start (int, optional): The first day number to read. Defaults to the beginning.
+        end (int, optional): The last day number to read. Defaults to the end.
+
+    Returns:
+        dict: The sorted day numbers of the check-offs keyed by habit.
+    """
+    query = "SELECT b.habit, a.days FROM habit_archive a JOIN habitbase b ON b.id = a.habit_id WHERE a.segment_end >= ? AND a.segment_start <= ?"
+    params = [start if start is not None else 0, end if end is not None else 2 ** 62]
+    if habit is not None:
+        query += " AND b.habit = ?"
+        params.append(habit)
+    cur = db.cursor()
+    cur.execute(query + " ORDER BY a.habit_id, a.segment_start", params)
+    archived = {}
+    for habit, segment in cur.fetchall():
+        days = [day for day in decode_days(segment) if params[0] <= day <= params[1]]
+        archived.setdefault(habit, []).extend(days)
+    for days in archived.values():
+        days.sort()
+    return archived
+
+
+def history_days(db, habit, start=None, end=None):
+    """
+    Read the check-offs of a habit across the hot habit history and the archive.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The habit.
+        start (int, optional): The first day number to read. Defaults to the beginning.
+        end (int, optional): The last day number to read. Defaults to the end.
+
+    Returns:
+        List[int]: The sorted day numbers of the check-offs.
+    """
+    cur = db.cursor()
+    habit_id, habit = _habit_row(cur, habit)
+    cur.execute("SELECT day FROM habit_history WHERE habit_id = ? AND event = 'completed' AND day BETWEEN ? AND ?",
+        (habit_id, start if start is not None else 0, end if end is not None else 2 ** 62))
+    return sorted([row[0] for row in cur.fetchall()] + archived_days(db, habit, start, end).get(habit, []))
+
+
+def compact_history(db, horizon):
+    """
+    Move the check-offs before a horizon out of the habit history into one compressed archive segment per habit.
+
+    The statistics, the calendar bitmaps and the history readers (history_days, completions_since) already account
+    for the archive, so nothing but the hot table changes.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        horizon (int): The first day number that stays in the habit history.
+
+    Returns:
+        tuple: The number of segments written and the number of archived check-offs.
+    """
+    cur = db.cursor()
+    cur.execute("SELECT habit_id, day FROM habit_history WHERE event = 'completed' AND day < ? ORDER BY habit_id, day", (horizon,))
+    segments = {}
+    for habit_id, day in cur.fetchall():
+        segments.setdefault(habit_id, []).append(day)
+    cur.executemany("INSERT INTO habit_archive VALUES (?, ?, ?, ?, ?)",
+        [(habit_id, days[0], days[-1], len(days), encode_days(days)) for habit_id, days in segments.items()])
+    cur.execute("DELETE FROM habit_history WHERE event = 'completed' AND day < ?", (horizon,))
+    db.commit()
+    return len(segments), sum(len(days) for days in segments.values())
+
+
+def vacuum_incrementally(db, pages=1000):
+    """
+    Give free pages back to the file system, a limited number per call.
+
+    A database created before incremental vacuuming was enabled is converted by one full VACUUM first.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        pages (int, optional): The maximum number of pages to free, 0 to free none. Defaults to 1000.
+
+    Returns:
+        int: The number of freed pages.
+    """
+    # SQLite frees the whole freelist for incremental_vacuum(0), the opposite of freeing no pages.
+    if pages <= 0:
+        return 0
+    cur = db.cursor()
+    before = cur.execute("PRAGMA freelist_count").fetchone()[0]
+    if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cur.execute("VACUUM")
+    else:
+        cur.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return before - cur.execute("PRAGMA freelist_count").fetchone()[0]
+
@@ -1,12 +1,155 @@
 
+import bisect
+
+import os
+
 import typer
 
 import questionary
 
-from habittracker import database
+from prompt_toolkit.completion import Completer, Completion
+
+from habittracker import database, schedules, search
 
 qt = questionary
 
+PICKER_THRESHOLD = 30
+
+_choices = {}
+
+
+class HabitChoices:
+    """
+    The habit choices of the prompts of one database file, kept sorted and refreshed only when the database changed.
+
+    The cache keeps its own connection and asks SQLite's 'data_version' pragma whether another connection committed
+    since the last refresh. Only then are the habits read again, in one query, and the habits that were added,
+    deleted, completed or uncompleted are moved in or out of the sorted lists.
+
+    Attributes:
+        db_name (str): The absolute path of the database file.
+        db (sqlite3.Connection): The connection of the cache.
+        identity (tuple): The device and inode of the database file, to notice a replaced file.
+        version (int): The data version of the last refresh.
+        completed (dict): Whether every habit is completed, keyed by habit.
+        habits (List[str]): The choices of all habits, sorted.
+        uncompleted (List[str]): The choices of the uncompleted habits, sorted.
+
+    """
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.db = None
+        self.identity = None
+        self.version = None
+        self.completed = {}
+        self.habits = []
+        self.uncompleted = []
+
+    def refresh(self):
+        """Bring the choices up to date, reading the habits only if the database changed since the last refresh."""
+        identity = None
+        if self.db is not None:
+            stat = os.stat(self.db_name) if os.path.exists(self.db_name) else None
+            identity = (stat.st_dev, stat.st_ino) if stat is not None else None
+        if self.db is None or identity != self.identity:
+            if self.db is not None:
+                self.db.close()
+            self.db = database.connect_db(self.db_name)
+            stat = os.stat(self.db_name)
+            self.identity = (stat.st_dev, stat.st_ino)
+            self.version = None
+            self.completed, self.habits, self.uncompleted = {}, [], []
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return self
+        completed = database.habit_completed_flags(self.db)
+        for habit in self.completed.keys() - completed.keys():
+            self._remove(self.habits, habit)
+            if not self.completed[habit]:
+                self._remove(self.uncompleted, habit)
+        for habit, done in completed.items():
+            if habit not in self.completed:
+                bisect.insort(self.habits, habit.capitalize())
+                if not done:
+                    bisect.insort(self.uncompleted, habit.capitalize())
+            elif done and not self.completed[habit]:
+                self._remove(self.uncompleted, habit)
+            elif not done and self.completed[habit]:
+                bisect.insort(self.uncompleted, habit.capitalize())
+        self.completed = completed
+        self.version = version
+        return self
+
+    @staticmethod
+    def _remove(choices, habit):
+        position = bisect.bisect_left(choices, habit.capitalize())
+        if position < len(choices) and choices[position] == habit.capitalize():
+            del choices[position]
+
+
+def habit_choices(db_name=None):
+    """
+    Find the up-to-date habit choices of a database file, connecting to it on first use.
+
+    Parameters:
+    db_name (str, optional): The name of the database file. Defaults to 'habit.db'.
+
+    Returns:
+    HabitChoices: The habit choices.
+    """
+    db_name = os.path.abspath(db_name or "habit.db")
+    choices = _choices.get(db_name)
+    if choices is None:
+        choices = _choices[db_name] = HabitChoices(db_name)
+    return choices.refresh()
+
+
+class HabitCompleter(Completer):
+    """
+    Complete the typed text with the best matching habit names of a search index.
+
+    Attributes:
+        index (search.HabitIndex): The search index of the habits.
+        allowed (dict): The habits that may be picked, keyed by their lower-case name, or None for all habits.
+        limit (int): The maximum number of suggestions.
+
+    """
+    def __init__(self, index, allowed=None, limit=10):
+        self.index = index
+        self.allowed = allowed
+        self.limit = limit
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        # Ask for more names than shown when some of them are filtered out afterwards.
+        names = self.index.search(text, self.limit if self.allowed is None else 5 * self.limit)
+        if self.allowed is not None:
+            names = [self.allowed[name.lower()] for name in names if name.lower() in self.allowed]
+        for name in names[:self.limit]:
+            yield Completion(name, start_position=-len(text))
+
+
+def pick_habit(db, choices):
+    """
+    Prompt the user to pick one of the given habits: from a list if there are only a few, otherwise by typing the
+    name with type-ahead suggestions from the search index.
+
+    Parameters:
+    db (sqlite3.Connection): The connection to the habits database.
+    choices (List[str]): The sorted habits to pick from.
+
+    Returns:
+    str: The picked habit, as given in the choices.
+    """
+    if len(choices) <= PICKER_THRESHOLD:
+        return qt.select("Please select one habit:",
+        choices = choices).ask()
+    allowed = {choice.lower(): choice for choice in choices}
+    habit = qt.autocomplete("Please type the habit (Tab shows suggestions):", choices=[],
+    completer=HabitCompleter(search.index_of(db), allowed),
+    validate=lambda habit: True if habit.lower() in allowed else "There is no such habit ! Please pick one of the suggestions !").ask()
+    return allowed[habit.lower()] if habit is not None else None
+
 
 def habit_entry():
     """
@@ -35,12 +178,30 @@ def habit_periodicity():
     """
     Prompt the user to select a periodicity for a habit.
 
+    Periodicities with a parameter (e.g. "Every N days") ask for it in a follow-up prompt.
+
     Returns:
-    str: The selected periodicity.
+    str: The label of the selected periodicity, e.g. "Daily" or "Every 3 Days".
     """
-    return qt.select("Please select a suitable periodicity for your habit:",
-    choices = ["Daily", "Weekly"]
+    periodicity = qt.select("Please select a suitable periodicity for your habit:",
+    choices = ["Daily", "Weekly", "Every N days", "On certain weekdays", "Monthly", "N times per week"]
     ).ask()
+    if periodicity == "Every N days":
+        days = qt.text("Every how many days do you want to do the habit?",
+        validate=lambda days: True if days.isdigit() and int(days) > 1
+        else "Please enter a whole number bigger than one !").ask()
+        return schedules.EveryNDays(int(days)).label
+    elif periodicity == "On certain weekdays":
+        weekdays = qt.checkbox("On which weekdays do you want to do the habit?",
+        choices = schedules.WEEKDAYS,
+        validate=lambda weekdays: True if len(weekdays) > 0 else "Please select at least one weekday !").ask()
+        return schedules.Weekdays([schedules.WEEKDAYS.index(weekday) for weekday in weekdays]).label
+    elif periodicity == "N times per week":
+        times = qt.text("How many times per week do you want to do the habit?",
+        validate=lambda times: True if times.isdigit() and 1 < int(times) <= 7
+        else "Please enter a whole number between 2 and 7 !").ask()
+        return schedules.TimesPerWeek(int(times)).label
+    return periodicity
 
 def analyze_habit_periodicity():
     """
@@ -49,8 +210,9 @@ def analyze_habit_periodicity():
     Returns:
     str: The selected periodicity.
     """
+    periodicities = database.collect_periodicity_choices(habit_choices().db)
     return qt.select("Please select the periodicity to be analyzed:",
-    choices=["Daily", "Weekly"]
+    choices=periodicities or ["Daily", "Weekly"]
     ).ask()
 
 def habits_of_database():
@@ -60,11 +222,9 @@ def habits_of_database():
     Returns:
     str: The selected habit.
     """
-    db = database.connect_db()
-    all_habits = database.collect_habits_choices(db)
-    if all_habits is not None:
-        return qt.select("Please select one habit:",
-        choices = sorted(all_habits)).ask()
+    choices = habit_choices()
+    if choices.habits:
+        return pick_habit(choices.db, choices.habits)
     else:
         typer.secho("\nThere is no habit in your database! Please add a habit first!\n",
         fg=typer.colors.BRIGHT_RED)
@@ -74,20 +234,17 @@ def uncompleted_habits():
     This function retrieves all the uncompleted habits from the habitsbase table of the database, and display them to the user to select one of them.
     
     Methods called:
-    connect_db() from module 'database'
-    collect_uncompleted_habits_choices(db) from module 'database'
-    select() from module 'qt'
+    habit_choices()
+    pick_habit(db, choices)
     ask() from module 'qt'
     secho() from module 'typer'
     
     Returns:
     The selected habit name (str) if there are any uncompleted habits in the habitsbase table, otherwise None.
     """
-    db = database.connect_db()
-    all_uncompleted_habits = database.collect_uncompleted_habits_choices(db)
-    if all_uncompleted_habits is not None:
-        return qt.select("Please select one habit:",
-        choices= sorted(all_uncompleted_habits)).ask()
+    choices = habit_choices()
+    if choices.uncompleted:
+        return pick_habit(choices.db, choices.uncompleted)
     else:
         typer.secho("\nThere is no habit in your database! Please add a habit first!\n",
         fg=typer.colors.BRIGHT_RED)
@@ -1,6 +1,19 @@
 import datetime
 
-from habittracker import database
+import enum
+
+import json
+
+from habittracker import database, schedules
+
+class Completion(enum.IntEnum):
+    """
+    Whether a habit is completed for its current period, as stored in the 'completed' column of the habitbase.
+
+    The values are the ones the habitbase has always used, so existing databases keep their meaning.
+    """
+    UNCOMPLETED = 1
+    COMPLETED = 2
 
 class Habit:
     """A class representing a habit.
@@ -10,16 +23,17 @@ class Habit:
         description (str): A description of the habit.
         periodicity (str): The periodicity of the habit (e.g. daily, weekly).
         starting_date (str): The date that the habit was started.
-        completed (int): The number of times the habit has been completed.
+        completed (Completion): Whether the habit is completed for its current period.
         datetime_completed (str): The date and time that the habit was last completed.
         streak (int): The current streak of consecutive days the habit has been completed.
         max_streak (int): The longest streak of consecutive days the habit has been completed.
         db (str): The path to the database file.
+        id (int): The id of the habit in the database, None until it is added.
         current_time (str): The current time as a string in the format '%d %b %Y %H:%M:%S'.
         current_date (str): The current date as a string in the format '%d %b %Y'.
 
     """
-    def __init__(self, habit: str = None, description: str = None, periodicity: str = None, starting_date = None, startdate_weekly= None, completed = None, datetime_completed = None, streak = None, max_streak = None, db=None ):
+    def __init__(self, habit: str = None, description: str = None, periodicity: str = None, starting_date = None, startdate_weekly= None, completed = None, datetime_completed = None, streak = None, max_streak = None, db=None, id=None):
         """
         Initialize a Habit object.
 
@@ -28,11 +42,12 @@ class Habit:
             description (str, optional): A description of the habit. Defaults to None.
             periodicity (str, optional): The periodicity of the habit. Defaults to None.
             starting_date (str, optional): The date that the habit was started. Defaults to the current date.
-            completed (int, optional): The number of times the habit has been completed. Defaults to 1.
+            completed (Completion, optional): Whether the habit is completed for its current period. Defaults to Completion.UNCOMPLETED.
             datetime_completed (str, optional): The date and time that the habit was last completed. Defaults to None.
             streak (int, optional): The current streak of consecutive days the habit has been completed. Defaults to 0.
             max_streak (int, optional): The longest streak of consecutive days the habit has been completed. Defaults to 0.
             db (str, optional): The path to the database file. Defaults to 'habit.db'.
+            id (int, optional): The id of the habit in the database. Defaults to None.
 
         """
         self.habit = habit
@@ -40,11 +55,12 @@ class Habit:
         self.periodicity = periodicity
         self.starting_date = starting_date if starting_date is not None else datetime.datetime.now().strftime("%d %b %Y")
         self.startdate_weekly = startdate_weekly if startdate_weekly is not None else None
-        self.completed = completed if completed is not None else 1
+        self.completed = Completion(completed) if completed is not None else Completion.UNCOMPLETED
         self.datetime_completed = datetime_completed if datetime_completed is not None else None
         self.streak = streak if streak is not None else 0
         self.max_streak = max_streak if max_streak is not None else 0
         self.db = db
+        self.id = id
         self.current_time = datetime.datetime.now().strftime("%d %b %Y %H:%M:%S")
         self.current_date = datetime.datetime.now().strftime("%d %b %Y")
 
@@ -53,136 +69,96 @@ class Habit:
         """
         Add a habit to the database.
 
-        Inserts the habit and its details into the 'habits' table, and inserts a row into the 'habitlog' table with initial values.
+        Inserts the habit and its details into the 'habitbase' table.
+        Habits whose periodicity counts its periods from the habit itself (e.g. "Weekly") open their first window on the starting date.
 
         """
-        if self.periodicity == "Daily":
-            self.db = database.connect_db(db_name=db_name)
-            database.insert_habit(self.db, self.habit, self.description, self.periodicity, self.starting_date, self.startdate_weekly, self.completed, self.datetime_completed, self.streak, self.max_streak)
-            database.insert_habitlog(self.db, self.habit, 1, 0, self.datetime_completed, 0)
-        else:
-            self.db = database.connect_db(db_name=db_name)
-            database.insert_habit(self.db, self.habit, self.description, self.periodicity, self.starting_date, self.current_date, self.completed, self.datetime_completed, self.streak, self.max_streak)
-            database.insert_habitlog(self.db, self.habit, 1, 0, self.datetime_completed, 0)
+        self.db = database.connect_db(db_name=db_name)
+        if schedules.parse(self.periodicity).anchored and self.startdate_weekly is None:
+            self.startdate_weekly = self.starting_date
+        self.id = database.insert_habit(self.db, self.habit, self.description, self.periodicity, self.starting_date, self.startdate_weekly, self.completed, self.datetime_completed, self.streak, self.max_streak)
 
 
     def delete_habit(self, db_name):
         """
         Delete a habit from the database.
 
-        Removes the habit from the 'habits' table and removes all related rows from the 'habitlog' table.
+        Removes the habit and all its related rows from the database.
 
         """
         self.db = database.connect_db(db_name=db_name)
-        database.delete_habit(self.db, self.habit)
-        database.reset_log(self.db, self.habit)
-
-    def increment_streak(self, db_name):
-        """
-        Increment the current streak for a habit.
-
-        Updates the `streak` and `max_streak` attributes for the habit, using the current streak and maximum streak values from the database.
+        database.delete_habit(self.db, self.habit_id())
 
+    def habit_id(self):
         """
-        self.db = database.connect_db(db_name)
-        self.streak = database.streak_count(self.db, self.habit) + 1
-        self.max_streak = database.max_streak_count(self.db, self.habit)
-        if self.streak > self.max_streak:
-            self.max_streak = self.streak
-            self.max_streak = max(self.max_streak, self.streak)
-            self.update_max_streak()
-
-    def update_max_streak_in_database(self, db_name):
-        """Update the maximum streak value in the database."""
-        self.db = database.connect_db(db_name)
-        database.update_habit_streak(self.db, self.habit, database.streak_count(self.db, self.habit), self.max_streak, self.current_date)
-        database.update_habitlog(self.db, self.habit, 2, database.streak_count(self.db, self.habit), self.current_time, self.max_streak)
+        Return the id of the habit in the database.
 
-    def update_streak(self, db_name, current_date):
-        """Update the streak information for a habit in the database.
+        A habit created from its name only looks its id up once, ignoring case; this is where a name becomes an id.
 
-        Increments the current streak, updates the `completed` attribute, and updates the streak and maximum streak values in the 'habits' and 'habitlog' tables in the database.
+        Returns:
+            int: The id of the habit, or None if there is no such habit.
 
         """
-        self.db = database.connect_db(db_name)
-        self.set_habit_completed(db_name)
-        self.increment_streak(db_name)
-        database.update_habit_streak(self.db, self.habit, self.streak, self.max_streak, current_date)
-        database.update_habitlog(self.db, self.habit, 2, database.streak_count(self.db, self.habit), self.current_time, database.max_streak_count(self.db, self.habit))
+        if self.id is None:
+            self.id = database.habit_id(self.db, self.habit)
+        return self.id
 
-    def reset_streak(self, db_name):
+    def rename(self, db_name, new_name):
         """
-        Reset the current streak for a habit.
+        Rename the habit in the database.
 
-        Sets the `streak` attribute to 0 and updates the streak value in the 'habitsbase' and 'habitlog' tables in the database.
+        Its history and statistics refer to its id, so they stay with the habit.
 
         """
-        self.db = database.connect_db(db_name)
-        self.streak = database.streak_count(self.db, self.habit)
-        self.streak = 0
-        database.reset_habitbase_streak(self.db, self.habit)
-        database.reset_habitlog_streak(self.db, self.habit)
+        self.db = database.connect_db(db_name=db_name)
+        database.rename_habit(self.db, self.habit_id(), new_name)
+        self.habit = new_name
 
-    def update_max_streak(self):
-        """
-        This function updates the attribute 'max_streak' with the current value of 'streak' if 'streak' is greater than 'max_streak'. It also updates the max_streak in the database.
-        
-        Attributes:
-        self.streak (int) : current streak value
-        self.max_streak (int) : max streak value
-        
-        Methods called:
-        update_max_streak_in_database(db_name="habit.db")
+    def update_streak(self, db_name, current_date, request_id=None):
+        """Update the streak information for a habit in the database.
+
+        Increments the current streak and the maximum streak and completes the current period in one statement (see database.check_off_habit),
+        and updates the `completed`, `streak` and `max_streak` attributes from its result. A second check-off in a period that is already completed changes nothing.
+        A periodicity that needs several check-offs per period (e.g. "3 Times Per Week") only records the check-off until the last one of the period.
+        With a `request_id` a retried check-off returns the result of the first one instead of checking off again (see database.submit_check_off).
+
+        Returns:
+            bool: Whether the check-off was recorded.
 
-        Returns: None
         """
-        if self.streak > self.max_streak:
-            self.max_streak = self.streak
-            self.update_max_streak_in_database(db_name="habit.db")
+        self.db = database.connect_db(db_name)
+        result = database.submit_check_off(self.db, self.habit_id(), current_date, request_id)
+        if result is None:
+            # The request id was used before, but its result expired in the meantime.
+            return False
+        if result["completed"]:
+            self.completed = Completion.COMPLETED
+            self.streak, self.max_streak = result["streak"], result["max_streak"]
+        return result["recorded"]
 
-    def set_habit_completed(self, db_name):
+    def reset_streak(self, db_name):
         """
-        Mark a habit as completed in the database.
+        Reset the current streak for a habit.
 
-        Sets the `completed` attribute to 2 and updates the 'habits' table in the database.
+        Sets the `streak` attribute to 0 and updates the streak value in the 'habitbase' table in the database.
 
         """
         self.db = database.connect_db(db_name)
-        self.completed = 2
-        database.complete_habit(self.db, self.habit)
+        self.streak = database.streak_count(self.db, self.habit_id())
+        self.streak = 0
+        database.reset_habitbase_streak(self.db, self.habit_id())
 
     def set_habit_uncomplete(self, db_name):
         """
         Mark a habit as not completed in the database.
 
-        Sets the `completed` attribute to 1 and updates the 'habits' and 'habitlog' tables in the database.
+        Sets the `completed` attribute to 1 and updates the 'habitbase' table in the database.
 
         """
         self.db = database.connect_db(db_name)
-        self.completed = 1
-        database.uncomplete_habit(self.db, self.habit)
-        database.set_habitlog_uncompleted(self.db, self.habit, 1)
-
-    def set_new_startdate_weekly(self, db_name):
-        """
-        This function sets a new startdate_weekly attribute to the current date and updates the startdate_weekly in the database.
-        
-        Attributes:
-        self.db (object) : database object
-        self.startdate_weekly (str) : current startdate_weekly value
-        self.habit (str) : habit name
-        self.current_date (str): current date
-        
-        Methods called:
-        connect_db(db_name) from module 'database'
-        set_startdate_weekly(self.db, self.habit, self.startdate_weekly) from module 'database'
-
-        Returns: None
-        """
-        self.db = database.connect_db(db_name)
-        self.startdate_weekly = self.current_date
-        database.set_startdate_weekly(self.db, self.habit, self.startdate_weekly)
-        
+        self.completed = Completion.UNCOMPLETED
+        database.uncomplete_habit(self.db, self.habit_id())
+
     def __repr__(self) -> str:
         """
         Return a string representation of the habit object.
@@ -200,7 +176,7 @@ class LogEntry:
 
     Attributes:
         habit (str): The name of the habit.
-        completed (int): The number of times the habit has been completed.
+        completed (Completion): Whether the habit is completed for its current period.
         streak (int): The current streak of consecutive days the habit has been completed.
         datetime_completed (str): The date and time that the habit was last completed.
         max_streak (int): The longest streak of consecutive days the habit has been completed.
@@ -212,14 +188,14 @@ class LogEntry:
 
         Args:
             habit (str): The name of the habit.
-            completed (int, optional): The number of times the habit has been completed. Defaults to 1.
+            completed (Completion, optional): Whether the habit is completed for its current period. Defaults to Completion.UNCOMPLETED.
             streak (int, optional): The current streak of consecutive days the habit has been completed. Defaults to 0.
             datetime_completed (str, optional): The date and time that the habit was last completed. Defaults to None.
             max_streak (int, optional): The longest streak of consecutive days the habit has been completed. Defaults to 0.
 
         """
         self.habit = habit
-        self.completed = completed if completed is not None else 1
+        self.completed = Completion(completed) if completed is not None else Completion.UNCOMPLETED
         self.streak = streak if streak is not None else 0
         self.datetime_completed = datetime_completed if datetime_completed is not None else None
         self.max_streak = max_streak if max_streak is not None else 0
@@ -233,4 +209,338 @@ class LogEntry:
             str: A string representation of the log entry object, in the format '(habit, completed, streak, datetime_completed, max_streak)'.
 
         """
-        return f"({self.habit}, {self.completed}, {self.streak}, {self.datetime_completed}, {self.max_streak})"
\ No newline at end of file
+        return f"({self.habit}, {self.completed}, {self.streak}, {self.datetime_completed}, {self.max_streak})"
+
+class HabitStats:
+    """
+    A class representing the materialized statistics of a habit.
+
+    Attributes:
+        habit (str): The name of the habit.
+        periodicity (str): The periodicity of the habit.
+        completions (int): The number of times the habit has been checked off.
+        resets (int): The number of times the streak of the habit was broken.
+        streak (int): The current streak of the habit.
+        max_streak (int): The longest streak of the habit.
+        last_completed (str): The date of the last check-off, or None.
+        started (str): The date the habit was started.
+        completion_rate (float): The share of periods since the start in which the habit was checked off, if it was requested.
+
+    """
+    def __init__(self, habit, periodicity, completions, resets, streak, max_streak, last_completed, started=None, completion_rate=None):
+        """
+        Initialize a HabitStats object from a row of the 'habit_stats' table.
+
+        Args:
+            habit (str): The name of the habit.
+            periodicity (str): The periodicity of the habit.
+            completions (int): The number of check-offs.
+            resets (int): The number of broken streaks.
+            streak (int): The current streak.
+            max_streak (int): The longest streak.
+            last_completed (int): The day number of the last check-off, or None.
+            started (int, optional): The day number the habit was started. Defaults to None.
+            completion_rate (float, optional): The completion rate, if it was computed by the query. Defaults to None.
+
+        """
+        self.habit = habit
+        self.periodicity = periodicity
+        self.completions = completions if completions is not None else 0
+        self.resets = resets if resets is not None else 0
+        self.streak = streak if streak is not None else 0
+        self.max_streak = max_streak if max_streak is not None else 0
+        self.last_completed = database.day_string(last_completed)
+        self.started = database.day_string(started)
+        self.completion_rate = completion_rate
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the statistics object.
+
+        Returns:
+            str: A string representation in the format '(habit, periodicity, completions, resets, streak, max_streak, last_completed)'.
+
+        """
+        return f"({self.habit}, {self.periodicity}, {self.completions}, {self.resets}, {self.streak}, {self.max_streak}, {self.last_completed})"
+
+
+class PeriodicityStats:
+    """
+    A class representing the aggregated statistics of all habits sharing one periodicity.
+
+    Attributes:
+        periodicity (str): The periodicity.
+        habits (int): The number of habits with this periodicity.
+        completions (int): The number of check-offs of these habits.
+        resets (int): The number of broken streaks of these habits.
+
+    """
+    def __init__(self, periodicity, habits, completions, resets):
+        """
+        Initialize a PeriodicityStats object from a row of the 'periodicity_stats' table.
+
+        Args:
+            periodicity (str): The periodicity.
+            habits (int): The number of habits.
+            completions (int): The number of check-offs.
+            resets (int): The number of broken streaks.
+
+        """
+        self.periodicity = periodicity
+        self.habits = habits
+        self.completions = completions
+        self.resets = resets
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the aggregate.
+
+        Returns:
+            str: A string representation in the format '(periodicity, habits, completions, resets)'.
+
+        """
+        return f"({self.periodicity}, {self.habits}, {self.completions}, {self.resets})"
+
+
+class WindowStats:
+    """
+    A class representing the consistency of a habit, or of all habits, over a date window.
+
+    Attributes:
+        habit (str): The name of the habit, or None for the aggregate of all habits.
+        periods (int): The number of periods of the habit inside the window.
+        completed (int): The number of those periods in which the habit was checked off.
+        misses (int): The number of those periods in which the habit was not checked off.
+        completion_rate (float): The share of completed periods, or None if the window holds no period.
+        average_gap (float): The average number of days between two check-offs, or None with less than two check-offs.
+        longest_gap (int): The longest stretch of days without a check-off.
+        rolling (dict): The completion rate of the last 7, 30 and 90 days of the window, keyed by the number of days.
+
+    """
+    def __init__(self, habit, periods, completed, average_gap, longest_gap, rolling=None):
+        """
+        Initialize a WindowStats object.
+
+        Args:
+            habit (str): The name of the habit, or None for the aggregate of all habits.
+            periods (int): The number of periods inside the window.
+            completed (int): The number of completed periods.
+            average_gap (float): The average number of days between two check-offs, or None.
+            longest_gap (int): The longest stretch of days without a check-off.
+            rolling (dict, optional): The rolling completion rates keyed by the number of days. Defaults to an empty dict.
+
+        """
+        self.habit = habit
+        self.periods = periods
+        self.completed = completed
+        self.misses = periods - completed
+        self.completion_rate = completed / periods if periods > 0 else None
+        self.average_gap = average_gap
+        self.longest_gap = longest_gap
+        self.rolling = rolling if rolling is not None else {}
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the window statistics.
+
+        Returns:
+            str: A string representation in the format '(habit, periods, completed, misses, average_gap, longest_gap)'.
+
+        """
+        return f"({self.habit}, {self.periods}, {self.completed}, {self.misses}, {self.average_gap}, {self.longest_gap})"
+
+
+class Reminder:
+    """
+    A class representing a reminder for a habit whose streak is about to break.
+
+    Attributes:
+        habit (str): The name of the habit.
+        periodicity (str): The periodicity of the habit.
+        streak (int): The streak that breaks if the habit is not checked off in time.
+        deadline (str): The last day the habit can be checked off without breaking the streak.
+        tenant (str): The database file the habit is stored in, or None.
+
+    """
+    def __init__(self, habit, periodicity, streak, deadline, tenant=None):
+        """
+        Initialize a Reminder object.
+
+        Args:
+            habit (str): The name of the habit.
+            periodicity (str): The periodicity of the habit.
+            streak (int): The current streak of the habit.
+            deadline (int): The day number of the deadline.
+            tenant (str, optional): The database file the habit is stored in. Defaults to None.
+
+        """
+        self.habit = habit
+        self.periodicity = periodicity
+        self.streak = streak
+        self.deadline = database.day_string(deadline)
+        self.tenant = tenant
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the reminder.
+
+        Returns:
+            str: A string representation in the format '(habit, periodicity, streak, deadline)'.
+
+        """
+        return f"({self.habit}, {self.periodicity}, {self.streak}, {self.deadline})"
+
+
+class Overlap:
+    """
+    A class representing how often a group of habits was checked off on the same days.
+
+    Attributes:
+        habits (List[str]): The names of the habits.
+        together (int): The number of days all habits were checked off.
+        any (int): The number of days at least one habit was checked off.
+        last_together (str): The last day all habits were checked off, or None.
+
+    """
+    def __init__(self, habits, together, any, last_together):
+        """
+        Initialize an Overlap object.
+
+        Args:
+            habits (List[str]): The names of the habits.
+            together (int): The number of days all habits were checked off.
+            any (int): The number of days at least one habit was checked off.
+            last_together (int): The day number of the last day all habits were checked off, or None.
+
+        """
+        self.habits = habits
+        self.together = together
+        self.any = any
+        self.last_together = database.day_string(last_together)
+
+    @property
+    def overlap(self):
+        """The share of the days with any check-off on which all habits were checked off, or None without check-offs."""
+        return self.together / self.any if self.any > 0 else None
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the overlap.
+
+        Returns:
+            str: A string representation in the format '(habits, together, any, last_together)'.
+
+        """
+        return f"({', '.join(self.habits)}, {self.together}, {self.any}, {self.last_together})"
+
+
+class Change:
+    """
+    A class representing one mutation of a habit in the change feed.
+
+    Attributes:
+        seq (int): The sequence number of the change, used as the cursor of the feed.
+        habit (str): The name of the habit.
+        event (str): What happened: 'added', 'deleted', 'checked_off', 'reset' or 'missed'.
+        date (str): The date of the change.
+        payload (dict): Further details of the change.
+
+    """
+    def __init__(self, seq, habit, event, day, payload=None):
+        """
+        Initialize a Change object from a row of the 'habit_changes' table.
+
+        Args:
+            seq (int): The sequence number of the change.
+            habit (str): The name of the habit.
+            event (str): What happened.
+            day (int): The day number of the change.
+            payload (str, optional): The details of the change as JSON. Defaults to None.
+
+        """
+        self.seq = seq
+        self.habit = habit
+        self.event = event
+        self.date = database.day_string(day)
+        self.payload = json.loads(payload) if payload else {}
+
+    def to_json(self) -> str:
+        """
+        Serialize the change as one line of JSON.
+
+        Returns:
+            str: The change with its sequence number, habit, event, date and payload.
+
+        """
+        return json.dumps({"seq": self.seq, "habit": self.habit, "event": self.event, "date": self.date, **self.payload})
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the change.
+
+        Returns:
+            str: A string representation in the format '(seq, habit, event, date)'.
+
+        """
+        return f"({self.seq}, {self.habit}, {self.event}, {self.date})"
+
+
+class RolloverPlan:
+    """
+    A class representing the changes a rollover makes, worked out before any of them is written.
+
+    Attributes:
+        local_days (dict): The day number the rollover is for in every time zone, see database.rollover_pending.
+        statuses (List[tuple]): The rollover status and the name of every due habit, in deadline order.
+        resets (List[str]): The habits whose streak breaks.
+        uncompletes (List[str]): The habits that start a new period and are set to uncompleted.
+        window_moves (List[tuple]): The habits with an anchored periodicity and the day number their window moves to.
+        missed (List[tuple]): The habits and the first day numbers of the periods they missed.
+        results (List[tuple]): The classification the plan was made from.
+        states (dict): The completion status, the last check-off, the window start and the streak every habit was planned
+            with, keyed by habit. A habit whose row no longer matches is not changed, see database.apply_rollover.
+
+    """
+    def __init__(self, local_days, results=(), states=None):
+        """
+        Initialize a RolloverPlan object from the classification of the due habits.
+
+        Args:
+            local_days (dict): The day number the rollover is for in every time zone.
+            results (List[tuple], optional): The status, the name, the new window start and the missed periods of
+                every due habit, as returned by cli.update_check. Defaults to no due habits.
+            states (dict, optional): The state every habit was planned with. Defaults to applying the plan unchecked.
+
+        """
+        self.local_days = local_days
+        self.results = list(results)
+        self.states = states or {}
+        self.statuses, self.resets, self.uncompletes, self.window_moves, self.missed = [], [], [], [], []
+        for status, habit, new_window_start, missed in results:
+            self.statuses.append((status, habit))
+            if status == schedules.BROKEN:
+                self.resets.append(habit)
+            if status in (schedules.NEW_PERIOD, schedules.BROKEN):
+                self.uncompletes.append(habit)
+            if new_window_start is not None:
+                self.window_moves.append((habit, new_window_start))
+            if missed:
+                self.missed.append((habit, missed))
+
+    def only(self, habits):
+        """Return the part of the plan that concerns the given habits."""
+        return RolloverPlan(self.local_days, [result for result in self.results if result[1] in habits],
+            {habit: state for habit, state in self.states.items() if habit in habits})
+
+    def __len__(self):
+        return len(self.resets) + len(self.uncompletes) + len(self.window_moves) + len(self.missed)
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the plan.
+
+        Returns:
+            str: A string representation in the format '(resets, uncompletes, window moves, missed periods)'.
+
+        """
+        return f"({len(self.resets)}, {len(self.uncompletes)}, {len(self.window_moves)}, {sum(len(days) for _, days in self.missed)})"
@@ -0,0 +1,111 @@
+"""
+    The background scheduler of the habit tracker.
+
+    Without it the rollover only runs when the tracker is started, so streaks break at unpredictable times and a cold
+    start pays for every habit that expired in the meantime. The scheduler runs the rollover at a fixed time of day
+    instead, either once per call (e.g. from a cron entry) or in a loop as a daemon, and sends reminders for the habits
+    whose streak breaks soon.
+
+    Every database file is one tenant with its own time zone (see timezones). A tenant is rolled over once its local
+    day has begun, and the daemon wakes up at the next time of day in any of the tenants' time zones. The tenants are
+    spread over shards that start a few seconds apart, so many tenants do not hit the disk at the same moment.
+"""
+import asyncio
+import datetime
+import zlib
+
+from habittracker import database, timezones
+
+
+class Scheduler:
+    """
+    Run the rollover and the reminders for a set of habit databases.
+
+    Attributes:
+        tenants (List[str]): The database files to roll over.
+        rollover (callable): Rolls one database over, called with the database file and the day in the format '%d %b %Y',
+            or None for the current day in the time zone of every habit.
+        remind (callable): Called with every model.Reminder, or None to only collect the reminders.
+        shards (int): The number of shards the tenants are spread over.
+        stagger (float): The seconds between the start of two shards.
+        remind_before (int): How many days before its deadline a habit is reminded of, 1 meaning on the last day.
+        run_at (datetime.time): The local time of day the rollover runs at.
+        clock (callable): Returns the current local datetime of the machine.
+        last_run (dict): The local day every tenant was last rolled over, so a tenant is rolled over at most once a day.
+        zones (dict): The time zone of every tenant seen so far, None for the local time of the machine.
+
+    """
+    def __init__(self, tenants, rollover, remind=None, shards=1, stagger=0.0, remind_before=1, run_at=datetime.time(0, 0), clock=datetime.datetime.now):
+        self.tenants = list(tenants)
+        self.rollover = rollover
+        self.remind = remind
+        self.shards = max(1, shards)
+        self.stagger = stagger
+        self.remind_before = remind_before
+        self.run_at = run_at
+        self.clock = clock
+        self.last_run = {}
+        self.zones = {}
+
+    def shard_of(self, tenant):
+        """Return the shard of a tenant. It only depends on the name of the tenant, so it is stable across runs."""
+        return zlib.crc32(tenant.encode()) % self.shards
+
+    def seconds_until_next_run(self):
+        """Return the seconds from now until the configured time of day comes next in any of the tenants' time zones."""
+        now = self.clock()
+        return min(self._seconds_until_run_at(now, zone) for zone in set(self.zones.values()) or {None})
+
+    def _seconds_until_run_at(self, now, zone):
+        tzinfo = timezones.zone(zone).zone if zone is not None else None
+        local_now = now.astimezone(tzinfo) if tzinfo is not None else now
+        next_run = datetime.datetime.combine(local_now.date(), self.run_at, tzinfo=tzinfo)
+        if next_run <= local_now:
+            next_run = datetime.datetime.combine(local_now.date() + datetime.timedelta(days=1), self.run_at, tzinfo=tzinfo)
+        if tzinfo is None:
+            return (next_run - local_now).total_seconds()
+        return next_run.timestamp() - local_now.timestamp()
+
+    async def run_once(self, today=None):
+        """
+        Roll over every tenant and collect the reminders, one shard after the other is started.
+
+        Args:
+            today (datetime.date, optional): The day to roll over to. Defaults to the current day in the time zone of every tenant.
+
+        Returns:
+            List[model.Reminder]: The reminders of all tenants, in the order of the tenants.
+        """
+        shards = [[tenant for tenant in self.tenants if self.shard_of(tenant) == index] for index in range(self.shards)]
+        results = await asyncio.gather(*(self._run_shard(index, tenants, today) for index, tenants in enumerate(shards)))
+        reminders = {tenant: tenant_reminders for result in results for tenant, tenant_reminders in result}
+        return [reminder for tenant in self.tenants for reminder in reminders.get(tenant, [])]
+
+    async def run_forever(self):
+        """Run the rollover every day at the configured time of day, starting with a run for today."""
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.seconds_until_next_run())
+
+    async def _run_shard(self, index, tenants, today):
+        await asyncio.sleep(index * self.stagger)
+        results = []
+        for tenant in tenants:
+            results.append((tenant, await asyncio.to_thread(self._run_tenant, tenant, today)))
+        return results
+
+    def _run_tenant(self, tenant, today):
+        db = database.connect_db(tenant)
+        try:
+            self.zones[tenant] = database.timezone_of(db)
+            local_today = today if today is not None else timezones.today(self.zones[tenant], self.clock().timestamp())
+            if self.last_run.get(tenant) != local_today:
+                self.rollover(tenant, today.strftime("%d %b %Y") if today is not None else None)
+                self.last_run[tenant] = local_today
+            reminders = database.habits_at_risk(db, local_today.toordinal() + self.remind_before - 1, tenant)
+        finally:
+            db.close()
+        if self.remind is not None:
+            for reminder in reminders:
+                self.remind(reminder)
+        return reminders
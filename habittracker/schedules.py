@@ -0,0 +1,538 @@
+"""
+    The periodicity engine of the habit tracker.
+
+    Every periodicity a habit can have is a schedule type in the registry below. A schedule knows how to split the
+    calendar into periods, so due windows, deadlines and the rollover status of a habit are computed with a few
+    arithmetic operations on day numbers (see database.day_number) instead of one Python loop per periodicity.
+
+    The periodicity is stored as its label, e.g. 'Daily', 'Every 3 Days', 'On Mon, Wed, Fri' or '3 Times Per Week'.
+"""
+import abc
+import calendar
+import datetime
+import heapq
+import re
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Rollover status of a habit, see Schedule.status.
+NOT_CHECKED_OFF = 0
+CHECKED_OFF = 1
+NEW_PERIOD = 2
+BROKEN = 3
+
+SCHEDULES = {}
+
+_parsed = {}
+
+
+def register(schedule_class):
+    """
+    Add a schedule type to the registry.
+
+    Args:
+        schedule_class (type): A subclass of Schedule with a unique 'kind' and a 'pattern' that matches its label.
+
+    Returns:
+        type: The registered class, so the function can be used as a class decorator.
+    """
+    SCHEDULES[schedule_class.kind] = schedule_class
+    return schedule_class
+
+
+def parse(label):
+    """
+    Find the schedule described by a periodicity label.
+
+    Args:
+        label (str): The periodicity as stored in the database.
+
+    Returns:
+        Schedule: The schedule of the periodicity.
+
+    Raises:
+        ValueError: If no registered schedule type matches the label.
+    """
+    schedule = _parsed.get(label)
+    if schedule is None:
+        for schedule_class in SCHEDULES.values():
+            match = re.fullmatch(schedule_class.pattern, label or "", re.IGNORECASE)
+            if match:
+                schedule = schedule_class.from_match(match)
+                break
+        else:
+            raise ValueError(f"Unknown periodicity '{label}'")
+        _parsed[label] = schedule
+    return schedule
+
+
+def expected_checkoffs(label, started, today):
+    """
+    Count the check-offs a habit needs from its start until today to never miss a period.
+
+    It is registered as the SQL function 'expected_checkoffs' by database.connect_db.
+
+    Args:
+        label (str): The periodicity of the habit.
+        started (int): The day number the habit was started.
+        today (int): The current day number.
+
+    Returns:
+        int: The number of periods since the start, including the current one, times the check-offs per period,
+        or None if the start of the habit is unknown.
+    """
+    if started is None:
+        return None
+    schedule = parse(label)
+    return max(1, schedule.period_index(today, started) - schedule.period_index(started, started) + 1) * schedule.target
+
+
+def window_start(label, day, anchor):
+    """
+    Find the first day of the due window that contains a day.
+
+    It is registered as the SQL function 'window_start' by database.connect_db.
+
+    Args:
+        label (str): The periodicity of the habit.
+        day (int): The day number.
+        anchor (int): The day number the periods are counted from, used by anchored schedules.
+
+    Returns:
+        int: The first day number of the window.
+    """
+    return parse(label).window(day, anchor)[0]
+
+
+def period_target(label):
+    """
+    Look up the number of check-offs that complete a period of a periodicity.
+
+    It is registered as the SQL function 'period_target' by database.connect_db.
+
+    Args:
+        label (str): The periodicity of the habit.
+
+    Returns:
+        int: The target of the schedule.
+    """
+    return parse(label).target
+
+
+class Schedule(abc.ABC):
+    """
+    The base class of all schedule types. A schedule type has to implement label, period_index and window.
+
+    Attributes:
+        kind (str): The name of the schedule type in the registry.
+        pattern (str): A regular expression that matches the labels of the schedule type.
+        anchored (bool): Whether the periods are counted from the habit's own window start instead of the calendar.
+        target (int): The number of check-offs per period to complete it.
+        days (float): The average length of one period in days.
+        noun (str): How the current period is called in messages, e.g. 'today' or 'this week'.
+
+    """
+    kind = None
+    pattern = None
+    anchored = False
+    target = 1
+    days = 1
+    noun = "this period"
+
+    @classmethod
+    def from_match(cls, match):
+        """Create the schedule from a match of its label pattern."""
+        return cls()
+
+    @property
+    @abc.abstractmethod
+    def label(self):
+        """The periodicity label stored in the database."""
+
+    @abc.abstractmethod
+    def period_index(self, day, anchor):
+        """
+        Number the period that contains a day.
+
+        Args:
+            day (int): The day number.
+            anchor (int): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            int: The index of the period. Consecutive periods have consecutive indexes.
+        """
+
+    @abc.abstractmethod
+    def window(self, day, anchor):
+        """
+        Find the due window (period) that contains a day.
+
+        Args:
+            day (int): The day number.
+            anchor (int): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            tuple: The first and the last day number of the window.
+        """
+
+    def next_deadline(self, last_completion, anchor):
+        """
+        Find the last day the next check-off can happen without breaking the streak.
+
+        Args:
+            last_completion (int): The day number of the last check-off.
+            anchor (int): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            int: The last day number of the window following the window of the last check-off.
+        """
+        return self.window(self.window(last_completion, anchor)[1] + 1, anchor)[1]
+
+    def deadline(self, last_completion, completed, streak, window_start=None, anchor=None):
+        """
+        Find the last day the rollover can leave a habit alone, i.e. the last day before its status changes.
+
+        Args:
+            last_completion (int): The day number of the check-off that completed the last period, or None.
+            completed (bool): Whether the habit is marked as completed.
+            streak (int): The current streak of the habit.
+            window_start (int, optional): The first day number of the stored window of an anchored schedule. Defaults to the anchor.
+            anchor (int, optional): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            int: The deadline day number, or None if the status does not change before the next check-off.
+        """
+        if self.anchored:
+            anchor = window_start if window_start is not None else anchor
+            return self.window(anchor, anchor)[1]
+        if last_completion is None:
+            return None
+        if completed:
+            return self.window(last_completion, anchor)[1]
+        if streak > 0:
+            return self.next_deadline(last_completion, anchor)
+        return None
+
+    def status(self, last_completion, today, window_start=None, anchor=None):
+        """
+        Classify a habit for the rollover.
+
+        The open window of a habit is the stored window of an anchored schedule, or the window of the last check-off
+        otherwise. As long as today lies inside it, nothing rolls over. Once it closed, the habit either moves on to
+        the next period with its streak intact, or its streak breaks because a whole period passed without a
+        completed check-off.
+
+        Args:
+            last_completion (int): The day number of the check-off that completed the last period, or None.
+            today (int): The current day number.
+            window_start (int, optional): The first day number of the stored window of an anchored schedule. Defaults to the anchor.
+            anchor (int, optional): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            tuple: The status (NOT_CHECKED_OFF, CHECKED_OFF, NEW_PERIOD or BROKEN) and the start of the window containing today.
+        """
+        if self.anchored:
+            anchor = window_start if window_start is not None else anchor
+            window_start = anchor
+        else:
+            window_start = last_completion if last_completion is not None else today
+        start, end = self.window(window_start, anchor)
+        completed = last_completion is not None and last_completion >= start
+        if today <= end:
+            return (CHECKED_OFF if completed else NOT_CHECKED_OFF), start
+        current_start = self.window(today, anchor)[0]
+        if last_completion is None:
+            return NOT_CHECKED_OFF, current_start
+        if completed and current_start == end + 1:
+            return NEW_PERIOD, current_start
+        return BROKEN, current_start
+
+    def missed_periods(self, last_completion, today, window_start=None, anchor=None):
+        """
+        List the periods that passed without a completed check-off between the open window of a habit and today.
+
+        Like status, it jumps straight from the open window to the window containing today, so a habit that was left
+        alone for months is caught up in one call. Their number is the difference of two period indexes; the list only
+        walks the missed windows to name their first days.
+
+        Args:
+            last_completion (int): The day number of the check-off that completed the last period, or None.
+            today (int): The current day number.
+            window_start (int, optional): The first day number of the stored window of an anchored schedule. Defaults to the anchor.
+            anchor (int, optional): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            list: The first day number of every missed period, oldest first. The period containing today is never missed yet.
+        """
+        if self.anchored:
+            anchor = window_start if window_start is not None else anchor
+            start = anchor
+        elif last_completion is None:
+            return []
+        else:
+            start = last_completion
+        first, end = self.window(start, anchor)
+        if last_completion is not None and last_completion >= first:
+            first = end + 1
+        current = self.window(today, anchor)[0]
+        missed = []
+        while first < current:
+            missed.append(first)
+            first = self.window(first, anchor)[1] + 1
+        return missed
+
+    def replay(self, days, today, anchor=None):
+        """
+        Derive the streak of a habit from the days it was checked off, e.g. after the check-offs of several devices were merged.
+
+        A period is completed by its target-th check-off. The streak is the run of completed periods that ends with
+        the current or the previous period, as a streak only breaks once a whole period passed without a check-off.
+
+        Args:
+            days (iterable): The day numbers of all check-offs. Duplicates count once.
+            today (int): The current day number.
+            anchor (int, optional): The day number the periods are counted from, used by anchored schedules.
+
+        Returns:
+            tuple: The streak, the longest streak, whether the current period is completed and the day number of the
+            check-off that completed the last period, or None.
+        """
+        checkoffs = {}
+        completing = {}
+        for day in sorted(set(days)):
+            period = self.period_index(day, anchor)
+            checkoffs[period] = checkoffs.get(period, 0) + 1
+            if checkoffs[period] == self.target:
+                completing[period] = day
+        streak = max_streak = 0
+        previous = None
+        for period in sorted(completing):
+            streak = streak + 1 if previous is not None and period == previous + 1 else 1
+            max_streak = max(max_streak, streak)
+            previous = period
+        current = self.period_index(today, anchor)
+        if previous is None or previous < current - 1:
+            streak = 0
+        return streak, max_streak, current in completing, completing.get(previous)
+
+    def __eq__(self, other):
+        return isinstance(other, Schedule) and self.label == other.label
+
+    def __hash__(self):
+        return hash(self.label)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.label!r})"
+
+
+@register
+class Daily(Schedule):
+    """One check-off every calendar day."""
+    kind = "daily"
+    pattern = r"daily"
+    noun = "today"
+
+    @property
+    def label(self):
+        return "Daily"
+
+    def period_index(self, day, anchor):
+        return day
+
+    def window(self, day, anchor):
+        return day, day
+
+
+@register
+class EveryNDays(Schedule):
+    """One check-off in every window of n days, counted from the habit's window start."""
+    kind = "every_n_days"
+    pattern = r"every (\d+) days?"
+    anchored = True
+
+    def __init__(self, n=2):
+        if n < 1:
+            raise ValueError("A periodicity needs at least one day per period")
+        self.n = n
+        self.days = n
+
+    @classmethod
+    def from_match(cls, match):
+        return cls(int(match.group(1)))
+
+    @property
+    def label(self):
+        return f"Every {self.n} Days"
+
+    def period_index(self, day, anchor):
+        return (day - anchor) // self.n
+
+    def window(self, day, anchor):
+        start = anchor + self.period_index(day, anchor) * self.n
+        return start, start + self.n - 1
+
+
+@register
+class Weekly(EveryNDays):
+    """One check-off in every window of seven days, counted from the habit's window start."""
+    kind = "weekly"
+    pattern = r"weekly"
+    noun = "this week"
+
+    def __init__(self):
+        super().__init__(7)
+
+    @classmethod
+    def from_match(cls, match):
+        return cls()
+
+    @property
+    def label(self):
+        return "Weekly"
+
+
+@register
+class Weekdays(Schedule):
+    """One check-off on each of a set of weekdays. A window runs from a due weekday until the day before the next one."""
+    kind = "weekdays"
+    pattern = r"on ((?:mon|tue|wed|thu|fri|sat|sun)(?:, ?(?:mon|tue|wed|thu|fri|sat|sun))*)"
+    noun = "since the last due day"
+
+    def __init__(self, weekdays):
+        self.weekdays = sorted(set(weekdays))
+        if len(self.weekdays) == 0:
+            raise ValueError("A periodicity needs at least one weekday")
+        self.days = 7 / len(self.weekdays)
+
+    @classmethod
+    def from_match(cls, match):
+        names = [name.strip().capitalize() for name in match.group(1).split(",")]
+        return cls([WEEKDAYS.index(name) for name in names])
+
+    @property
+    def label(self):
+        return "On " + ", ".join(WEEKDAYS[weekday] for weekday in self.weekdays)
+
+    def _last_due(self, day):
+        weekday = datetime.date.fromordinal(day).weekday()
+        return day - min((weekday - due) % 7 for due in self.weekdays)
+
+    def period_index(self, day, anchor):
+        # Day number 1 (01 Jan 0001) is a Monday, so (day - 1) // 7 numbers the calendar weeks.
+        week, weekday = divmod(self._last_due(day) - 1, 7)
+        return week * len(self.weekdays) + self.weekdays.index(weekday)
+
+    def window(self, day, anchor):
+        start = self._last_due(day)
+        weekday = datetime.date.fromordinal(start).weekday()
+        return start, start + min((due - weekday - 1) % 7 for due in self.weekdays)
+
+
+@register
+class Monthly(Schedule):
+    """One check-off every calendar month."""
+    kind = "monthly"
+    pattern = r"monthly"
+    days = 30.4
+    noun = "this month"
+
+    @property
+    def label(self):
+        return "Monthly"
+
+    def period_index(self, day, anchor):
+        date = datetime.date.fromordinal(day)
+        return date.year * 12 + date.month - 1
+
+    def window(self, day, anchor):
+        date = datetime.date.fromordinal(day)
+        start = date.replace(day=1).toordinal()
+        return start, start + calendar.monthrange(date.year, date.month)[1] - 1
+
+
+@register
+class TimesPerWeek(Schedule):
+    """A number of check-offs in every calendar week from Monday to Sunday."""
+    kind = "times_per_week"
+    pattern = r"(\d+) times? per week"
+    days = 7
+    noun = "this week"
+
+    def __init__(self, n=2):
+        if not 1 <= n <= 7:
+            raise ValueError("A week holds between one and seven check-offs")
+        self.target = n
+
+    @classmethod
+    def from_match(cls, match):
+        return cls(int(match.group(1)))
+
+    @property
+    def label(self):
+        return f"{self.target} Times Per Week"
+
+    def period_index(self, day, anchor):
+        # Day number 1 (01 Jan 0001) is a Monday.
+        return (day - 1) // 7
+
+    def window(self, day, anchor):
+        start = day - (day - 1) % 7
+        return start, start + 6
+
+
+class DeadlineQueue:
+    """
+    A min-heap of habits ordered by their deadline, for processes that keep running across several rollovers.
+
+    Moving a deadline pushes a new entry and leaves the old one in the heap, where it is skipped once it surfaces, so
+    every operation costs O(log n) and a rollover only touches the habits whose deadline has passed.
+
+    Attributes:
+        deadlines (dict): The current deadline of every queued habit.
+    """
+
+    def __init__(self, deadlines=()):
+        """
+        Args:
+            deadlines (iterable): Pairs of a deadline day number and a habit, e.g. from database.habit_deadlines.
+        """
+        self.deadlines = {habit: deadline for deadline, habit in deadlines}
+        self._heap = [(deadline, habit) for habit, deadline in self.deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def push(self, habit, deadline):
+        """Queue a habit with a new deadline, or drop it if the deadline is None."""
+        if deadline is None:
+            self.deadlines.pop(habit, None)
+            return
+        self.deadlines[habit] = deadline
+        heapq.heappush(self._heap, (deadline, habit))
+
+    def _drop_stale(self):
+        while self._heap and self.deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def peek(self):
+        """Return the earliest deadline, or None if the queue is empty."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, today):
+        """
+        Remove the habits whose deadline lies before a day.
+
+        Args:
+            today (int): The current day number.
+
+        Returns:
+            list: The names of the due habits, earliest deadline first. They have to be pushed again with their new deadline.
+        """
+        due = []
+        while self.peek() is not None and self._heap[0][0] < today:
+            deadline, habit = heapq.heappop(self._heap)
+            del self.deadlines[habit]
+            due.append(habit)
+        return due
+
+    def __len__(self):
+        return len(self.deadlines)
@@ -0,0 +1,163 @@
+"""
+    Type-ahead search over the names of the habits.
+
+    The names are kept in memory twice: sorted by their lower-case form, so all names with a given prefix are one
+    binary search away (the same lookups as a trie, without a node object per letter), and in an index of the
+    trigrams (three-letter pieces) of every name, so names containing the query anywhere, or resembling it despite a
+    typo, are found by intersecting a few small sets instead of scanning every name.
+
+    The index of a database is built once and then follows the 'added', 'deleted' and 'renamed' events of the change feed (see
+    database.habit_name_changes), so adding or deleting a habit only touches the entries of that habit.
+"""
+import bisect
+
+from habittracker import database
+
+_indexes = {}
+
+
+def trigrams(key):
+    """Return the trigrams of a lower-case name, padded so the start and the end of the name count as well."""
+    padded = f"^{key}$"
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class HabitIndex:
+    """
+    A search index over habit names.
+
+    Attributes:
+        entries (List[tuple]): The lower-case form and the name of every habit, sorted.
+        grams (dict): The names containing every trigram, keyed by trigram.
+        cursor (int): The sequence number of the last change of the change feed the index has seen.
+
+    """
+    def __init__(self, names=(), cursor=0):
+        self.entries = sorted((name.lower(), name) for name in set(names))
+        self.grams = {}
+        self.cursor = cursor
+        for key, name in self.entries:
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(name)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        entry = (name.lower(), name)
+        position = bisect.bisect_left(self.entries, entry)
+        return position < len(self.entries) and self.entries[position] == entry
+
+    def add(self, name):
+        """Add a name to the index, unless it is indexed already."""
+        if name in self:
+            return
+        key = name.lower()
+        bisect.insort(self.entries, (key, name))
+        for gram in trigrams(key):
+            self.grams.setdefault(gram, set()).add(name)
+
+    def remove(self, name):
+        """Remove a name from the index, if it is indexed."""
+        if name not in self:
+            return
+        key = name.lower()
+        del self.entries[bisect.bisect_left(self.entries, (key, name))]
+        for gram in trigrams(key):
+            self.grams[gram].discard(name)
+            if not self.grams[gram]:
+                del self.grams[gram]
+
+    def prefix(self, query, limit=10):
+        """
+        Find the names starting with a query, ignoring case.
+
+        Args:
+            query (str): The start of the name.
+            limit (int, optional): The maximum number of names. Defaults to 10.
+
+        Returns:
+            List[str]: The matching names in alphabetical order.
+        """
+        key = query.lower()
+        start = bisect.bisect_left(self.entries, (key,))
+        matches = []
+        for entry_key, name in self.entries[start:start + limit]:
+            if not entry_key.startswith(key):
+                break
+            matches.append(name)
+        return matches
+
+    def search(self, query, limit=10):
+        """
+        Find the names matching a query, ignoring case: first the names starting with it, then the names containing
+        it, and then the names sharing most of its trigrams, so a typo still finds the habit.
+
+        Args:
+            query (str): The typed text.
+            limit (int, optional): The maximum number of names. Defaults to 10.
+
+        Returns:
+            List[str]: The matching names, best matches first.
+        """
+        matches = self.prefix(query, limit)
+        key = query.lower()
+        if len(matches) >= limit or len(key) < 3:
+            return matches
+        found = set(matches)
+        postings = sorted((self.grams.get(key[index:index + 3], set()) for index in range(len(key) - 2)), key=len)
+        candidates = set.intersection(*postings) if postings and postings[0] else set()
+        for name in sorted((name for name in candidates - found if key in name.lower()), key=lambda name: (len(name), name.lower()))[:limit - len(matches)]:
+            matches.append(name)
+            found.add(name)
+        if len(matches) < limit:
+            query_grams = trigrams(key)
+            shared = {}
+            for gram in query_grams:
+                for name in self.grams.get(gram, ()):
+                    if name not in found:
+                        shared[name] = shared.get(name, 0) + 1
+            similar = [name for name, count in shared.items() if 2 * count >= len(query_grams)]
+            similar.sort(key=lambda name: (-shared[name], len(name), name.lower()))
+            matches.extend(similar[:limit - len(matches)])
+        return matches
+
+    def refresh(self, db):
+        """
+        Apply the habits added and deleted since the index last looked at the change feed.
+
+        Args:
+            db (sqlite3.Connection): A connection to the database.
+        """
+        latest = database.latest_change(db)
+        if latest == self.cursor:
+            return
+        for seq, habit, event in database.habit_name_changes(db, self.cursor):
+            if event == "added":
+                self.add(habit)
+            else:
+                self.remove(habit)
+        self.cursor = latest
+
+
+def index_of(db):
+    """
+    Find the search index of a database, building it on first use and bringing it up to date otherwise.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        HabitIndex: The search index.
+    """
+    path = db.execute("PRAGMA database_list").fetchone()[2]
+    index = _indexes.get(path)
+    # A change feed older than the index means the database file was replaced, so its index starts over.
+    if index is None or not path or database.latest_change(db) < index.cursor:
+        cursor = database.latest_change(db)
+        index = HabitIndex(database.habit_names(db), cursor)
+        if path:
+            _indexes[path] = index
+    else:
+        index.refresh(db)
+    return index
@@ -0,0 +1,272 @@
+"""
+    Offline synchronization of several replicas (e.g. two laptops) of the same habit tracker.
+
+    Every replica keeps a log of the habits it added, renamed and deleted and of the days they were checked off, stamped
+    with a hybrid logical clock (HLC). Replicas exchange only the part of the log the other side has not seen yet, through a
+    delta file, so the cost of a sync grows with the number of changes and not with the size of the database.
+
+    Merging is deterministic: events are ordered by their clock stamps, the last add, delete or rename of a habit
+    decides whether it exists under a name, check-offs are a set of days, and the streaks are derived from the merged
+    check-offs (see schedules.Schedule.replay) instead of copying the counters of whichever replica synced last. The
+    log is keyed by names, so a habit that was renamed carries the events of its old name up to the rename.
+"""
+import json
+import time
+import uuid
+
+from habittracker import database, model, schedules
+
+SYNCED_EVENTS = ("added", "deleted", "checked_off", "renamed")
+
+
+def replica_id(db):
+    """
+    Find the id of the local replica, creating it on first use.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+
+    Returns:
+        str: The id of the replica.
+    """
+    replica = database.get_setting(db, "replica_id")
+    if replica is None:
+        replica = uuid.uuid4().hex[:12]
+        database.set_setting(db, "replica_id", replica)
+    return replica
+
+
+def format_hlc(wall, counter, replica):
+    """
+    Encode a hybrid logical clock stamp as a string that sorts in clock order.
+
+    Args:
+        wall (int): The physical part in milliseconds since the epoch.
+        counter (int): The logical counter for events within the same millisecond.
+        replica (str): The replica that created the event, which breaks ties.
+
+    Returns:
+        str: The stamp.
+    """
+    return f"{wall:015d}.{counter:05d}.{replica}"
+
+
+def parse_hlc(stamp):
+    """
+    Decode a hybrid logical clock stamp.
+
+    Args:
+        stamp (str): The stamp, or None.
+
+    Returns:
+        tuple: The physical part and the counter, (0, 0) if no stamp is given.
+    """
+    if not stamp:
+        return 0, 0
+    wall, counter, _ = stamp.split(".", 2)
+    return int(wall), int(counter)
+
+
+class Clock:
+    """
+    The hybrid logical clock of the local replica. Its state is kept in the settings, so it never goes backwards.
+
+    Attributes:
+        db (sqlite3.Connection): A connection to the database.
+        replica (str): The id of the local replica.
+        wall (int): The physical part of the last stamp.
+        counter (int): The counter of the last stamp.
+
+    """
+    def __init__(self, db):
+        self.db = db
+        self.replica = replica_id(db)
+        self.wall, self.counter = parse_hlc(database.get_setting(db, "hlc"))
+
+    def tick(self):
+        """Return the stamp of a new local event."""
+        now = int(time.time() * 1000)
+        if now > self.wall:
+            self.wall, self.counter = now, 0
+        else:
+            self.counter += 1
+        return format_hlc(self.wall, self.counter, self.replica)
+
+    def receive(self, stamp):
+        """Move the clock past the stamp of an event from another replica."""
+        wall, counter = parse_hlc(stamp)
+        if (wall, counter) > (self.wall, self.counter):
+            self.wall, self.counter = wall, counter
+
+    def save(self):
+        """Store the state of the clock."""
+        database.set_setting(self.db, "hlc", format_hlc(self.wall, self.counter, self.replica))
+
+
+def capture(db, clock=None):
+    """
+    Copy the local changes since the last capture from the change feed into the replicated log.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        clock (Clock, optional): The clock to stamp the events with. Defaults to the clock of the replica.
+
+    Returns:
+        int: The number of captured events.
+    """
+    clock = clock if clock is not None else Clock(db)
+    cursor = database.get_setting(db, "sync_cursor")
+    events = []
+    if cursor is None:
+        # The first capture seeds the log with the current habits, as their history may predate the change feed.
+        cursor = database.latest_change(db)
+        for habit in database.all_habits(db):
+            payload = json.dumps({"description": habit.description, "periodicity": habit.periodicity})
+            events.append((clock.tick(), clock.replica, habit.habit, "added", database.day_number(habit.starting_date), payload))
+            for day in sorted(database.completed_days(db, habit.habit)):
+                events.append((clock.tick(), clock.replica, habit.habit, "checked_off", day, "{}"))
+    for change in database.stream_changes(db, int(cursor)):
+        cursor = change.seq
+        if change.event in SYNCED_EVENTS:
+            day = database.day_number(change.date) if change.date is not None else None
+            events.append((clock.tick(), clock.replica, change.habit, change.event, day, json.dumps(change.payload)))
+    database.insert_sync_events(db, events)
+    database.set_setting(db, "sync_cursor", str(cursor))
+    clock.save()
+    return len(events)
+
+
+def export_delta(db, path, peer=None):
+    """
+    Write the events another replica has not seen yet into a delta file.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        path (str): The file to write.
+        peer (str, optional): The id of the replica the file is meant for. Its last known state is read from the
+            delta it sent last. Defaults to exporting the whole log.
+
+    Returns:
+        int: The number of exported events.
+    """
+    capture(db)
+    peer_vector = json.loads(database.get_setting(db, f"sync_peer:{peer}", "{}")) if peer is not None else {}
+    events = database.sync_events_after(db, peer_vector)
+    with open(path, "w") as delta:
+        json.dump({"replica": replica_id(db), "vector": database.sync_vector(db), "events": events}, delta)
+    return len(events)
+
+
+def import_delta(db, path, today=None):
+    """
+    Merge a delta file of another replica and derive the state of every habit it touched.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        path (str): The file to read.
+        today (int, optional): The current day number. Defaults to today in the time zone of every habit.
+
+    Returns:
+        List[str]: The habits whose state was merged, sorted by name.
+    """
+    with open(path) as delta:
+        delta = json.load(delta)
+    clock = Clock(db)
+    capture(db, clock)
+    for event in delta["events"]:
+        clock.receive(event[0])
+    changed = database.insert_sync_events(db, delta["events"])
+    database.set_setting(db, f"sync_peer:{delta['replica']}", json.dumps(delta["vector"]))
+    clock.save()
+    # Renames go first, in clock order, so the merge finds a renamed habit with its history under the new name.
+    for _, _, habit, event, _, payload in sorted(delta["events"]):
+        if event == "renamed":
+            renamed_from = json.loads(payload)["renamed_from"]
+            changed.add(renamed_from)
+            last = lifecycle(db, renamed_from)[-1]
+            if (last[1], last[3]) == ("renamed", habit) and database.habit_existing_check(db, renamed_from) and not database.habit_existing_check(db, habit):
+                database.rename_habit(db, renamed_from, habit)
+    for habit in sorted(changed):
+        merge_habit(db, habit, today)
+    # The merge itself wrote to the change feed; those changes came from the other replica and must not be captured again.
+    database.set_setting(db, "sync_cursor", str(database.latest_change(db)))
+    return sorted(changed)
+
+
+def habit_events(db, habit, before=None):
+    """
+    Collect the replicated events of a habit, together with the events of the names it was renamed from, up to the rename.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The habit.
+        before (str, optional): Only collect the events before this hybrid logical clock stamp. Defaults to all events.
+
+    Returns:
+        List[tuple]: The (hlc, event, day, payload) rows, in clock order.
+    """
+    events = [event for event in database.sync_events_of_habit(db, habit) if before is None or event[0] < before]
+    for hlc, event, _, payload in list(events):
+        if event == "renamed":
+            events.extend(habit_events(db, json.loads(payload)["renamed_from"], hlc))
+    return sorted(events)
+
+
+def lifecycle(db, habit):
+    """
+    Collect the events that decide whether a habit exists under a name: its adds and deletes, including the ones of the
+    names it was renamed from, and the renames of the name to another one.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The name.
+
+    Returns:
+        List[tuple]: The (hlc, event, day, payload) rows in clock order. A rename to another name is a 'renamed' row
+        with the new name as its payload.
+    """
+    events = [event for event in habit_events(db, habit) if event[1] in ("added", "deleted")]
+    events.extend((hlc, "renamed", day, new_name) for hlc, day, new_name in database.sync_renames_from(db, habit))
+    return sorted(events)
+
+
+def merge_habit(db, habit, today=None):
+    """
+    Bring one habit in line with the merged events of all replicas.
+
+    Args:
+        db (sqlite3.Connection): A connection to the database.
+        habit (str): The habit.
+        today (int, optional): The current day number. Defaults to today in the time zone of the habit.
+
+    Returns:
+        None
+    """
+    events = lifecycle(db, habit)
+    exists = database.habit_existing_check(db, habit)
+    if not events:
+        return
+    if events[-1][1] == "deleted":
+        if exists:
+            database.delete_habit(db, habit)
+        return
+    if events[-1][1] == "renamed":
+        # The habit lives on under its new name, if it could be renamed (see import_delta).
+        return
+    added_at, _, started, payload = events[-1]
+    payload = json.loads(payload)
+    if not exists:
+        starting_date = database.day_string(started)
+        anchored = schedules.parse(payload["periodicity"]).anchored
+        database.insert_habit(db, habit, payload["description"], payload["periodicity"], starting_date,
+            starting_date if anchored else None, 1, None, 0, 0)
+
+    habit_id = database.habit_id(db, habit)
+    schedule = schedules.parse(database.periodicity_of_habit(db, habit_id))
+    anchor = database.day_number(database.get_starting_date(db, habit_id))
+    today = today if today is not None else database.local_today(db, habit).toordinal()
+    days = {event[2] for event in habit_events(db, habit) if event[1] == "checked_off" and event[0] > added_at}
+    streak, max_streak, completed, last_completion = schedule.replay(days, today, anchor)
+    window_start = schedule.window(today, anchor)[0] if schedule.anchored else None
+    database.apply_synced_state(db, habit, days - database.completed_days(db, habit), streak, max_streak,
+        model.Completion.COMPLETED if completed else model.Completion.UNCOMPLETED, database.day_string(last_completion), database.day_string(window_start))
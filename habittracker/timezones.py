@@ -0,0 +1,125 @@
+"""
+    Local day numbers for users in any time zone.
+
+    A habit day is a day of the user's own calendar, so the current day number (see database.day_number) depends on
+    the time zone of the user. Asking zoneinfo for every habit of a bulk rollover is slow, so the UTC offsets of a zone
+    are precomputed once per year as a sorted list of transitions. Converting a UTC timestamp into a local day number
+    is then one binary search and an integer division.
+
+    Without a configured time zone the local time of the machine is used, as before.
+"""
+import bisect
+import calendar
+import datetime
+import time
+import zoneinfo
+
+EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+SECONDS_PER_DAY = 86400
+
+_zones = {}
+
+
+class ZoneDays:
+    """
+    Convert UTC timestamps into local day numbers of one time zone.
+
+    Attributes:
+        name (str): The IANA name of the zone, e.g. 'Europe/Berlin'.
+        zone (zoneinfo.ZoneInfo): The zone.
+
+    """
+    def __init__(self, name):
+        self.name = name
+        self.zone = zoneinfo.ZoneInfo(name)
+        self._years = {}
+
+    def _offset(self, timestamp):
+        return int(datetime.datetime.fromtimestamp(timestamp, self.zone).utcoffset().total_seconds())
+
+    def transitions(self, year):
+        """
+        Compute the UTC offsets of a year, probing once a day and bisecting to the second where the offset changes.
+
+        Args:
+            year (int): The UTC year.
+
+        Returns:
+            tuple: The sorted UTC timestamps the offsets start at, and the offsets in seconds.
+        """
+        table = self._years.get(year)
+        if table is None:
+            start = calendar.timegm((year, 1, 1, 0, 0, 0))
+            end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+            starts, offsets = [start], [self._offset(start)]
+            for probe in range(start + SECONDS_PER_DAY, end + 1, SECONDS_PER_DAY):
+                offset = self._offset(probe)
+                if offset == offsets[-1]:
+                    continue
+                low, high = probe - SECONDS_PER_DAY, probe
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if self._offset(middle) == offsets[-1]:
+                        low = middle
+                    else:
+                        high = middle
+                if high < end:
+                    starts.append(high)
+                    offsets.append(offset)
+            table = self._years[year] = (starts, offsets)
+        return table
+
+    def day_number(self, timestamp=None):
+        """
+        Convert a UTC timestamp into the local day number.
+
+        Args:
+            timestamp (float, optional): Seconds since the epoch. Defaults to now.
+
+        Returns:
+            int: The day number of the local date.
+        """
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        year = datetime.date.fromordinal(timestamp // SECONDS_PER_DAY + EPOCH_DAY).year
+        starts, offsets = self.transitions(year)
+        offset = offsets[bisect.bisect_right(starts, timestamp) - 1]
+        return (timestamp + offset) // SECONDS_PER_DAY + EPOCH_DAY
+
+
+def zone(name):
+    """
+    Find the day converter of a time zone, precomputing it on first use.
+
+    Args:
+        name (str): The IANA name of the zone.
+
+    Returns:
+        ZoneDays: The day converter of the zone.
+
+    Raises:
+        ValueError: If the zone is unknown.
+    """
+    days = _zones.get(name)
+    if days is None:
+        try:
+            days = _zones[name] = ZoneDays(name)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown time zone '{name}'")
+    return days
+
+
+def today(name=None, timestamp=None):
+    """
+    Find the current local date of a time zone.
+
+    Args:
+        name (str, optional): The IANA name of the zone. Defaults to the local time of the machine.
+        timestamp (float, optional): Seconds since the epoch. Defaults to now.
+
+    Returns:
+        datetime.date: The local date.
+    """
+    if name is None:
+        return datetime.datetime.now().date() if timestamp is None else datetime.datetime.fromtimestamp(timestamp).date()
+    return datetime.date.fromordinal(zone(name).day_number(timestamp))
@@ -0,0 +1,217 @@
+"""
+    Group commit of the mutations of many concurrent clients, for a long-running process serving them.
+
+    SQLite lets one writer in at a time and every commit waits for the disk, so one transaction per check-off caps
+    the throughput at the number of commits the disk can do. The write queue collects the mutations that arrive
+    within a short window, or until a batch is full, and applies them in one transaction (see
+    database.apply_writes). Every caller still waits until the batch holding its mutation is committed and gets its
+    own result or error, so a mutation is durable once its caller has the result, just like with its own commit.
+
+    The daemon serves the queue to its clients over a Unix socket (see WriteServer): a client sends a mutation as one
+    line of JSON and gets its result as one line back. The check-off command sends its check-off there when it is given
+    the socket of a running daemon, and writes directly otherwise.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import socket
+
+from habittracker import database
+
+
+class WriteQueue:
+    """
+    Batch the mutations of one database into shared transactions.
+
+    Attributes:
+        db_name (str): The database file.
+        window (float): The seconds a batch waits for more mutations after its first one arrived.
+        max_batch (int): The number of mutations that closes a batch right away.
+        pending (list): The operation, the arguments and the future of every mutation of the open batch.
+
+    """
+    def __init__(self, db_name, window=0.002, max_batch=256):
+        self.db_name = db_name
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.pending = []
+        self._timer = None
+        self._flushes = set()
+        self._db = None
+        # One thread owns the connection, so the batches are committed one after the other in their order.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, operation, *args):
+        """
+        Queue a mutation and wait until the batch holding it is committed.
+
+        Args:
+            operation (str): The name of the mutation, see database.WRITE_OPERATIONS.
+            *args: The arguments of the mutation.
+
+        Returns:
+            The result of the mutation.
+
+        Raises:
+            Exception: The error of the mutation, e.g. sqlite3.IntegrityError for a habit name that is taken.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((operation, args, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    async def check_off(self, habit, datetime_completed, request_id=None):
+        """Check off a habit, see database.submit_check_off."""
+        return await self.submit("check_off", habit, datetime_completed, request_id)
+
+    async def add(self, habit, description, periodicity, starting_date, startdate_weekly=None):
+        """Add a habit that was not checked off yet and return its id, see database.insert_habit."""
+        return await self.submit("add", habit, description, periodicity, starting_date, startdate_weekly, 1, None, 0, 0)
+
+    async def delete(self, habit):
+        """Delete a habit, see database.delete_habit."""
+        return await self.submit("delete", habit)
+
+    def flush(self):
+        """Close the open batch and start committing it."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._commit(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def close(self):
+        """Commit the open batch, wait for all batches and close the connection."""
+        self.flush()
+        if self._flushes:
+            await asyncio.wait(set(self._flushes))
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+
+    async def _commit(self, batch):
+        try:
+            outcomes = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._apply, [(operation, args) for operation, args, _ in batch])
+        except Exception as error:
+            outcomes = [(error, None)] * len(batch)
+        for (_, _, future), (error, result) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _apply(self, writes):
+        if self._db is None:
+            self._db = database.connect_db(self.db_name)
+        return database.apply_writes(self._db, writes)
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class WriteServer:
+    """
+    Accept the mutations of clients over a Unix socket and commit them through the write queue of their database.
+
+    Every request is one line of JSON with the 'database', the name of the 'operation' (see database.WRITE_OPERATIONS)
+    and its 'args'. The answer is one line of JSON with the 'result' of the mutation, or its 'error'.
+
+    Attributes:
+        path (str): The file of the Unix socket.
+        databases (List[str]): The absolute paths of the database files the server accepts mutations for.
+        window (float): The seconds a batch waits for more mutations, see WriteQueue.
+        max_batch (int): The number of mutations that closes a batch right away.
+        queues (dict): The write queue of every database that received a mutation.
+
+    """
+    def __init__(self, path, databases, window=0.002, max_batch=256):
+        self.path = path
+        self.databases = [os.path.abspath(db_name) for db_name in databases]
+        self.window = window
+        self.max_batch = max_batch
+        self.queues = {}
+        self._server = None
+
+    async def start(self):
+        """Start listening on the socket."""
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+
+    async def close(self):
+        """Stop listening and commit the mutations still queued for any database."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for queue in self.queues.values():
+            await queue.close()
+        self.queues = {}
+
+    def queue(self, db_name):
+        """Return the write queue of a database, creating it on first use."""
+        if db_name not in self.queues:
+            self.queues[db_name] = WriteQueue(db_name, self.window, self.max_batch)
+        return self.queues[db_name]
+
+    async def _serve(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                writer.write(json.dumps(await self._answer(line)).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _answer(self, line):
+        try:
+            request = json.loads(line)
+            db_name = os.path.abspath(request["database"])
+            if db_name not in self.databases:
+                raise ValueError(f"The daemon does not serve the database '{db_name}'")
+            if request["operation"] not in database.WRITE_OPERATIONS:
+                raise ValueError(f"Unknown operation '{request['operation']}'")
+            return {"result": await self.queue(db_name).submit(request["operation"], *request["args"])}
+        except Exception as error:
+            return {"error": f"{type(error).__name__}: {error}"}
+
+
+def submit(path, db_name, operation, *args, timeout=10.0):
+    """
+    Send a mutation to the write server of a daemon and wait until it is committed.
+
+    Args:
+        path (str): The file of the Unix socket of the daemon.
+        db_name (str): The database file to apply the mutation to.
+        operation (str): The name of the mutation, see database.WRITE_OPERATIONS.
+        *args: The arguments of the mutation.
+        timeout (float, optional): The seconds to wait for the answer. Defaults to 10.
+
+    Returns:
+        The result of the mutation.
+
+    Raises:
+        OSError: If the daemon cannot be reached or does not answer in time.
+        RuntimeError: With the error of the mutation.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(json.dumps({"database": os.path.abspath(db_name), "operation": operation, "args": args}).encode() + b"\n")
+        with client.makefile("rb") as answers:
+            answer = answers.readline()
+    if not answer:
+        raise ConnectionError("The daemon closed the connection without an answer")
+    answer = json.loads(answer)
+    if "error" in answer:
+        raise RuntimeError(answer["error"])
+    return answer["result"]
@@ -2,13 +2,23 @@ import pytest
 
 import datetime
 
+import random
+
+import threading
+
+import asyncio
+
+import zoneinfo
+
+import json
+
 from typer.testing import CliRunner
 
 import os
 
 from freezegun import freeze_time
 
-from habittracker import __app_name__, __version__, cli, database, model, analytics
+from habittracker import __app_name__, __version__, cli, database, get, model, analytics, schedules, scheduler, timezones, sync, bitmaps, search, cache, writes
 
 @pytest.fixture
 def runner():
@@ -177,9 +187,9 @@ class TestHabit:
         - The function also tests the max_streak_count method from the database module, which verifies that the habits are correctly updated in the database.
 
         Assertions:
-        - `database.max_streak_count(self.db, "Drinking")` should be 29
-        - `database.max_streak_count(self.db, "Learning")` should be 19
-        - `database.max_streak_count(self.db, "Pushups")` should be 15
+        - `database.max_streak_count(self.db, database.habit_id(self.db, "Drinking"))` should be 29
+        - `database.max_streak_count(self.db, database.habit_id(self.db, "Learning"))` should be 19
+        - `database.max_streak_count(self.db, database.habit_id(self.db, "Pushups"))` should be 15
         """
 
         habit_daily = model.Habit("Drinking")
@@ -190,7 +200,7 @@ class TestHabit:
             cli.update(db_name="testha.db", today= current_date_formatted)
             habit_daily.update_streak(db_name="testha.db", current_date= current_date_formatted)
             current_date += datetime.timedelta(days=1)
-        assert database.max_streak_count(self.db, "Drinking") == 29
+        assert database.max_streak_count(self.db, database.habit_id(self.db, "Drinking")) == 29
 
         habit_daily = model.Habit("Learning")
         end_date = datetime.datetime.strptime("23 Dec 2022", "%d %b %Y")
@@ -200,7 +210,7 @@ class TestHabit:
             cli.update(db_name="testha.db", today= current_date_formatted)
             habit_daily.update_streak(db_name="testha.db", current_date= current_date_formatted)
             current_date += datetime.timedelta(days=1)
-        assert database.max_streak_count(self.db, "Learning") == 19
+        assert database.max_streak_count(self.db, database.habit_id(self.db, "Learning")) == 19
 
         habit_daily = model.Habit("Pushups")
         end_date = datetime.datetime.strptime("19 Dec 2022", "%d %b %Y")
@@ -210,7 +220,7 @@ class TestHabit:
             cli.update(db_name="testha.db", today= current_date_formatted)
             habit_daily.update_streak(db_name="testha.db", current_date= current_date_formatted)
             current_date += datetime.timedelta(days=1)
-        assert database.max_streak_count(self.db, "Pushups") == 15
+        assert database.max_streak_count(self.db, database.habit_id(self.db, "Pushups")) == 15
 
     @freeze_time("2022-12-20")
     def test_break_habit_pushups(self):
@@ -222,12 +232,12 @@ class TestHabit:
         - The function also tests the max_streak_count method from the database module, which verifies that the habits are correctly updated in the database.
 
         Assertions:
-        - `database.streak_count(self.db, "Pushups")` should be 0
-        - `database.max_streak_count(self.db, "Pushups")` should be 15
+        - `database.streak_count(self.db, database.habit_id(self.db, "Pushups"))` should be 0
+        - `database.max_streak_count(self.db, database.habit_id(self.db, "Pushups"))` should be 15
         """
 
         cli.update(db_name="testha.db", today= "20 Dec 2022")
-        assert database.streak_count(self.db, "Pushups") == 0
+        assert database.streak_count(self.db, database.habit_id(self.db, "Pushups")) == 0
 
         habit_daily = model.Habit("Pushups")
         end_date = datetime.datetime.strptime("02 Jan 2023", "%d %b %Y")
@@ -237,7 +247,7 @@ class TestHabit:
             cli.update(db_name="testha.db", today= current_date_formatted)
             habit_daily.update_streak(db_name="testha.db", current_date= current_date_formatted)
             current_date += datetime.timedelta(days=1)
-        assert database.max_streak_count(self.db, "Pushups") == 15     
+        assert database.max_streak_count(self.db, database.habit_id(self.db, "Pushups")) == 15     
 
     @freeze_time("2022-12-24")
     def test_break_habit_learning(self):
@@ -249,12 +259,12 @@ class TestHabit:
         - The function also tests the max_streak_count method from the database module, which verifies that the habits are correctly updated in the database.
         
         Assertions:
-        - `database.streak_count(self.db, "Learning")` should be 0
-        - `database.max_streak_count(self.db, "Learning")` should be 19
+        - `database.streak_count(self.db, database.habit_id(self.db, "Learning"))` should be 0
+        - `database.max_streak_count(self.db, database.habit_id(self.db, "Learning"))` should be 19
         """
 
         cli.update(db_name="testha.db", today= "20 Dec 2022")
-        assert database.streak_count(self.db, "Learning") == 0
+        assert database.streak_count(self.db, database.habit_id(self.db, "Learning")) == 0
 
         habit_daily = model.Habit("Learning")
         end_date = datetime.datetime.strptime("02 Jan 2023", "%d %b %Y")
@@ -264,7 +274,7 @@ class TestHabit:
             cli.update(db_name="testha.db", today= current_date_formatted)
             habit_daily.update_streak(db_name="testha.db", current_date= current_date_formatted)
             current_date += datetime.timedelta(days=1)
-        assert database.max_streak_count(self.db, "Learning") == 19
+        assert database.max_streak_count(self.db, database.habit_id(self.db, "Learning")) == 19
     
     @freeze_time("2022-12-08")
     def test_habit_weekly_update(self):
@@ -288,12 +298,12 @@ class TestHabit:
         current_date_formatted = current_date.strftime("%d %b %Y")
         habit_weekly = model.Habit("Running")
         habit_weekly.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Running")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Running"))
         assert habit_weekly.completed == 2
 
         habit_weekly_second = model.Habit("Workout")
         habit_weekly_second.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Workout")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Workout"))
         assert habit_weekly_second.completed == 2
 
     @freeze_time("2022-12-11")
@@ -328,7 +338,7 @@ class TestHabit:
         current_date_formatted = current_date.strftime("%d %b %Y")
         habit_weekly = model.Habit("Running")
         habit_weekly.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Running")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Running"))
         assert habit_weekly.completed == 2
 
     @freeze_time("2022-12-18")
@@ -361,9 +371,9 @@ class TestHabit:
         current_date_formatted = current_date.strftime("%d %b %Y")
         habit_weekly = model.Habit("Running")
         habit_weekly.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Running")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Running"))
         assert habit_weekly.completed == 2
-        assert database.streak_count(self.db, "Running") == 3
+        assert database.streak_count(self.db, database.habit_id(self.db, "Running")) == 3
 
     @freeze_time("2022-12-24")
     def test_workout_checkoff_after_break(self):
@@ -382,7 +392,7 @@ class TestHabit:
         current_date_formatted = current_date.strftime("%d %b %Y")
         second_habit_weekly = model.Habit("Workout")
         second_habit_weekly.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Workout")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Workout"))
         assert second_habit_weekly.completed == 2
 
     @freeze_time("2022-12-25")
@@ -393,16 +403,16 @@ class TestHabit:
         "2022-12-25" and uses the update() method of the cli class to update the habits.
 
         Assertions:
-        - `database.streak_count(self.db, "Drinking")` should be 29
-        - `database.streak_count(self.db, "Learning")` should be 19
-        - `database.streak_count(self.db, "Pushups")` should be 15
+        - `database.streak_count(self.db, database.habit_id(self.db, "Drinking"))` should be 29
+        - `database.streak_count(self.db, database.habit_id(self.db, "Learning"))` should be 19
+        - `database.streak_count(self.db, database.habit_id(self.db, "Pushups"))` should be 15
         """
 
         current_date = datetime.datetime.now().date()
         current_date_formatted = current_date.strftime("%d %b %Y")
         cli.update(db_name="testha.db", today= current_date_formatted)
-        assert database.streak_count(self.db, "Running") == 3
-        assert database.streak_count(self.db, "Workout") == 2
+        assert database.streak_count(self.db, database.habit_id(self.db, "Running")) == 3
+        assert database.streak_count(self.db, database.habit_id(self.db, "Workout")) == 2
 
     @freeze_time("2022-12-30")
     def test_last_checkoff_weekly(self):
@@ -422,12 +432,12 @@ class TestHabit:
         current_date_formatted = current_date.strftime("%d %b %Y")
         habit_weekly = model.Habit("Running")
         habit_weekly.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Running")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Running"))
         assert habit_weekly.completed == 2
 
         habit_weekly_second = model.Habit("Workout")
         habit_weekly_second.update_streak(db_name="testha.db", current_date= current_date_formatted)
-        database.habit_completed_check(self.db, "Workout")
+        database.habit_completed_check(self.db, database.habit_id(self.db, "Workout"))
         assert habit_weekly_second.completed == 2
 
     @freeze_time("2023-01-01")
@@ -495,3 +505,1385 @@ class TestHabit:
 
         
         
+class TestHabitStats:
+    @freeze_time("2023-02-02")
+    def test_stats_maintained_on_write(self, tmp_path):
+        """
+        Test that the materialized statistics follow check-offs, resets and deletions without a rebuild.
+
+        Assertions:
+        - The statistics of 'Reading' show 2 check-offs, 1 broken streak and a max. streak of 2
+        - The 'Daily' aggregate counts 1 habit once 'Cycling' is deleted
+        - `database.habit_stats_drift` finds no drift
+        """
+        db_name = str(tmp_path / "stats.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily").add_habit(db_name)
+        model.Habit("Cycling", "Cycle to work", "Daily").add_habit(db_name)
+        reading = model.Habit("Reading")
+        reading.update_streak(db_name, current_date="01 Feb 2023")
+        reading.update_streak(db_name, current_date="02 Feb 2023")
+        reading.reset_streak(db_name)
+        model.Habit("Cycling").update_streak(db_name, current_date="02 Feb 2023")
+        model.Habit("Cycling").delete_habit(db_name)
+
+        stats = analytics.habit_stats(db, "Reading")
+        assert stats.completions == 2
+        assert stats.resets == 1
+        assert stats.streak == 0
+        assert stats.max_streak == 2
+        assert stats.last_completed == "02 Feb 2023"
+        assert analytics.habit_stats(db, "Cycling") is None
+        [daily] = analytics.periodicity_stats(db)
+        assert (daily.periodicity, daily.habits, daily.completions, daily.resets) == ("Daily", 1, 2, 1)
+        assert database.habit_stats_drift(db) == []
+
+    def test_verify_stats_detects_and_repairs_drift(self, runner, tmp_path, monkeypatch):
+        """
+        Test that the `verify-stats` command reports drift and rebuilds the statistics with `--repair`.
+
+        Assertions:
+        - The command exits with code 1 while the statistics are stale
+        - After `--repair` the statistics match a recomputation from scratch
+        """
+        monkeypatch.chdir(tmp_path)
+        db = database.connect_db()
+        model.Habit("Reading", "Read 20 pages", "Daily").add_habit(db_name="habit.db")
+        db.execute("UPDATE habit_stats SET completions = 7 WHERE habit_id = (SELECT id FROM habitbase WHERE habit = 'Reading')")
+        db.commit()
+
+        result = runner.invoke(cli.app, ["verify-stats"])
+        assert result.exit_code == 1
+        assert "Reading" in result.stdout
+
+        result = runner.invoke(cli.app, ["verify-stats", "--repair"])
+        assert result.exit_code == 0
+        assert database.habit_stats_drift(db) == []
+        assert analytics.habit_stats(db, "Reading").completions == 0
+
+
+class TestLeaderboard:
+    @freeze_time("2023-02-01")
+    def test_leaderboard_rankings(self, tmp_path):
+        """
+        Test the leaderboard rankings, the periodicity filter and the pagination.
+
+        Assertions:
+        - The habits are ranked by max. streak with ties broken by id, without sorting outside of the index
+        - The periodicity filter only ranks 'Weekly' habits
+        - The second page continues the ranking
+        - The completion rate ranks 'Cycling' (1 of 1 week) before 'Reading' (3 of 4 days)
+        """
+        db_name = str(tmp_path / "leaderboard.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Feb 2023").add_habit(db_name)
+        model.Habit("Stretching", "Stretch 10 minutes", "Daily", starting_date="01 Feb 2023").add_habit(db_name)
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="01 Feb 2023").add_habit(db_name)
+        for day in ["01 Feb 2023", "02 Feb 2023", "03 Feb 2023"]:
+            model.Habit("Reading").update_streak(db_name, current_date=day)
+        model.Habit("Stretching").update_streak(db_name, current_date="01 Feb 2023")
+        model.Habit("Cycling").update_streak(db_name, current_date="01 Feb 2023")
+
+        assert [s.habit for s in analytics.leaderboard(db)] == ["Reading", "Stretching", "Cycling"]
+        for by in ("max_streak", "streak"):
+            plan = db.execute(f"EXPLAIN QUERY PLAN SELECT {analytics.STATS_COLUMNS} FROM {analytics.STATS_FROM} ORDER BY {analytics.LEADERBOARD_ORDER[by]} LIMIT 10").fetchall()
+            assert not [row for row in plan if "TEMP B-TREE" in row[3]]
+        assert [s.habit for s in analytics.leaderboard(db, periodicity="Weekly")] == ["Cycling"]
+        assert [s.habit for s in analytics.leaderboard(db, k=2, offset=2)] == ["Cycling"]
+        ranked = analytics.leaderboard(db, by="completion_rate", today=datetime.date(2023, 2, 4))
+        assert [s.habit for s in ranked] == ["Cycling", "Reading", "Stretching"]
+        assert ranked[1].completion_rate == 0.75
+        with pytest.raises(ValueError):
+            analytics.leaderboard(db, by="description")
+
+
+class TestConsistency:
+    @freeze_time("2023-02-10")
+    def test_window_report(self, tmp_path):
+        """
+        Test the completion rate, misses, gaps and rolling consistency over a date window.
+
+        'Reading' is checked off on 01, 02, 03, 07 and 10 Feb 2023, 'Cycling' in the first of its two weeks.
+
+        Assertions:
+        - 'Reading' completes 5 of 10 days with an average gap of 2.25 days and a longest gap of 3 days
+        - The window 04 - 06 Feb 2023 holds only misses
+        - 'Cycling' completes 1 of 2 weeks and the aggregate counts 6 of 12 periods
+        """
+        db_name = str(tmp_path / "consistency.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Feb 2023").add_habit(db_name)
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="01 Feb 2023").add_habit(db_name)
+        for day in ["01 Feb 2023", "02 Feb 2023", "03 Feb 2023", "07 Feb 2023", "10 Feb 2023"]:
+            model.Habit("Reading").update_streak(db_name, current_date=day)
+        model.Habit("Cycling").update_streak(db_name, current_date="05 Feb 2023")
+
+        index = analytics.CompletionIndex(db)
+        reading = index.habit_window("Reading", datetime.date(2023, 2, 1), datetime.date(2023, 2, 10))
+        assert (reading.periods, reading.completed, reading.misses) == (10, 5, 5)
+        assert reading.average_gap == 2.25
+        assert reading.longest_gap == 3
+        assert reading.rolling[7] == 2 / 7
+        gap = index.habit_window("Reading", datetime.date(2023, 2, 4), datetime.date(2023, 2, 6))
+        assert (gap.completed, gap.misses, gap.longest_gap) == (0, 3, 3)
+
+        cycling, reading, total = index.window_report(datetime.date(2023, 2, 1), datetime.date(2023, 2, 28))
+        assert (cycling.periods, cycling.completed) == (2, 1)
+        assert total.habit is None
+        assert (total.periods, total.completed) == (12, 6)
+
+
+class TestHeatmap:
+    @freeze_time("2023-02-10")
+    def test_completion_calendar_bitmaps(self, tmp_path):
+        """
+        Test that check-offs are cached as monthly bitmaps and counted per day for the heatmap.
+
+        Assertions:
+        - The January bitmap of 'Reading' has the bits of the 1st and the 31st set
+        - The aggregated calendar counts both habits on 01 Feb 2023
+        - The rendered heatmap reports 4 check-offs in 2023
+        """
+        db_name = str(tmp_path / "heatmap.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily").add_habit(db_name)
+        model.Habit("Cycling", "Cycle to work", "Weekly").add_habit(db_name)
+        for day in ["01 Jan 2023", "31 Jan 2023", "01 Feb 2023"]:
+            model.Habit("Reading").update_streak(db_name, current_date=day)
+        model.Habit("Cycling").update_streak(db_name, current_date="01 Feb 2023")
+
+        bits = db.execute("SELECT bits FROM habit_calendar WHERE habit_id = ? AND month = ?", (database.habit_id(db, 'Reading'), 2023 * 12)).fetchone()[0]
+        assert bits == (1 << 0) | (1 << 30)
+        counts = analytics.completion_calendar(db, 2023)
+        assert counts[datetime.date(2023, 2, 1)] == 2
+        assert analytics.completion_calendar(db, 2023, habit="Cycling") == {datetime.date(2023, 2, 1): 1}
+        assert "4 check-offs" in cli.render_heatmap(counts, 2023, "All habits").plain
+
+
+class TestSchedules:
+    def test_schedule_windows_and_status(self):
+        """
+        Test that periodicity labels are parsed into schedules with the right windows, deadlines and rollover status.
+
+        Assertions:
+        - Labels are parsed case-insensitively and unknown labels raise a ValueError
+        - 'Every 3 Days' windows are counted from the anchor, 'On Mon, Thu' windows run from one due weekday to the next
+        - A daily habit moves on to a new period the day after its check-off and breaks one day later
+        - The next deadline of a monthly habit is the end of the following month
+        """
+        assert schedules.parse("every 3 days") == schedules.EveryNDays(3)
+        assert schedules.parse("On Mon, Thu").label == "On Mon, Thu"
+        with pytest.raises(ValueError):
+            schedules.parse("Fortnightly")
+
+        day = datetime.date(2023, 1, 2).toordinal()
+        every_three = schedules.parse("Every 3 Days")
+        assert every_three.window(day + 4, day) == (day + 3, day + 5)
+        weekdays = schedules.parse("On Mon, Thu")
+        assert weekdays.window(day + 1, None) == (day, day + 2)
+        assert weekdays.window(day + 5, None) == (day + 3, day + 6)
+        assert weekdays.period_index(day + 7, None) == weekdays.period_index(day + 3, None) + 1
+
+        daily = schedules.parse("Daily")
+        assert daily.status(day, day, None, day) == (schedules.CHECKED_OFF, day)
+        assert daily.status(day, day + 1, None, day) == (schedules.NEW_PERIOD, day + 1)
+        assert daily.status(day, day + 2, None, day) == (schedules.BROKEN, day + 2)
+        monthly = schedules.parse("Monthly")
+        assert monthly.next_deadline(day, None) == datetime.date(2023, 2, 28).toordinal()
+
+    def test_times_per_week_partial_checkoffs(self, tmp_path):
+        """
+        Test that a habit with several check-offs per week only completes with the last one.
+
+        Assertions:
+        - After two of three check-offs the habit is still uncompleted without a streak
+        - The third check-off completes the habit with a streak of 1
+        - The expected check-offs count every started week
+        """
+        db_name = str(tmp_path / "schedules.db")
+        db = database.connect_db(db_name)
+        model.Habit("Swimming", "Swim 1 km", "3 Times Per Week", starting_date="02 Jan 2023").add_habit(db_name)
+        for day in ["02 Jan 2023", "04 Jan 2023"]:
+            model.Habit("Swimming").update_streak(db_name, current_date=day)
+        assert db.execute("SELECT completed, streak FROM habitbase WHERE habit = 'Swimming'").fetchone() == (1, 0)
+        model.Habit("Swimming").update_streak(db_name, current_date="06 Jan 2023")
+        assert db.execute("SELECT completed, streak FROM habitbase WHERE habit = 'Swimming'").fetchone() == (2, 1)
+        started = datetime.date(2023, 1, 2).toordinal()
+        assert schedules.expected_checkoffs("3 Times Per Week", started, started + 13) == 6
+
+    def test_incomplete_schedule_type_is_rejected(self):
+        """
+        Test that a schedule type without a window cannot be created.
+
+        Assertions:
+        - Creating a schedule that only implements its label raises a TypeError
+        """
+        class Yearly(schedules.Schedule):
+            label = "Yearly"
+
+            def period_index(self, day, anchor):
+                return datetime.date.fromordinal(day).year
+
+        with pytest.raises(TypeError):
+            Yearly()
+
+    def test_every_n_days_rollover(self, tmp_path):
+        """
+        Test the rollover of a habit that is due every three days.
+
+        Assertions:
+        - Inside its first window the checked-off habit is not due for the rollover
+        - In the next window the habit moves on to a new period and its window start moves with it
+        - Skipping a whole window breaks the streak and reports the skipped window as missed
+        """
+        db_name = str(tmp_path / "schedules.db")
+        model.Habit("Watering", "Water the plants", "Every 3 Days", starting_date="02 Jan 2023").add_habit(db_name)
+        model.Habit("Watering").update_streak(db_name, current_date="03 Jan 2023")
+        assert cli.update_check(db_name, "04 Jan 2023") == []
+        new_start = datetime.date(2023, 1, 5).toordinal()
+        assert cli.update_check(db_name, "06 Jan 2023") == [(schedules.NEW_PERIOD, "Watering", new_start, [])]
+        assert cli.update_check(db_name, "09 Jan 2023")[0] == (schedules.BROKEN, "Watering", new_start + 3, [new_start])
+
+
+class TestDeadlines:
+    def test_deadline_index(self, tmp_path):
+        """
+        Test that the deadline index follows check-offs and rollovers, and that the rollover only reads due habits.
+
+        Assertions:
+        - A daily habit checked off on 02 Jan 2023 is due after that day, an unchecked daily habit has no deadline
+        - A weekly habit is due at the end of its first window
+        - On 04 Jan 2023 only the daily habit is due, and after its rollover on 03 Jan 2023 it is not due on that day anymore
+        """
+        db_name = str(tmp_path / "deadlines.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Flossing", "Floss teeth", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Reading").update_streak(db_name, current_date="02 Jan 2023")
+        day = datetime.date(2023, 1, 2).toordinal()
+        assert database.habit_deadlines(db) == [(day, "Reading"), (day + 5, "Cycling")]
+
+        assert [habit.habit for habit in database.due_habits(db, day + 2)] == ["Reading"]
+        with freeze_time("2023-01-03"):
+            cli.update_check_results(db_name)
+        assert database.habit_deadlines(db)[0] == (day + 1, "Reading")
+        assert database.due_habits(db, day + 1) == []
+
+    def test_rebuild_of_deadlines_is_silent(self, tmp_path):
+        """
+        Test that rebuilding the deadline index of a database with habits only touches the index.
+
+        Assertions:
+        - The rebuild runs without errors and restores the deadlines
+        - It writes nothing to the change feed, as no habit changed
+        """
+        db_name = str(tmp_path / "rebuild.db")
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Reading").update_streak(db_name, current_date="02 Jan 2023")
+        db = database.connect_db(db_name)
+        deadlines, latest = database.habit_deadlines(db), database.latest_change(db)
+        database.rebuild_habit_deadlines(db)
+        assert database.habit_deadlines(db) == deadlines
+        assert database.latest_change(db) == latest
+
+    def test_deadline_queue(self):
+        """
+        Test the in-memory deadline queue.
+
+        Assertions:
+        - Due habits are popped in deadline order and the others stay queued
+        - A moved deadline replaces the old one and a deadline of None removes the habit
+        """
+        queue = schedules.DeadlineQueue([(5, "Reading"), (3, "Cycling"), (9, "Running")])
+        assert queue.peek() == 3
+        queue.push("Running", 4)
+        queue.push("Cycling", None)
+        assert queue.pop_due(6) == ["Running", "Reading"]
+        assert len(queue) == 0 and queue.peek() is None
+
+
+def starts_period(schedule, day, anchor):
+    """Tell whether a period of the schedule starts on a day, from the definition of the schedule types alone."""
+    date = datetime.date.fromordinal(day)
+    if isinstance(schedule, schedules.EveryNDays):
+        return (day - anchor) % schedule.n == 0
+    if isinstance(schedule, schedules.Weekdays):
+        return date.weekday() in schedule.weekdays
+    if isinstance(schedule, schedules.Monthly):
+        return date.day == 1
+    if isinstance(schedule, schedules.TimesPerWeek):
+        return date.weekday() == 0
+    return True
+
+def simulate_rollover(schedule, anchor, checkoffs, last_day, today):
+    """
+    Replay a habit day by day to find its rollover status and missed periods after an absence.
+
+    The habit starts on the anchor, is checked off on the given days until last_day and left alone until today.
+
+    Returns:
+        tuple: The status, the first days of the missed periods, the last completing check-off and the window start
+        an anchored habit has stored on last_day.
+    """
+    begin = anchor
+    while not starts_period(schedule, begin, anchor):
+        begin -= 1
+    periods = []
+    for day in range(begin, today + 1):
+        if starts_period(schedule, day, anchor):
+            periods.append([day, []])
+        if day in checkoffs:
+            periods[-1][1].append(day)
+    period_of = {day: i for i, (start, days) in enumerate(periods) for day in range(start, (periods[i + 1][0] if i + 1 < len(periods) else today + 1))}
+    completed = [days[schedule.target - 1] for start, days in periods if len(days) >= schedule.target]
+    last_completion = completed[-1] if completed else None
+    current = len(periods) - 1
+    if schedule.anchored:
+        open_window = period_of[last_day]
+    elif last_completion is None:
+        return schedules.NOT_CHECKED_OFF, [], None, None
+    else:
+        open_window = period_of[last_completion]
+    open_done = last_completion is not None and last_completion >= periods[open_window][0]
+    missed = [periods[i][0] for i in range(open_window + 1 if open_done else open_window, current)]
+    if current == open_window:
+        status = schedules.CHECKED_OFF if open_done else schedules.NOT_CHECKED_OFF
+    elif last_completion is None:
+        status = schedules.NOT_CHECKED_OFF
+    elif open_done and current == open_window + 1:
+        status = schedules.NEW_PERIOD
+    else:
+        status = schedules.BROKEN
+    return status, missed, last_completion, periods[open_window][0]
+
+
+class TestCatchUp:
+    def test_catch_up_matches_day_by_day_simulation(self):
+        """
+        Test the closed-form catch-up against a day-by-day replay over randomized histories and absences of up to a year.
+
+        Assertions:
+        - For every schedule type the status and the missed periods after the absence match the replay
+        """
+        rng = random.Random(20230101)
+        first_day = datetime.date(2022, 11, 1).toordinal()
+        for label in ["Daily", "Weekly", "Every 3 Days", "On Mon, Thu", "Monthly", "2 Times Per Week"]:
+            schedule = schedules.parse(label)
+            for _ in range(60):
+                anchor = first_day + rng.randrange(60)
+                last_day = anchor + rng.randrange(60)
+                today = last_day + rng.randrange(400)
+                density = rng.random()
+                checkoffs = {day for day in range(anchor, last_day + 1) if rng.random() < density}
+                status, missed, last_completion, window_start = simulate_rollover(schedule, anchor, checkoffs, last_day, today)
+                assert schedule.status(last_completion, today, window_start, anchor)[0] == status, (label, anchor, last_day, today)
+                assert schedule.missed_periods(last_completion, today, window_start, anchor) == missed, (label, anchor, last_day, today)
+
+    def test_rollover_records_missed_periods(self, tmp_path):
+        """
+        Test that one rollover after a long absence catches a weekly habit up and records every missed week.
+
+        Assertions:
+        - After eleven weeks away the window of the habit jumps to the current week in one rollover
+        - The ten weeks between are recorded as missed in the habit history and the streak is reset
+        """
+        db_name = str(tmp_path / "catchup.db")
+        db = database.connect_db(db_name)
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="02 Jan 2023").add_habit(db_name)
+        model.Habit("Cycling").update_streak(db_name, current_date="03 Jan 2023")
+        with freeze_time("2023-03-20"):
+            cli.update_check_results(db_name)
+        assert db.execute("SELECT startdate_weekly, streak FROM habitbase").fetchone() == ("20 Mar 2023", 0)
+        missed = [row[0] for row in db.execute("SELECT day FROM habit_history WHERE event = 'missed' ORDER BY day")]
+        start = datetime.date(2023, 1, 9).toordinal()
+        assert missed == list(range(start, start + 70, 7))
+
+
+
+class TestScheduler:
+    def test_run_once_rolls_over_and_reminds(self, tmp_path):
+        """
+        Test one scheduler run over two tenants in two shards.
+
+        Assertions:
+        - The daily habit checked off two days ago is reset and the weekly habit checked off last week is reminded of
+        - A second run on the same day does not roll over again
+        - The next run is scheduled for the configured time of day
+        """
+        tenants = [str(tmp_path / "anna.db"), str(tmp_path / "ben.db")]
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(tenants[0])
+        model.Habit("Reading").update_streak(tenants[0], current_date="02 Jan 2023")
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="26 Dec 2022").add_habit(tenants[1])
+        model.Habit("Cycling").update_streak(tenants[1], current_date="28 Dec 2022")
+
+        rollovers = []
+        def rollover(tenant, today):
+            rollovers.append(tenant)
+            cli.update_check_results(tenant, today)
+        clock = lambda: datetime.datetime(2023, 1, 4, 22, 30)
+        jobs = scheduler.Scheduler(tenants, rollover, shards=2, remind_before=5, run_at=datetime.time(23, 0), clock=clock)
+        with freeze_time("2023-01-04"):
+            reminders = asyncio.run(jobs.run_once())
+            assert repr(asyncio.run(jobs.run_once())) == repr(reminders)
+        assert sorted(rollovers) == sorted(tenants)
+        assert database.connect_db(tenants[0]).execute("SELECT streak FROM habitbase").fetchone() == (0,)
+        assert [(reminder.habit, reminder.deadline, reminder.tenant) for reminder in reminders] == [("Cycling", "08 Jan 2023", tenants[1])]
+        assert jobs.seconds_until_next_run() == 30 * 60
+
+
+class TestTimezones:
+    def test_offset_transitions(self):
+        """
+        Test the precomputed UTC offset transitions against zoneinfo.
+
+        Assertions:
+        - Berlin switches to summer time at 01:00 UTC on 26 Mar 2023 and back at 01:00 UTC on 29 Oct 2023
+        - The local day numbers of random timestamps in several zones match zoneinfo
+        """
+        berlin = timezones.zone("Europe/Berlin")
+        starts, offsets = berlin.transitions(2023)
+        assert starts[1:] == [int(datetime.datetime(2023, 3, 26, 1, tzinfo=datetime.timezone.utc).timestamp()),
+            int(datetime.datetime(2023, 10, 29, 1, tzinfo=datetime.timezone.utc).timestamp())]
+        assert offsets == [3600, 7200, 3600]
+        with pytest.raises(ValueError):
+            timezones.zone("Mars/Olympus_Mons")
+
+        rng = random.Random(34)
+        for name in ["Europe/Berlin", "America/New_York", "Australia/Lord_Howe", "Pacific/Kiritimati", "Asia/Kolkata"]:
+            zone = zoneinfo.ZoneInfo(name)
+            for _ in range(200):
+                timestamp = rng.randrange(946684800, 2524608000)
+                assert timezones.zone(name).day_number(timestamp) == datetime.datetime.fromtimestamp(timestamp, zone).date().toordinal()
+
+    @freeze_time("2023-01-03 12:00:00")
+    def test_rollover_in_habit_time_zone(self, tmp_path):
+        """
+        Test that the rollover counts days in the time zone of the user and of single habits.
+
+        At 12:00 UTC on 03 Jan 2023 it is already 04 Jan 2023 in Kiritimati (UTC+14) but still 03 Jan 2023 at UTC-12.
+
+        Assertions:
+        - The habit of the user at UTC-12 moves on to a new period, while the habit in Kiritimati breaks
+        """
+        db_name = str(tmp_path / "timezones.db")
+        db = database.connect_db(db_name)
+        for habit in ["Reading", "Surfing"]:
+            model.Habit(habit, "Every day", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+            model.Habit(habit).update_streak(db_name, current_date="02 Jan 2023")
+        database.set_setting(db, "timezone", "Etc/GMT+12")
+        database.set_setting(db, "timezone:Surfing", "Pacific/Kiritimati")
+        assert database.local_today(db, "Surfing") == datetime.date(2023, 1, 4)
+        results = {habit: status for status, habit, *_ in cli.update_check(db_name)}
+        assert results == {"Reading": schedules.NEW_PERIOD, "Surfing": schedules.BROKEN}
+
+    def test_habit_time_zone_follows_the_stored_name(self, runner, tmp_path, monkeypatch):
+        """
+        Test that the time zone of a habit given in another case is stored under the name of the habit.
+
+        Assertions:
+        - The time zone set for 'surfing' applies to the habit 'Surfing'
+        - The setting follows a rename and is removed with the habit
+        """
+        monkeypatch.chdir(tmp_path)
+        db = database.connect_db()
+        model.Habit("Surfing", "Every day", "Daily", starting_date="01 Jan 2023").add_habit("habit.db")
+        result = runner.invoke(cli.app, ["timezone", "Pacific/Kiritimati", "--habit", "surfing"])
+        assert result.exit_code == 0
+        assert database.timezone_of(db, "Surfing") == "Pacific/Kiritimati"
+
+        database.rename_habit(db, "Surfing", "Kitesurfing")
+        assert database.timezone_settings(db) == (None, {"Kitesurfing": "Pacific/Kiritimati"})
+        database.delete_habit(db, "Kitesurfing")
+        assert database.timezone_settings(db) == (None, {})
+
+
+class TestChanges:
+    def test_change_feed(self, runner, tmp_path, monkeypatch):
+        """
+        Test that every mutation of a habit is written to the outbox and can be read after a cursor.
+
+        Assertions:
+        - Adding, checking off, breaking and deleting a habit are recorded in this order
+        - Reading in batches of two returns the same changes as one read
+        - The 'changes' command prints the changes after the cursor as JSON lines
+        """
+        monkeypatch.chdir(tmp_path)
+        db = database.connect_db()
+        with freeze_time("2023-01-05"):
+            model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit("habit.db")
+            model.Habit("Reading").update_streak("habit.db", current_date="02 Jan 2023")
+            cli.update_check_results("habit.db")
+            model.Habit("Reading").delete_habit("habit.db")
+
+        changes = database.changes_since(db)
+        assert [(change.event, change.date) for change in changes] == [("added", "01 Jan 2023"), ("checked_off", "02 Jan 2023"),
+            ("missed", "03 Jan 2023"), ("missed", "04 Jan 2023"), ("reset", "05 Jan 2023"), ("deleted", "05 Jan 2023")]
+        assert changes[0].payload == {"description": "Read 20 pages", "periodicity": "Daily"}
+        assert repr(list(database.stream_changes(db, 0, batch_size=2))) == repr(changes)
+
+        result = runner.invoke(cli.app, ["changes", "--since", str(changes[3].seq)])
+        assert result.exit_code == 0
+        lines = [json.loads(line) for line in result.stdout.splitlines()]
+        assert [line["event"] for line in lines] == ["reset", "deleted"]
+        assert lines[0]["seq"] == changes[4].seq
+
+
+class TestSync:
+    def test_two_replicas_converge(self, tmp_path):
+        """
+        Test the delta exchange between two replicas with concurrent check-offs and a delete.
+
+        Assertions:
+        - The second replica gets the habit of the first one with the streak derived from its check-offs
+        - The answer to the first replica only holds the changes it has not seen
+        - Concurrent check-offs on both replicas merge into the same history and streak on both sides
+        - Deleting the habit on one replica deletes it on the other one
+        """
+        anna, ben = database.connect_db(str(tmp_path / "anna.db")), database.connect_db(str(tmp_path / "ben.db"))
+        delta = str(tmp_path / "delta.json")
+        with freeze_time("2023-01-02"):
+            model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(str(tmp_path / "anna.db"))
+            for day in ["01 Jan 2023", "02 Jan 2023"]:
+                model.Habit("Reading").update_streak(str(tmp_path / "anna.db"), current_date=day)
+            assert sync.export_delta(anna, delta) == 3
+            assert sync.import_delta(ben, delta) == ["Reading"]
+        assert ben.execute("SELECT streak, max_streak, datetime_completed FROM habitbase").fetchone() == (2, 2, "02 Jan 2023")
+
+        with freeze_time("2023-01-04"):
+            model.Habit("Reading").update_streak(str(tmp_path / "ben.db"), current_date="03 Jan 2023")
+            model.Habit("Reading").update_streak(str(tmp_path / "ben.db"), current_date="04 Jan 2023")
+            model.Habit("Reading").update_streak(str(tmp_path / "anna.db"), current_date="04 Jan 2023")
+            assert sync.export_delta(ben, delta, peer=sync.replica_id(anna)) == 2
+            sync.import_delta(anna, delta)
+            sync.export_delta(anna, delta, peer=sync.replica_id(ben))
+            sync.import_delta(ben, delta)
+        for replica in (anna, ben):
+            assert replica.execute("SELECT streak, max_streak FROM habitbase").fetchone() == (4, 4)
+            assert database.completed_days(replica, "Reading") == {datetime.date(2023, 1, day).toordinal() for day in range(1, 5)}
+
+        with freeze_time("2023-01-05"):
+            model.Habit("Reading").delete_habit(str(tmp_path / "anna.db"))
+            sync.export_delta(anna, delta, peer=sync.replica_id(ben))
+            sync.import_delta(ben, delta)
+        assert database.all_habits(ben) == []
+
+    def test_rename_is_replicated(self, tmp_path):
+        """
+        Test that a habit renamed and checked off on one replica is renamed and checked off on the other one.
+
+        Assertions:
+        - The other replica only has the habit under its new name, with the check-offs from before and after the rename
+        - The streak is derived from all of them
+        """
+        anna, ben = database.connect_db(str(tmp_path / "anna.db")), database.connect_db(str(tmp_path / "ben.db"))
+        delta = str(tmp_path / "delta.json")
+        with freeze_time("2023-01-02"):
+            model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(str(tmp_path / "anna.db"))
+            model.Habit("Reading").update_streak(str(tmp_path / "anna.db"), current_date="02 Jan 2023")
+            sync.export_delta(anna, delta)
+            sync.import_delta(ben, delta)
+
+        with freeze_time("2023-01-03"):
+            reading = model.Habit("Reading")
+            reading.rename(str(tmp_path / "anna.db"), "Reading Books")
+            reading.update_streak(str(tmp_path / "anna.db"), current_date="03 Jan 2023")
+            sync.export_delta(anna, delta, peer=sync.replica_id(ben))
+            sync.import_delta(ben, delta)
+        assert [habit.habit for habit in database.all_habits(ben)] == ["Reading Books"]
+        assert database.completed_days(ben, "Reading Books") == {datetime.date(2023, 1, day).toordinal() for day in (2, 3)}
+        assert ben.execute("SELECT streak, max_streak FROM habitbase").fetchone() == (2, 2)
+
+
+class TestArchive:
+    @freeze_time("2023-03-01")
+    def test_compaction_is_transparent(self, tmp_path):
+        """
+        Test that archiving old check-offs keeps every reader of the history unchanged.
+
+        Assertions:
+        - Day numbers survive the compressed encoding, including repeated days and large gaps
+        - Check-offs before the horizon leave the hot history and end up in one segment
+        - The history, the statistics check, the calendar bitmaps and the consistency report read the same data as before
+        """
+        days = [1, 1, 5, 300, 738000, 738001]
+        assert database.decode_days(database.encode_days(days)) == days
+
+        db_name = str(tmp_path / "archive.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        for day in range(1, 60, 2):
+            model.Habit("Reading").update_streak(db_name, current_date=(datetime.date(2023, 1, 1) + datetime.timedelta(days=day)).strftime("%d %b %Y"))
+        before = (database.history_days(db, "Reading"), repr(analytics.CompletionIndex(db).window_report(datetime.date(2023, 1, 1), datetime.date(2023, 3, 1))),
+            analytics.completion_calendar(db, 2023))
+
+        horizon = datetime.date(2023, 2, 1).toordinal()
+        assert database.compact_history(db, horizon) == (1, 15)
+        assert db.execute("SELECT COUNT(*) FROM habit_history WHERE event = 'completed' AND day < ?", (horizon,)).fetchone() == (0,)
+        database.rebuild_habit_calendar(db)
+        after = (database.history_days(db, "Reading"), repr(analytics.CompletionIndex(db).window_report(datetime.date(2023, 1, 1), datetime.date(2023, 3, 1))),
+            analytics.completion_calendar(db, 2023))
+        assert after == before
+        assert database.habit_stats_drift(db) == []
+        since = datetime.date(2023, 1, 20).toordinal()
+        assert database.completions_since(db, "Reading", since) == len([day for day in before[0] if day >= since])
+        assert database.vacuum_incrementally(db) >= 0
+        db.execute("CREATE TABLE filler (data BLOB)")
+        db.executemany("INSERT INTO filler VALUES (?)", [(bytes(4000),)] * 20)
+        db.execute("DROP TABLE filler")
+        db.commit()
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        assert free > 0 and database.vacuum_incrementally(db, 0) == 0
+        assert db.execute("PRAGMA freelist_count").fetchone()[0] == free
+
+
+class TestBitmaps:
+    def test_bitmap_set_operations(self):
+        """
+        Test that the compressed day bitmaps behave like sets of day numbers.
+
+        Assertions:
+        - Arrays, runs and dense bit sets all survive serialization
+        - AND, OR, popcount and the last day match the equivalent set operations, across container boundaries
+        """
+        rng = random.Random(38)
+        sparse = set(rng.sample(range(700000, 800000), 300))
+        runs = set(range(737000, 737400)) | set(range(737500, 737510))
+        dense = set(rng.sample(range(720896, 786432), 40000))
+        for days in (sparse, runs, dense, set()):
+            bitmap = bitmaps.DayBitmap(days)
+            assert bitmaps.DayBitmap.from_bytes(bitmap.to_bytes()) == bitmap
+            assert list(bitmap) == sorted(days)
+        assert len(bitmaps.DayBitmap(runs).to_bytes()) < 2 * len(runs)
+
+        a, b, c = bitmaps.DayBitmap(sparse), bitmaps.DayBitmap(runs), bitmaps.DayBitmap(dense)
+        assert set(bitmaps.intersect([a | b, c])) == (sparse | runs) & dense
+        assert len(bitmaps.union([a, b, c])) == len(sparse | runs | dense)
+        assert (a & bitmaps.DayBitmap.from_range(730000, 760000)).last() == max(day for day in sparse if day <= 760000)
+
+    @freeze_time("2023-03-01")
+    def test_bitmaps_follow_checkoffs(self, tmp_path):
+        """
+        Test that the stored completion bitmaps stay in line with the check-offs and answer overlap queries.
+
+        Assertions:
+        - Every check-off is added to the bitmap of its habit, and a rebuild from the history gives the same bitmaps
+        - The overlap counts the days all and any of the habits were checked off, optionally within a window
+        - Deleting a habit drops its bitmap
+        """
+        db_name = str(tmp_path / "bitmaps.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Running", "Run 5 km", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        for day in range(1, 30):
+            date = (datetime.date(2023, 1, 1) + datetime.timedelta(days=day)).strftime("%d %b %Y")
+            model.Habit("Reading").update_streak(db_name, current_date=date)
+            if day % 3 == 0:
+                model.Habit("Running").update_streak(db_name, current_date=date)
+        stored = database.completion_bitmaps(db)
+        assert list(stored["Reading"]) == database.history_days(db, "Reading")
+        database.rebuild_habit_bitmaps(db)
+        assert database.completion_bitmaps(db) == stored
+
+        stats = analytics.habit_overlap(db)
+        assert (stats.habits, stats.together, stats.any, stats.last_together) == (["Reading", "Running"], 9, 29, "28 Jan 2023")
+        stats = analytics.habit_overlap(db, ["Reading", "Running"], start=datetime.date(2023, 1, 10), end=datetime.date(2023, 1, 20))
+        assert (stats.together, stats.any) == (4, 11)
+
+        database.delete_habit(db, "Running")
+        assert list(database.completion_bitmaps(db)) == ["Reading"]
+
+
+class TestSearch:
+    def test_search_index(self):
+        """
+        Test that the search index finds names by prefix, by a part of the name and despite a typo.
+
+        Assertions:
+        - Names starting with the query come first, ignoring case, followed by names containing it
+        - A misspelled name still finds the habit
+        - Adding and removing a name updates the lookups
+        """
+        index = search.HabitIndex(["Reading", "Running", "Rowing", "Meditation", "Proofreading"])
+        assert index.search("r") == ["Reading", "Rowing", "Running"]
+        assert index.search("read") == ["Reading", "Proofreading"]
+        assert index.search("Medtation")[0] == "Meditation"
+        index.add("Readaloud")
+        index.remove("Reading")
+        assert index.prefix("rea") == ["Readaloud"]
+        assert "Reading" not in index and len(index) == 5
+
+    def test_index_follows_database(self, runner, tmp_path, monkeypatch):
+        """
+        Test that the index of a database follows added and deleted habits, and that the 'find' command uses it.
+
+        Assertions:
+        - The index is built from the habitbase and reused for the same database file
+        - Habits added and deleted afterwards are applied from the change feed
+        - The 'find' command prints the matching habits and fails if there are none
+        """
+        monkeypatch.chdir(tmp_path)
+        db = database.connect_db()
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit("habit.db")
+        index = search.index_of(db)
+        assert index.search("rea") == ["Reading"]
+        model.Habit("Readaloud", "Read to the kids", "Daily", starting_date="01 Jan 2023").add_habit("habit.db")
+        model.Habit("Reading").delete_habit("habit.db")
+        assert search.index_of(db) is index
+        assert index.search("rea") == ["Readaloud"]
+
+        result = runner.invoke(cli.app, ["find", "aloud"])
+        assert result.exit_code == 0 and "Readaloud" in result.stdout
+        assert runner.invoke(cli.app, ["find", "xyz"]).exit_code == 1
+
+
+class TestHabitChoices:
+    def test_choices_follow_database(self, tmp_path):
+        """
+        Test that the cached prompt choices stay sorted and current while other connections change the habits.
+
+        Assertions:
+        - Added habits appear in the sorted choices, and checked-off habits leave the uncompleted choices
+        - Without a change in between, a refresh only asks SQLite for the data version
+        - Deleted habits leave the choices
+        """
+        db_name = str(tmp_path / "choices.db")
+        database.connect_db(db_name)
+        for habit in ("Running", "Reading", "Yoga"):
+            model.Habit(habit, "Stay healthy", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        choices = get.habit_choices(db_name)
+        assert choices.habits == choices.uncompleted == ["Reading", "Running", "Yoga"]
+
+        model.Habit("Reading").update_streak(db_name, current_date="01 Jan 2023")
+        statements = []
+        choices.db.set_trace_callback(statements.append)
+        assert get.habit_choices(db_name).uncompleted == ["Running", "Yoga"]
+        get.habit_choices(db_name)
+        assert statements[-1] == "PRAGMA data_version"
+        assert len(statements) == 3
+
+        model.Habit("Yoga").delete_habit(db_name)
+        assert get.habit_choices(db_name).habits == ["Reading", "Running"]
+
+
+class TestNormalizedState:
+    def test_habitlog_is_a_view(self, tmp_path):
+        """
+        Test that the habitlog of an existing database is replaced by a view of the habitbase.
+
+        Assertions:
+        - The migration drops the old habitlog table and the view shows the state of the habitbase
+        - A check-off changes the completion status, the streak and the log in one transaction
+        """
+        db_name = str(tmp_path / "normalized.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        db.execute("DROP VIEW habitlog")
+        db.execute("CREATE TABLE habitlog (habit TEXT, completed INT, streak INTEGER, datetime_completed TIME, max_streak INTEGER)")
+        db.execute("INSERT INTO habitlog VALUES ('Reading', 1, 0, NULL, 0)")
+        db.execute("PRAGMA user_version = 5")
+        db.commit()
+        db = database.connect_db(db_name)
+        assert db.execute("SELECT type FROM sqlite_master WHERE name = 'habitlog'").fetchone() == ("view",)
+
+        statements = []
+        db.set_trace_callback(statements.append)
+        database.check_off_habit(db, "Reading", "02 Jan 2023")
+        assert len([statement for statement in statements if statement.startswith("UPDATE habitbase")]) == 1
+        assert statements.count("COMMIT") == 1
+        assert repr(database.all_log(db)) == "[(Reading, 2, 1, 02 Jan 2023, 1)]"
+
+
+class TestHabitIds:
+    def test_legacy_database_gets_integer_ids(self, tmp_path):
+        """
+        Test that a database keyed by habit names is migrated to integer ids.
+
+        Assertions:
+        - Every habit gets an id in the order it was added, and names differing only in case are made unique
+        - The history is kept and the statistics are rebuilt from it
+        """
+        db_name = str(tmp_path / "legacy.db")
+        db = database.sqlite3.connect(db_name)
+        db.execute("""CREATE TABLE habitbase (habit TEXT PRIMARY KEY, description TEXT, periodicity TEXT, starting_date TEXT,
+            startdate_weekly TEXT, completed INTEGER, datetime_completed TEXT, streak INTEGER, max_streak INTEGER)""")
+        db.execute("CREATE TABLE habit_history (habit TEXT, day INTEGER, event TEXT)")
+        db.execute("CREATE TABLE habit_stats (habit TEXT PRIMARY KEY, periodicity TEXT, completions INTEGER, resets INTEGER, streak INTEGER, max_streak INTEGER, last_completed INTEGER, started INTEGER)")
+        db.execute("INSERT INTO habitbase VALUES ('Reading', 'Read', 'Daily', '01 Jan 2023', NULL, 2, '02 Jan 2023', 2, 2)")
+        db.execute("INSERT INTO habitbase VALUES ('reading', 'Read more', 'Daily', '01 Jan 2023', NULL, 1, NULL, 0, 0)")
+        day = datetime.date(2023, 1, 1).toordinal()
+        db.executemany("INSERT INTO habit_history VALUES ('Reading', ?, 'completed')", [(day,), (day + 1,)])
+        db.execute("PRAGMA user_version = 6")
+        db.commit()
+        db.close()
+
+        db = database.connect_db(db_name)
+        assert [(habit.id, habit.habit) for habit in database.all_habits(db)] == [(1, "Reading"), (2, "reading2")]
+        assert database.history_days(db, "READING") == [day, day + 1]
+        assert analytics.habit_stats(db, "Reading").completions == 2
+        assert database.habit_stats_drift(db) == []
+        assert db.execute("SELECT name FROM sqlite_master WHERE name LIKE 'legacy_%'").fetchall() == []
+
+    def test_baseline_database_opens(self, tmp_path):
+        """
+        Test that a database created by the first version of the tracker, with only the habitbase and the habitlog, is migrated.
+
+        Assertions:
+        - Opening it does not fail, although it has no history yet
+        - The habits and their streaks are kept and the derived tables are built from them
+        """
+        db_name = str(tmp_path / "baseline.db")
+        db = database.sqlite3.connect(db_name)
+        db.execute("""CREATE TABLE habitbase (habit TEXT PRIMARY KEY, description TEXT, periodicity TEXT, starting_date TEXT,
+            startdate_weekly TEXT, completed INTEGER, datetime_completed TEXT, streak INTEGER, max_streak INTEGER)""")
+        db.execute("""CREATE TABLE habitlog (habit TEXT, completed INT, streak INTEGER DEFAULT 0, datetime_completed TIME,
+            max_streak INTEGER DEFAULT 0, FOREIGN KEY (habit) REFERENCES habitbase(habit))""")
+        db.execute("INSERT INTO habitbase VALUES ('Reading', 'Read', 'Daily', '01 Jan 2023', NULL, 2, '02 Jan 2023', 2, 2)")
+        db.execute("INSERT INTO habitbase VALUES ('Cycling', 'Cycle', 'Weekly', '01 Jan 2023', '01 Jan 2023', 1, NULL, 0, 0)")
+        db.execute("INSERT INTO habitlog VALUES ('Reading', 2, 2, '02 Jan 2023', 2)")
+        db.commit()
+        db.close()
+
+        db = database.connect_db(db_name)
+        assert db.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+        assert [(habit.habit, habit.periodicity, habit.streak) for habit in database.all_habits(db)] == [("Reading", "Daily", 2), ("Cycling", "Weekly", 0)]
+        assert analytics.habit_stats(db, "Reading").max_streak == 2
+        assert [habit for _, habit in database.habit_deadlines(db)] == ["Reading", "Cycling"]
+        assert database.habit_stats_drift(db) == []
+
+    def test_rename_keeps_history(self, tmp_path):
+        """
+        Test that habits are found regardless of case and that a rename keeps everything attached to the habit.
+
+        Assertions:
+        - A second habit with the same name in another case is rejected
+        - After a rename the statistics, the history and the search index follow the new name
+        """
+        db_name = str(tmp_path / "rename.db")
+        db = database.connect_db(db_name)
+        reading = model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023")
+        reading.add_habit(db_name)
+        database.check_off_habit(db, "reading", "01 Jan 2023")
+        assert database.habit_id(db, "READING") == reading.id
+        with pytest.raises(database.sqlite3.IntegrityError):
+            model.Habit("reading", "Again", "Daily").add_habit(db_name)
+        search.index_of(db)
+
+        reading.rename(db_name, "Reading Books")
+        assert database.habit_by_id(db, reading.id).habit == "Reading Books"
+        assert analytics.habit_stats(db, "Reading Books").completions == 1
+        assert database.history_days(db, "reading books") == [datetime.date(2023, 1, 1).toordinal()]
+        assert analytics.habit_stats(db, "Reading") is None
+        assert search.index_of(db).search("read") == ["Reading Books"]
+
+    def test_habit_state_is_read_by_id(self, tmp_path):
+        """
+        Test that the state of a habit is read by its id, and that a habit created from its name looks the id up once.
+
+        Assertions:
+        - A habit created from its name in another case checks off the stored habit and keeps its id
+        - The readers take the id and keep answering after a rename
+        """
+        db_name = str(tmp_path / "ids.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        reading = model.Habit("reading")
+        assert reading.update_streak(db_name, current_date="01 Jan 2023")
+        assert reading.id == database.habit_id(db, "Reading")
+
+        database.rename_habit(db, reading.id, "Reading Books")
+        assert database.streak_count(db, reading.id) == database.max_streak_count(db, reading.id) == 1
+        assert database.habit_completed_check(db, reading.id) == model.Completion.COMPLETED
+        assert database.habit_completed_time(db, reading.id) == "01 Jan 2023"
+        assert (database.periodicity_of_habit(db, reading.id), database.get_starting_date(db, reading.id)) == ("Daily", "01 Jan 2023")
+
+
+class TestCompactEncoding:
+    def test_periodicity_labels_become_ids(self, tmp_path):
+        """
+        Test that the periodicity labels of an existing database are replaced by ids of the periodicities table.
+
+        Assertions:
+        - Every label is stored once and the habits read back with their labels
+        - The statistics are keyed by the periodicity id and match a recomputation
+        """
+        db_name = str(tmp_path / "labels.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        db.execute("DROP VIEW habitlog")
+        db.execute("DROP INDEX habitbase_periodicity")
+        db.execute("DROP TABLE periodicity_stats")
+        db.execute("CREATE TABLE periodicity_stats (periodicity TEXT PRIMARY KEY, habits INTEGER, completions INTEGER, resets INTEGER)")
+        db.execute("ALTER TABLE habitbase ADD COLUMN periodicity TEXT")
+        db.execute("UPDATE habitbase SET periodicity = 'Weekly', periodicity_id = NULL")
+        db.execute("ALTER TABLE habitbase DROP COLUMN periodicity_id")
+        db.execute("INSERT INTO habitbase (habit, description, periodicity, starting_date, completed, streak, max_streak) VALUES ('Yoga', 'Stretch', 'Weekly', '01 Jan 2023', 1, 0, 0)")
+        db.execute("DELETE FROM periodicities")
+        db.execute("PRAGMA user_version = 7")
+        db.commit()
+
+        db = database.connect_db(db_name)
+        assert db.execute("SELECT id, label FROM periodicities").fetchall() == [(1, "Weekly")]
+        assert [habit.periodicity for habit in database.certain_periodicity(db, "Weekly")] == ["Weekly", "Weekly"]
+        assert [(stats.periodicity, stats.habits) for stats in analytics.periodicity_stats(db)] == [("Weekly", 2)]
+        assert database.habit_stats_drift(db) == []
+
+    def test_completion_status_is_an_enum(self, tmp_path):
+        """
+        Test that the completion status reads back as a Completion and that the uncompleted habits come from the partial index.
+
+        Assertions:
+        - The status of a checked off habit is Completion.COMPLETED
+        - The query for uncompleted habits only reads the partial index
+        """
+        db_name = str(tmp_path / "status.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Yoga", "Stretch", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        database.complete_habit(db, "Yoga")
+        assert {habit.habit: habit.completed for habit in database.all_habits(db)} == {
+            "Reading": model.Completion.UNCOMPLETED, "Yoga": model.Completion.COMPLETED}
+        assert database.collect_uncompleted_habits_choices(db) == ["Reading"]
+        plan = db.execute(f"EXPLAIN QUERY PLAN SELECT habit FROM habitbase WHERE completed = {model.Completion.UNCOMPLETED:d}").fetchall()
+        assert "habitbase_uncompleted" in plan[0][3]
+
+
+class TestAtomicCheckOff:
+    def test_check_off_is_one_guarded_update(self, tmp_path):
+        """
+        Test that a check-off increments the streak in one statement and that a second check-off in the same period is a no-op.
+
+        Assertions:
+        - The check-off writes the habitbase with a single UPDATE and no reads of the streak beforehand
+        - A second connection checking off the same day changes nothing, the next day counts again
+        - The weekly habit is only counted once per week, regardless of the completion flag
+        """
+        db_name = str(tmp_path / "atomic.db")
+        db = database.connect_db(db_name)
+        other = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="02 Jan 2023").add_habit(db_name)
+
+        statements = []
+        db.set_trace_callback(statements.append)
+        assert database.check_off_habit(db, "reading", "01 Jan 2023") == (1, 1)
+        db.set_trace_callback(None)
+        assert [statement for statement in statements if "FROM habitbase" in statement or statement.startswith("UPDATE habitbase")][0].startswith("UPDATE habitbase")
+        assert not [statement for statement in statements if statement.startswith("SELECT")]
+        assert database.check_off_habit(other, "Reading", "01 Jan 2023") is None
+        assert database.check_off_habit(other, "Reading", "02 Jan 2023") == (2, 2)
+        assert database.history_days(db, "Reading") == [datetime.date(2023, 1, 1).toordinal(), datetime.date(2023, 1, 2).toordinal()]
+
+        assert database.check_off_habit(db, "Cycling", "03 Jan 2023") == (1, 1)
+        database.uncomplete_habit(db, "Cycling")
+        assert database.check_off_habit(db, "Cycling", "05 Jan 2023") == (2, 2)
+        assert database.check_off_habit(db, "Cycling", "08 Jan 2023") is None
+        assert database.check_off_habit(db, "Cycling", "09 Jan 2023") == (3, 3)
+
+    def test_parallel_check_offs_count_once(self, tmp_path):
+        """
+        Test that check-offs running at the same time on separate connections complete a period once.
+
+        Assertions:
+        - Of eight parallel check-offs of a daily habit on the same day exactly one completes it
+        - Of five parallel check-offs of a habit with three check-offs per week three are recorded and one completes the week
+        - The history and the statistics hold exactly the recorded check-offs
+        """
+        db_name = str(tmp_path / "parallel.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Swimming", "Swim 1 km", "3 Times Per Week", starting_date="02 Jan 2023").add_habit(db_name)
+
+        def check_off_in_parallel(habit, count):
+            barrier = threading.Barrier(count)
+            results = []
+            def check_off():
+                connection = database.connect_db(db_name)
+                barrier.wait()
+                results.append(database.submit_check_off(connection, habit, "04 Jan 2023"))
+                connection.close()
+            threads = [threading.Thread(target=check_off) for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return results
+
+        results = check_off_in_parallel("Reading", 8)
+        assert [result["completed"] for result in results].count(True) == 1
+        results = check_off_in_parallel("Swimming", 5)
+        assert ([result["recorded"] for result in results].count(True), [result["completed"] for result in results].count(True)) == (3, 1)
+
+        day = datetime.date(2023, 1, 4).toordinal()
+        assert database.history_days(db, "Reading") == [day]
+        assert database.history_days(db, "Swimming") == [day] * 3
+        assert database.streak_count(db, database.habit_id(db, "Swimming")) == 1
+        assert (analytics.habit_stats(db, "Reading").completions, analytics.habit_stats(db, "Swimming").completions) == (1, 3)
+        assert database.habit_stats_drift(db) == []
+
+
+class TestIdempotentCheckOff:
+    def test_retried_request_returns_the_stored_result(self, tmp_path):
+        """
+        Test that a check-off retried with the same request id is answered from the stored result.
+
+        Assertions:
+        - The retry returns the result of the first check-off and does not touch the habitbase
+        - The habit history holds the check-off once
+        - A request id is only purged after its time to live
+        """
+        db_name = str(tmp_path / "requests.db")
+        db = database.connect_db(db_name)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        first = database.submit_check_off(db, "Reading", "01 Jan 2023", "req-1")
+        assert first == {"recorded": True, "completed": True, "streak": 1, "max_streak": 1}
+
+        statements = []
+        db.set_trace_callback(statements.append)
+        assert database.submit_check_off(db, "Reading", "02 Jan 2023", "req-1") == first
+        db.set_trace_callback(None)
+        assert not [statement for statement in statements if "habitbase" in statement]
+        assert database.history_days(db, "Reading") == [datetime.date(2023, 1, 1).toordinal()]
+        assert model.Habit("Reading").update_streak(db_name, "02 Jan 2023", request_id="req-2")
+        assert database.streak_count(db, database.habit_id(db, "Reading")) == 2
+
+        created = db.execute("SELECT created FROM request_results WHERE request_id = 'req-1'").fetchone()[0]
+        assert database.purge_request_results(db, now=created + database.REQUEST_TTL) == 0
+        assert database.purge_request_results(db, now=created + database.REQUEST_TTL + 60) == 2
+        assert database.request_result(db, "req-1") is None
+
+    def test_check_off_command_rejects_bad_days(self, runner, tmp_path, monkeypatch):
+        """
+        Test that the check-off command only accepts days from the last completion until today.
+
+        Assertions:
+        - A day in the future and a day before the last completion are rejected with exit code 2
+        - A back-dated check-off after the rollover does not move the last completion backwards
+        - A request id whose result is no longer known fails with exit code 1 instead of an error
+        """
+        monkeypatch.chdir(tmp_path)
+        db = database.connect_db()
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit("habit.db")
+        reading = database.habit_id(db, "Reading")
+        with freeze_time("2023-01-05", ignore=["typer"]):
+            assert runner.invoke(cli.app, ["check-off", "reading", "--date", "2023-01-04"]).exit_code == 0
+            assert runner.invoke(cli.app, ["check-off", "Reading", "--date", "2023-01-06"]).exit_code == 2
+            assert runner.invoke(cli.app, ["check-off", "Reading", "--date", "2023-01-03"]).exit_code == 2
+        assert database.habit_completed_time(db, reading) == "04 Jan 2023"
+
+        database.uncomplete_habit(db, reading)
+        assert not database.submit_check_off(db, reading, "03 Jan 2023")["recorded"]
+        assert database.habit_completed_time(db, reading) == "04 Jan 2023"
+
+        db.execute("INSERT INTO request_results VALUES ('req-lost', NULL, 0)")
+        db.commit()
+        with freeze_time("2023-01-05", ignore=["typer"]):
+            result = runner.invoke(cli.app, ["check-off", "Reading", "--request-id", "req-lost"])
+        assert result.exit_code == 1 and "no longer known" in result.stdout
+
+
+class TestWriteQueue:
+    def test_concurrent_mutations_share_one_commit(self, tmp_path, monkeypatch):
+        """
+        Test that the mutations of concurrent clients are committed together and every client gets its own result.
+
+        Assertions:
+        - A batch of additions and check-offs is committed once
+        - Every caller gets the result of its own mutation, a failing one only gets its error
+        - The committed state matches one transaction per mutation
+        """
+        db_name = str(tmp_path / "queue.db")
+        database.connect_db(db_name).close()
+        batches = []
+        apply_writes = database.apply_writes
+        monkeypatch.setattr(database, "apply_writes", lambda db, writes: batches.append(len(writes)) or apply_writes(db, writes))
+
+        async def clients():
+            queue = writes.WriteQueue(db_name, window=0.05)
+            reading, cycling = await asyncio.gather(queue.add("Reading", "Read 20 pages", "Daily", "01 Jan 2023"),
+                queue.add("Cycling", "Cycle to work", "Daily", "01 Jan 2023"))
+            results = await asyncio.gather(queue.check_off("Reading", "01 Jan 2023", "req-1"), queue.check_off("Reading", "01 Jan 2023", "req-1"),
+                queue.check_off("Cycling", "01 Jan 2023"), queue.add("reading", "Taken", "Daily", "01 Jan 2023"), return_exceptions=True)
+            await queue.close()
+            return reading, cycling, results
+
+        reading, cycling, results = asyncio.run(clients())
+        assert (reading, cycling) == (1, 2)
+        assert batches == [2, 4]
+        assert results[0] == results[1] == {"recorded": True, "completed": True, "streak": 1, "max_streak": 1}
+        assert results[2]["streak"] == 1
+        assert isinstance(results[3], database.sqlite3.IntegrityError)
+        db = database.connect_db(db_name)
+        assert [habit.habit for habit in database.all_habits(db)] == ["Reading", "Cycling"]
+        assert database.history_days(db, "Reading") == [datetime.date(2023, 1, 1).toordinal()]
+
+    def test_daemon_commits_the_changes_of_clients(self, runner, tmp_path, monkeypatch):
+        """
+        Test that the write server of the daemon batches the changes its clients send over the socket.
+
+        Assertions:
+        - The changes of concurrent clients share one commit and every client gets its own result
+        - The check-off command sends its check-off to the daemon when given its socket
+        - Changes for a database the daemon does not serve and unknown operations are rejected
+        """
+        monkeypatch.chdir(tmp_path)
+        database.connect_db().close()
+        path = str(tmp_path / "daemon.sock")
+        batches = []
+        apply_writes = database.apply_writes
+        monkeypatch.setattr(database, "apply_writes", lambda db, writes: batches.append(len(writes)) or apply_writes(db, writes))
+        today = datetime.date.today().strftime("%d %b %Y")
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        server = writes.WriteServer(path, ["habit.db"], window=0.05)
+        try:
+            asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+            clients = [threading.Thread(target=lambda habit=habit: results.append(writes.submit(path, "habit.db", "add", habit, "", "Daily", today, None, 1, None, 0, 0)))
+                for habit in ("Reading", "Cycling")]
+            results = []
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            assert sorted(results) == [1, 2]
+            assert batches == [2]
+
+            result = runner.invoke(cli.app, ["check-off", "reading", "--socket", path])
+            assert result.exit_code == 0 and "Your streak is 1" in result.stdout
+            assert batches == [2, 1]
+
+            with pytest.raises(RuntimeError, match="does not serve"):
+                writes.submit(path, "other.db", "delete", "Reading")
+            with pytest.raises(RuntimeError, match="Unknown operation"):
+                writes.submit(path, "habit.db", "drop", "Reading")
+        finally:
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+        db = database.connect_db()
+        assert database.streak_count(db, database.habit_id(db, "Reading")) == 1
+        assert database.streak_count(db, database.habit_id(db, "Cycling")) == 0
+
+
+class TestQueryCache:
+    def test_identical_queries_share_one_execution(self, tmp_path):
+        """
+        Test that concurrent identical analytics queries run once and that a commit invalidates their result.
+
+        Assertions:
+        - Readers asking at the same time share the result of one execution
+        - A commit by another connection makes the next reader run the query again
+        - After its time to live a result is still served while one reader revalidates it
+        """
+        import threading
+        db_name = str(tmp_path / "cache.db")
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        now = [0.0]
+        query_cache = cache.QueryCache(ttl=5.0, stale=30.0, clock=lambda: now[0])
+        started, release, runs = threading.Event(), threading.Event(), []
+
+        def slow_query(db):
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return [habit.habit for habit in analytics.all_habits_information.uncached(db)]
+
+        results = []
+        readers = [threading.Thread(target=lambda: results.append(query_cache.get(database.connect_db(db_name), slow_query))) for _ in range(8)]
+        readers[0].start()
+        started.wait(5)
+        for reader in readers[1:]:
+            reader.start()
+        release.set()
+        for reader in readers:
+            reader.join()
+        assert len(runs) == 1 and results == [["Reading"]] * 8
+
+        model.Habit("Cycling", "Cycle to work", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        db = database.connect_db(db_name)
+        assert query_cache.get(db, slow_query) == ["Reading", "Cycling"] and len(runs) == 2
+        now[0] = 10.0
+        assert query_cache.get(db, slow_query) == ["Reading", "Cycling"] and len(runs) == 3
+        assert query_cache.get(db, slow_query) == ["Reading", "Cycling"] and len(runs) == 3
+        query_cache.clear()
+
+    def test_outdated_results_are_evicted(self, tmp_path):
+        """
+        Test that the cache does not grow with the commits to a database or the number of queries.
+
+        Assertions:
+        - A result of a new version of the file replaces the results of the older versions
+        - The results of other database files are kept
+        - Beyond its size the oldest results are dropped
+        """
+        reading, cycling = str(tmp_path / "reading.db"), str(tmp_path / "cycling.db")
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(reading)
+        model.Habit("Cycling", "Cycle to work", "Daily", starting_date="01 Jan 2023").add_habit(cycling)
+        query_cache = cache.QueryCache(max_entries=3)
+
+        def names(db, suffix=""):
+            return [habit.habit + suffix for habit in analytics.all_habits_information.uncached(db)]
+
+        db, other = database.connect_db(reading), database.connect_db(cycling)
+        query_cache.get(other, names)
+        for count in range(3):
+            model.Habit(f"Habit {count}", "", "Daily", starting_date="01 Jan 2023").add_habit(reading)
+            query_cache.get(db, names)
+            query_cache.get(db, names, "!")
+        assert sorted(key[2] for key in query_cache.entries if key[0] == reading) == [(), ("!",)]
+        assert len(query_cache.entries) == 3
+
+        query_cache.get(db, names, "?")
+        assert len(query_cache.entries) == 3
+        assert all(key[0] == reading for key in query_cache.entries)
+        query_cache.clear()
+
+
+class TestRolloverWatermark:
+    def test_rollover_runs_once_per_day(self, tmp_path):
+        """
+        Test that a second rollover of the same day is skipped after reading the watermark.
+
+        Assertions:
+        - The second rollover of a day only reads the time zones and the watermark from the settings
+        - The next day, or a new time zone, is rolled over again
+        """
+        db_name = str(tmp_path / "watermark.db")
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+        model.Habit("Reading").update_streak(db_name, current_date="01 Jan 2023")
+        db = database.connect_db(db_name)
+        with freeze_time("2023-01-02"):
+            cli.update_check_results(db_name)
+            assert database.habit_completed_check(db, database.habit_id(db, "Reading")) == model.Completion.UNCOMPLETED
+            statements = []
+            original = database.connect_db
+            def traced(name=None):
+                connection = original(name)
+                connection.set_trace_callback(statements.append)
+                return connection
+            with pytest.MonkeyPatch.context() as patch:
+                patch.setattr(database, "connect_db", traced)
+                cli.update_check_results(db_name)
+            assert statements and all(statement.startswith("SELECT") and "FROM settings" in statement for statement in statements)
+            assert database.rollover_pending(db, {"Pacific/Kiritimati": datetime.date(2023, 1, 2).toordinal()})
+        with freeze_time("2023-01-04"):
+            cli.update_check_results(db_name)
+        assert database.streak_count(db, database.habit_id(db, "Reading")) == 0
+
+
+class TestRolloverPlan:
+    def test_dry_run_plans_and_apply_writes_once(self, runner, tmp_path, monkeypatch):
+        """
+        Test that the rollover is planned without writing and then applied in one transaction.
+
+        Assertions:
+        - The plan lists the reset, the uncompleted habits, the window move and the missed periods
+        - 'rollover --dry-run' prints the plan and leaves the database unchanged
+        - Applying the plan commits once and moves the rollover watermark
+        """
+        monkeypatch.chdir(tmp_path)
+        model.Habit("Reading", "Read 20 pages", "Daily", starting_date="01 Jan 2023").add_habit("habit.db")
+        model.Habit("Cycling", "Cycle to work", "Weekly", starting_date="02 Jan 2023").add_habit("habit.db")
+        model.Habit("Reading").update_streak("habit.db", current_date="02 Jan 2023")
+        model.Habit("Cycling").update_streak("habit.db", current_date="03 Jan 2023")
+        db = database.connect_db()
+        # typer has to keep the real datetime class to build the options of the commands.
+        with freeze_time("2023-01-10", ignore=["typer"]):
+            plan = cli.plan_rollover()
+            assert (plan.resets, sorted(plan.uncompletes)) == (["Reading"], ["Cycling", "Reading"])
+            assert plan.window_moves == [("Cycling", datetime.date(2023, 1, 9).toordinal())]
+            assert [habit for habit, _ in plan.missed] == ["Reading"]
+
+            result = runner.invoke(cli.app, ["rollover", "--dry-run"])
+            assert result.exit_code == 0 and "Window moves to 09 Jan 2023" in result.stdout and "7 missed periods recorded" in result.stdout
+            assert database.streak_count(db, database.habit_id(db, "Reading")) == 1 and database.rollover_pending(db, plan.local_days)
+
+            commits = []
+            apply_rollover = database.apply_rollover
+            monkeypatch.setattr(database, "apply_rollover", lambda db, plan: commits.append(plan) or apply_rollover(db, plan))
+            cli.update_check_results()
+            assert len(commits) == 1
+            assert database.streak_count(db, database.habit_id(db, "Reading")) == 0
+            assert database.get_startdate_weekly(db, database.habit_id(db, "Cycling")) == "09 Jan 2023"
+            assert not database.rollover_pending(db, plan.local_days)
+
+
+    def test_apply_leaves_habits_changed_since_planning_alone(self, tmp_path):
+        """
+        Test that a habit checked off between planning and applying the rollover is not reset.
+
+        Assertions:
+        - The checked-off habit keeps its streak and stays completed, while the other habit is reset
+        - The watermark does not move, so the next rollover plans the changed habit again
+        """
+        db_name = str(tmp_path / "stale.db")
+        for habit in ["Reading", "Cycling"]:
+            model.Habit(habit, "Every day", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+            model.Habit(habit).update_streak(db_name, current_date="01 Jan 2023")
+        db = database.connect_db(db_name)
+        with freeze_time("2023-01-05"):
+            plan = cli.plan_rollover(db_name)
+            assert sorted(plan.resets) == ["Cycling", "Reading"]
+            database.check_off_habit(db, "Reading", "05 Jan 2023")
+            assert database.apply_rollover(db, plan) == ["Reading"]
+            assert database.streak_count(db, database.habit_id(db, "Reading")) == 2
+            assert database.habit_completed_check(db, database.habit_id(db, "Reading")) == model.Completion.COMPLETED
+            assert database.streak_count(db, database.habit_id(db, "Cycling")) == 0
+            assert database.rollover_pending(db, plan.local_days)
+            cli.update_check_results(db_name)
+            assert not database.rollover_pending(db, plan.local_days)
+
+    def test_rollover_plans_changed_habits_again(self, tmp_path, monkeypatch):
+        """
+        Test that the rollover plans a habit again if it changed between planning and applying.
+
+        Assertions:
+        - The habit checked off in between is not due anymore when planned again and keeps its streak
+        - The watermark moves once the second plan is applied
+        """
+        db_name = str(tmp_path / "replan.db")
+        for habit in ["Reading", "Cycling"]:
+            model.Habit(habit, "Every day", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+            model.Habit(habit).update_streak(db_name, current_date="01 Jan 2023")
+        db = database.connect_db(db_name)
+        apply_rollover, plans = database.apply_rollover, []
+        def check_off_first(connection, plan):
+            if not plans:
+                database.check_off_habit(db, "Reading", "05 Jan 2023")
+            plans.append(plan)
+            return apply_rollover(connection, plan)
+        monkeypatch.setattr(database, "apply_rollover", check_off_first)
+        with freeze_time("2023-01-05"):
+            cli.update_check_results(db_name)
+            assert [plan.statuses for plan in plans] == [[(schedules.BROKEN, "Cycling"), (schedules.BROKEN, "Reading")], []]
+            assert (database.streak_count(db, database.habit_id(db, "Reading")), database.streak_count(db, database.habit_id(db, "Cycling"))) == (2, 0)
+            assert not database.rollover_pending(db, plans[0].local_days)
+
+class TestRolloverSummary:
+    def test_summary_is_one_render_with_capped_lists(self, tmp_path, monkeypatch):
+        """
+        Test that the rollover prints one summary with the counts per status and a capped list of broken habits.
+
+        Assertions:
+        - The whole summary is printed with a single call to the console
+        - Only the first broken habits are listed by default and all of them with verbose
+        """
+        db_name = str(tmp_path / "summary.db")
+        habits = [f"Habit{number:02d}" for number in range(15)]
+        for habit in habits:
+            model.Habit(habit, "Every day", "Daily", starting_date="01 Jan 2023").add_habit(db_name)
+            model.Habit(habit).update_streak(db_name, current_date="01 Jan 2023")
+        summary = cli.rollover_summary(db_name, model.RolloverPlan({None: 0}, [(schedules.BROKEN, habit, None, []) for habit in habits]))
+        printed = []
+        monkeypatch.setattr(cli.console, "print", lambda *renderables: printed.append(renderables))
+        with freeze_time("2023-01-05"):
+            cli.update_check_results(db_name)
+        assert len(printed) == 1
+        lines = [line.plain for line in printed[0][0].renderables]
+        assert "0 checked off, 0 in a new period, 0 not checked off yet, 15 broken" in lines[0]
+        assert lines[1].endswith("Habit09 and 5 more") and lines == [line.plain for line in summary.renderables]
+        verbose = cli.rollover_summary(db_name, model.RolloverPlan({None: 0}, [(schedules.BROKEN, habit, None, []) for habit in habits]), verbose=True)
+        assert verbose.renderables[1].plain.endswith("Habit14")
+